@@ -0,0 +1,165 @@
+#!/usr/bin/python
+
+import os
+import gzip
+import Queue
+import threading
+
+"""
+##################################################################################################################
+##########################################   Batch Writer   ####################################################
+##################################################################################################################
+
+* Shared output layer for every parser writing to csv_out/.
+* Rows passed to write() are gathered in a list and handed to the outfile with one writelines() call
+    per ~4MB batch, instead of one write() call per row (or two, for forward and reverse edges).
+* Outfiles whose path ends in .gz are gzip compressed, neo4j-import reads them directly.
+    Batches are compressed on a background thread (zlib releases the GIL), so parsing continues meanwhile.
+* Parsers set compressOutputs with their -z option; getOutputPath() then appends .gz to outfile names.
+* After stageOutputs(outDir, stagingDir) (buildAll.py), outfiles of outDir are written to stagingDir instead and
+    moved into outDir by publishOutputs() once complete, one rename each, so outDir never holds a partly written
+    outfile. BuildManifest.record() publishes the outfiles of every output key it records.
+"""
+
+BUFFER_SIZE = 1 << 22  # bytes gathered before a batch is flushed
+QUEUE_DEPTH = 4  # batches waiting for the compression thread before write() blocks
+COMPRESS_LEVEL = 6
+
+compressOutputs = False  # set by the parsers' -z option
+stagingState = dict()  # outDir and stagingDir while outfiles are staged; inherited by forked workers
+
+
+def getOutputPath(path):
+    """ Returns outfile path, with .gz appended when compressOutputs is set """
+    if compressOutputs and not path.endswith('.gz'):
+        return path + '.gz'
+    return path
+
+
+def openOutput(path, mode='w'):
+    """ Returns BatchWriter for getOutputPath(path), mode is 'w' or 'a' """
+    return BatchWriter(getOutputPath(path), mode)
+
+
+def stageOutputs(outDir, stagingDir):
+    """ Writes outfiles of outDir to stagingDir, on the same file system, until publishOutputs() moves them """
+    if not os.path.isdir(stagingDir):
+        os.makedirs(stagingDir)
+    stagingState.update(outDir=os.path.abspath(outDir), stagingDir=os.path.abspath(stagingDir))
+
+
+def getWritePath(path):
+    """ Returns path an outfile is written to: its staging path while outfiles of its directory are staged """
+    if stagingState and os.path.dirname(os.path.abspath(path)) == stagingState['outDir']:
+        return os.path.join(stagingState['stagingDir'], os.path.basename(path))
+    return path
+
+
+def publishOutputs(paths):
+    """ Moves staged outfiles of paths into place, replacing the previous outfiles """
+    for path in paths:
+        writePath = getWritePath(path)
+        if writePath != path and os.path.isfile(writePath):
+            os.rename(writePath, path)
+
+
+class BatchWriter(object):
+    """
+    File like writer gathering rows into batches of about bufferSize bytes.
+    Paths ending in .gz are written through gzip on a background thread.
+    Supports write(), writelines(), flush(), close() and use as a context manager.
+    """
+    def __init__(self, path, mode='w', bufferSize=BUFFER_SIZE):
+        self.path = path
+        self.bufferSize = bufferSize
+        self.buffer = []
+        self.bufferedBytes = 0
+        self.closed = False
+        self.openFile(mode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def openFile(self, mode):
+        """ Opens the outfile (its staging path while staged), and starts the compression thread for .gz paths """
+        self.error = None
+        writePath = getWritePath(self.path)
+        if self.path.endswith('.gz'):
+            self.outFile = gzip.open(writePath, mode.replace('b', '') + 'b', COMPRESS_LEVEL)
+            self.queue = Queue.Queue(QUEUE_DEPTH)
+            self.thread = threading.Thread(target=self.compressBatches)
+            self.thread.daemon = True
+            self.thread.start()
+        else:
+            self.outFile = open(writePath, mode)
+            self.queue = None
+            self.thread = None
+
+    def closeFile(self):
+        """ Waits for the compression thread to finish pending batches, then closes the outfile """
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+        self.outFile.close()
+        self.checkError()
+
+    def compressBatches(self):
+        """ Compression thread: writes queued batches through gzip until None is queued """
+        batch = self.queue.get()
+        while batch is not None:
+            if self.error is None:
+                try:
+                    self.outFile.write(''.join(batch))
+                except Exception as error:
+                    self.error = error  # raised in the writing thread, batches are drained so it never blocks
+            batch = self.queue.get()
+
+    def checkError(self):
+        """ Re-raises an error hit by the compression thread """
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def write(self, string):
+        """ Adds string to the current batch, flushes once bufferSize bytes are gathered """
+        self.buffer.append(string)
+        self.bufferedBytes += len(string)
+        if self.bufferedBytes >= self.bufferSize:
+            self.flush()
+
+    def writelines(self, strings):
+        """ Adds every string of iterable strings to the current batch """
+        for string in strings:
+            self.write(string)
+
+    def flush(self):
+        """ Hands the current batch to the outfile, or to the compression thread """
+        if not self.buffer:
+            return
+        batch = self.buffer
+        self.buffer = []
+        self.bufferedBytes = 0
+        if self.queue:
+            self.checkError()
+            self.queue.put(batch)
+        else:
+            self.outFile.writelines(batch)
+
+    def truncate(self):
+        """ Discards everything written so far, the outfile starts over empty """
+        self.buffer = []
+        self.bufferedBytes = 0
+        self.closeFile()
+        self.openFile('w')
+
+    def close(self):
+        """ Flushes the last batch and closes the outfile """
+        if self.closed:
+            return
+        self.closed = True
+        self.flush()
+        self.closeFile()
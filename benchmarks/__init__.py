@@ -0,0 +1,9 @@
+"""
+##################################################################################################################
+##########################################   Benchmarks   ######################################################
+##################################################################################################################
+
+* generators.py writes seeded synthetic corpora in every upstream format, scaled to a target size.
+* runner.py times the real parser entry points on those corpora and records wall time, rows/sec and peak RSS as JSON.
+* compare.py flags regressions between two runner.py result files.
+"""
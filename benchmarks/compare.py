@@ -0,0 +1,100 @@
+#!/usr/bin/python
+
+import sys
+import json
+import getopt
+
+"""
+##################################################################################################################
+##########################################   Benchmark Compare   ###############################################
+##################################################################################################################
+
+* Compares two runner.py result files, matching results by benchmark name and size.
+* A benchmark regresses when its wall time or peak RSS grows by more than the threshold (default 10%),
+    or when it fails in the new file but not in the old one.
+* Exits with status 1 if any benchmark regressed, so it can gate a build.
+* Run as: python benchmarks/compare.py old.json new.json [-t 0.10] [-m 0.10]
+"""
+
+
+def loadResults(path):
+    """ Returns dict of (benchmark, sizeMB) to result dict from a runner.py result file """
+    with open(path, 'r') as resultFile:
+        report = json.load(resultFile)
+    return dict(((result['benchmark'], result['sizeMB']), result) for result in report['results'])
+
+
+def getChange(old, new):
+    """ Returns relative change from old to new, None when old is zero """
+    if not old:
+        return None
+    return (new - old) / float(old)
+
+
+def compareResults(oldResults, newResults, timeThreshold, memoryThreshold):
+    """ Prints one line per benchmark present in both files, returns number of regressions """
+    regressionCount = 0
+    print "%-16s %8s %10s %10s %8s %12s %12s %8s" % ('benchmark', 'size MB', 'old s', 'new s', 'time',
+                                                    'old KB', 'new KB', 'memory')
+    for key in sorted(set(oldResults) & set(newResults)):
+        old, new = oldResults[key], newResults[key]
+        if 'error' in new:
+            flag = '' if 'error' in old else '  REGRESSION (now fails: %s)' % new['error']
+            regressionCount += bool(flag)
+            print "%-16s %8g %s%s" % (key[0], key[1], 'error', flag)
+            continue
+        if 'error' in old:
+            print "%-16s %8g %s" % (key[0], key[1], 'fixed, no previous result to compare')
+            continue
+        timeChange = getChange(old['seconds'], new['seconds'])
+        memoryChange = getChange(old['peakRssKB'], new['peakRssKB'])
+        flagList = []
+        if timeChange is not None and timeChange > timeThreshold:
+            flagList.append('time')
+        if memoryChange is not None and memoryChange > memoryThreshold:
+            flagList.append('memory')
+        regressionCount += bool(flagList)
+        print "%-16s %8g %10.3f %10.3f %+7.1f%% %12d %12d %+7.1f%%%s" % (
+            key[0], key[1], old['seconds'], new['seconds'], 100 * (timeChange or 0), old['peakRssKB'], new['peakRssKB'],
+            100 * (memoryChange or 0), '  REGRESSION (%s)' % ', '.join(flagList) if flagList else '')
+    for key in sorted(set(oldResults) ^ set(newResults)):
+        print "%-16s %8g only in %s file" % (key[0], key[1], 'old' if key in oldResults else 'new')
+    return regressionCount
+
+
+def howToRun():
+    """
+    Instructs users how to use script.
+    opts/args: -h, help
+    """
+    print "\n\t\t * Run as: python benchmarks/compare.py old.json new.json"
+    print "\n\t\t * Optional: -t allowed wall time growth (default 0.10), -m allowed peak RSS growth (default 0.10)\n"
+    sys.exit()
+
+
+def main(argv):
+    """ If run as main script, function executes with user input """
+    timeThreshold = 0.10
+    memoryThreshold = 0.10
+    try:
+        opts, args = getopt.getopt(argv, 'ht:m:', ['help', 'time=', 'memory='])
+    except getopt.GetoptError:
+        howToRun()
+    for opt, arg in opts:
+        if opt in ['-h', '--help']:
+            howToRun()
+        elif opt in ['-t', '--time']:
+            timeThreshold = float(arg)
+        elif opt in ['-m', '--memory']:
+            memoryThreshold = float(arg)
+    if len(args) != 2:
+        howToRun()
+    regressionCount = compareResults(loadResults(args[0]), loadResults(args[1]), timeThreshold, memoryThreshold)
+    if regressionCount:
+        print "\n%d benchmark(s) regressed" % regressionCount
+        sys.exit(1)
+    print "\nNo regressions"
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,474 @@
+#!/usr/bin/python
+
+import os
+import sys
+import json
+import getopt
+import random
+from collections import OrderedDict
+
+"""
+##################################################################################################################
+##########################################   Corpus Generators   ###############################################
+##################################################################################################################
+
+* Seeded synthetic corpora in the layout parsers expect under a top directory:
+    MeSH/, Ontologies/, NCBITaxonomy/, TTD/, NAL/, NCBIEntrezGene/, CTD/ and jsonFiles/ for refactor.py.
+* Each generator writes about targetBytes in total, split over its files by fixed shares.
+    Files other records refer to (gene_info, nodes.dmp, d2016.bin, ...) are written first, and the
+    referring files pick IDs from the written range, with a few unknown IDs to exercise filtering.
+* Same seed and size always give the same corpus.
+* Run as: python benchmarks/generators.py -o /path/to/corpus -s SIZE_MB [-g mesh,ontology,...] [--seed N]
+"""
+
+CHECK_EVERY = 256  # records written between file size checks
+
+
+def fillFile(path, targetBytes, recordFunction):
+    """
+    Writes recordFunction(index) for index 0, 1, ... to path until targetBytes are written.
+    recordFunction returns the record text, or None when it has nothing more to write.
+    Returns number of records written.
+    """
+    count = 0
+    with open(path, 'w') as outFile:
+        while True:
+            if count % CHECK_EVERY == 0 and outFile.tell() >= targetBytes:
+                break
+            record = recordFunction(count)
+            if record is None:
+                break
+            outFile.write(record)
+            count += 1
+    return count
+
+
+def makeSourceDir(topDir, source):
+    """ Creates and returns topDir/source """
+    sourcePath = os.path.join(topDir, source)
+    if not os.path.exists(sourcePath):
+        os.makedirs(sourcePath)
+    return sourcePath
+
+
+def writeJsonConfig(topDir, source, configDict):
+    """ Writes refactor.py attribute config jsonFiles/<source>.json """
+    with open(os.path.join(makeSourceDir(topDir, 'jsonFiles'), source.lower() + '.json'), 'w') as jsonFile:
+        json.dump(configDict, jsonFile, indent=1)
+
+
+##################################################################################################################
+##########################################   MeSH   ############################################################
+##################################################################################################################
+
+
+def generateMesh(topDir, targetBytes, seed):
+    """ MeSH descriptors (d2016.bin) with tree numbers, qualifiers (q2016.bin), supplementals (c2016.bin), mtrees2016.bin """
+    rng = random.Random(seed)
+    meshPath = makeSourceDir(topDir, 'MeSH')
+    letters = 'ABCDEFGZ'
+    treeNumbers = []
+    childCounts = []
+    descriptorTrees = []
+
+    def newTreeNumber():
+        index = len(treeNumbers)
+        if index < 3 * len(letters):
+            treeNumber = '%s%02d' % (letters[index % len(letters)], index // len(letters) + 1)
+        else:
+            parent = rng.randrange(index)
+            childCounts[parent] += 1
+            treeNumber = '%s.%03d' % (treeNumbers[parent], childCounts[parent] % 1000)
+        treeNumbers.append(treeNumber)
+        childCounts.append(0)
+        return treeNumber
+
+    def descriptor(i):
+        trees = [newTreeNumber() for n in range(2 if rng.random() < 0.1 else 1)]
+        descriptorTrees.append(trees)
+        lines = ['*NEWRECORD', 'RECTYPE = D', 'MH = Heading D%07d' % i]
+        lines.extend('MN = %s' % tree for tree in trees)
+        for n in range(rng.randint(0, 3)):
+            lines.append('ENTRY = Entry %d %d|T109|NON|EQV|UNK (19XX)|771118|abbcdef' % (i, n))
+        lines.append('PRINT ENTRY = Print %d' % i)
+        lines.append('ST = T%03d' % rng.randint(1, 200))
+        lines.append('UI = D%07d' % i)
+        return '\n'.join(lines) + '\n\n'
+
+    def qualifier(i):
+        return '*NEWRECORD\nRECTYPE = Q\nSH = qualifier %d\nQA = %s\nUI = Q%07d\n\n' % (i, letters[i % 8] * 2, i)
+
+    def supplemental(i):
+        synonyms = '\n'.join('SY = syn %d %d|a|b|cd' % (i, n) for n in range(rng.randint(0, 3)))
+        return '*NEWRECORD\nRECTYPE = C\nNM = chemical %d\nRN = 0\n%s\nST = T116\nUI = C%07d\n\n' % (i, synonyms, i)
+
+    fillFile(os.path.join(meshPath, 'd2016.bin'), targetBytes * 45 // 100, descriptor)
+    fillFile(os.path.join(meshPath, 'q2016.bin'), targetBytes * 5 // 100, qualifier)
+    fillFile(os.path.join(meshPath, 'c2016.bin'), targetBytes * 35 // 100, supplemental)
+    with open(os.path.join(meshPath, 'mtrees2016.bin'), 'w') as treeFile:
+        for i, trees in enumerate(descriptorTrees):
+            for tree in trees:
+                treeFile.write('Heading D%07d;%s\n' % (i, tree))
+
+
+##################################################################################################################
+##########################################   Ontologies   ######################################################
+##################################################################################################################
+
+
+def writeOboFile(path, namespace, prefix, targetBytes, rng, extraLines=None):
+    """ Writes one .obo ontology of [Term] stanzas with is_a, relationship, synonym and obsolete lines """
+    header = ['format-version: 1.2', 'data-version: synthetic']
+    if namespace:
+        header.append('default-namespace: %s' % namespace)
+
+    def stanza(i):
+        if i == 0:
+            return '\n'.join(header) + '\n\n'
+        termID = '%s:%07d' % (prefix, i)
+        lines = ['[Term]', 'id: %s' % termID, 'name: term %d "quoted"' % i, 'def: "Definition of %d." [REF:1]' % i,
+                 'synonym: "syn %d" EXACT []' % i, 'synonym: "related %d" RELATED []' % i, 'xref: XR:%d' % i]
+        if i > 1:
+            lines.append('is_a: %s:%07d ! parent' % (prefix, rng.randint(1, i - 1)))
+        if i > 2 and rng.random() < 0.3:
+            lines.append('relationship: part_of %s:%07d ! whole' % (prefix, rng.randint(1, i - 1)))
+        if rng.random() < 0.1:
+            lines.append('intersection_of: %s:%07d ! genus' % (prefix, rng.randint(1, i)))
+            lines.append('intersection_of: has_part %s:%07d' % (prefix, rng.randint(1, i)))
+        if rng.random() < 0.05:
+            lines.append('is_obsolete: true')
+        if extraLines:
+            lines.extend(extraLines(i))
+        return '\n'.join(lines) + '\n\n'
+
+    count = fillFile(path, targetBytes, stanza)
+    with open(path, 'a') as oboFile:
+        oboFile.write('[Typedef]\nid: part_of\nname: part of\n\n')
+    return count - 1
+
+
+def generateOntology(topDir, targetBytes, seed):
+    """ Gene Ontology, ChEBI, Disease Ontology and the GO to ChEBI cross-ontology file """
+    rng = random.Random(seed)
+    oboPath = makeSourceDir(topDir, 'Ontologies')
+    goCount = writeOboFile(os.path.join(oboPath, 'gene_ontology.obo'), 'gene_ontology', 'GO', targetBytes * 35 // 100, rng)
+    chebiCount = writeOboFile(os.path.join(oboPath, 'chebi.obo'), 'chebi_ontology', 'CHEBI', targetBytes * 40 // 100, rng,
+                              lambda i: ['relationship: has_role CHEBI:%07d' % rng.randint(1, i)] if i % 4 == 0 else [])
+    writeOboFile(os.path.join(oboPath, 'doid.obo'), 'disease_ontology', 'DOID', targetBytes * 15 // 100, rng,
+                 lambda i: ['xref: MESH:D%07d' % i])
+
+    def crossStanza(i):
+        if i == 0:
+            return 'format-version: 1.2\n\n'
+        goID, chebiID = rng.randint(1, goCount), rng.randint(1, chebiCount)
+        return ('[Term]\nid: GO:%07d\nis_a: GO:%07d ! x\nintersection_of: GO:%07d ! g\nintersection_of: has_input CHEBI:%07d\n'
+                'relationship: has_input CHEBI:%07d ! c\n\n' % (goID, rng.randint(1, goCount), goID, chebiID, chebiID))
+
+    fillFile(os.path.join(oboPath, 'GOmfbp_to_ChEBI03092015.obo'), targetBytes * 10 // 100, crossStanza)
+
+
+##################################################################################################################
+##########################################   NCBI Taxonomy   ###################################################
+##################################################################################################################
+
+
+def generateTaxonomy(topDir, targetBytes, seed):
+    """ nodes.dmp, names.dmp (sorted by tax_id like the NCBI dump) and citations.dmp """
+    rng = random.Random(seed)
+    taxPath = makeSourceDir(topDir, 'NCBITaxonomy')
+    ranks = ['no rank', 'superkingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species', 'subspecies']
+
+    def node(i):
+        taxID = i + 1
+        parentID = 1 if taxID == 1 else rng.randint(max(1, taxID - 5000), taxID - 1)
+        return '%d\t|\t%d\t|\t%s\t|\t\t|\t0\t|\t1\t|\t1\t|\t1\t|\t0\t|\t1\t|\t0\t|\t0\t|\t\t|\n' % (
+            taxID, parentID, rng.choice(ranks))
+
+    taxCount = fillFile(os.path.join(taxPath, 'nodes.dmp'), targetBytes * 40 // 100, node)
+    with open(os.path.join(taxPath, 'names.dmp'), 'w') as namesFile:
+        for taxID in xrange(1, taxCount + 1):
+            if taxID % 5 == 0:
+                namesFile.write('%d\t|\tcommon %d\t|\t\t|\tgenbank common name\t|\n' % (taxID, taxID))
+            uniqueName = 'Taxon %d <u>' % taxID if taxID % 7 == 0 else ''
+            namesFile.write('%d\t|\tTaxon %d\t|\t%s\t|\tscientific name\t|\n' % (taxID, taxID, uniqueName))
+            if taxID % 3 == 0:
+                namesFile.write("%d\t|\tsyn'%d\t|\t\t|\tsynonym\t|\n" % (taxID, taxID))
+            if taxID % 11 == 0:
+                namesFile.write('%d\t|\tAuthor %d, 1900\t|\t\t|\tauthority\t|\n' % (taxID, taxID))
+
+    def citation(i):
+        taxa = ' '.join(str(rng.randint(1, taxCount)) for n in range(rng.randint(0, 4)))
+        medlineID = '0' if i % 6 == 0 else str(90000 + i)
+        return '%d\t|\tcitation key %d\t|\t0\t|\t%s\t|\t\t|\ttext %d\t|\t%s\t|\n' % (i + 1, i, medlineID, i, taxa)
+
+    fillFile(os.path.join(taxPath, 'citations.dmp'), targetBytes * 10 // 100, citation)
+
+
+##################################################################################################################
+##########################################   TTD   #############################################################
+##################################################################################################################
+
+
+def generateTTD(topDir, targetBytes, seed):
+    """ TTD_download_raw.txt, target-disease_TTD2016.txt, Target-KEGGpathway_all.txt, Target-wikipathway_all.txt """
+    rng = random.Random(seed)
+    ttdPath = makeSourceDir(topDir, 'TTD')
+
+    def target(i):
+        if i == 0:
+            return 'TTD Download raw\n'
+        targetID = 'TTDR%06d' % i
+        rows = [('Name', 'Target %d' % i), ('Type of target', 'Successful target'),
+                ('Function', 'Catalyses | reaction %d' % i), ('Disease', 'disease %d' % rng.randint(1, 500))]
+        rows.extend(('Synonyms', 'syn %d %d' % (i, n)) for n in range(rng.randint(0, 3)))
+        rows.append(('KEGG Pathway', 'hsa%05d:Pathway %d' % (i % 300, i % 300)))
+        rows.append(('Wiki Pathway', 'WP%d:Wiki %d' % (i % 200, i % 200)))
+        return ''.join('%s\t%s\t%s\n' % (targetID, key, value) for key, value in rows)
+
+    targetCount = fillFile(os.path.join(ttdPath, 'TTD_download_raw.txt'), targetBytes * 60 // 100, target)
+
+    def targetDisease(i):
+        targetIndex = rng.randint(1, targetCount + targetCount // 10)
+        return 'TTDR%06d\tTarget %d\tdisease %d\tIndication\tPhase %d\n' % (targetIndex, targetIndex, rng.randint(1, 500), i % 4)
+
+    def pathway(prefix, template):
+        def row(i):
+            if i == 0:
+                return 'TTDID\tPathway ID\tPathway Name\n'
+            pathwayIndex = rng.randint(1, 300)
+            return 'TTDR%06d\t%s\t%s\n' % (rng.randint(1, targetCount), prefix % pathwayIndex, template % pathwayIndex)
+        return row
+
+    fillFile(os.path.join(ttdPath, 'target-disease_TTD2016.txt'), targetBytes * 20 // 100, targetDisease)
+    fillFile(os.path.join(ttdPath, 'Target-KEGGpathway_all.txt'), targetBytes * 10 // 100, pathway('hsa%05d', 'KEGG pathway %d'))
+    fillFile(os.path.join(ttdPath, 'Target-wikipathway_all.txt'), targetBytes * 10 // 100, pathway('WP%d', 'Wiki pathway %d'))
+
+
+##################################################################################################################
+##########################################   NAL   #############################################################
+##################################################################################################################
+
+
+def generateNAL(topDir, targetBytes, seed):
+    """ NAL_Thesaurus_2015.xml of <CONCEPT> records with UF, BT, NT and RT links """
+    rng = random.Random(seed)
+    nalPath = makeSourceDir(topDir, 'NAL')
+    expectedCount = max(targetBytes // 200, 10)
+
+    def concept(i):
+        if i == 0:
+            return '<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE THESAURUS>\n<THESAURUS>\n'
+        lines = ['<CONCEPT>', '<DESCRIPTOR>term %d</DESCRIPTOR>' % i, '<TNR>%d</TNR>' % (100000 + i), '<SC>Category %d</SC>' % (i % 20)]
+        lines.extend('<UF>alternate %d.%d</UF>' % (i, n) for n in range(i % 3))
+        if i > 1:
+            lines.extend('<BT>term %d</BT>' % broader for broader in set(rng.randint(1, i - 1) for n in range(1 + i % 2)))
+        if i % 4 == 0:
+            lines.append('<NT>term %d</NT>' % (i + 1))
+            lines.append('<RT>term %d</RT>' % rng.randint(1, expectedCount))
+        lines.append('<STA>Active</STA>')
+        lines.append('</CONCEPT>')
+        return '\n'.join(lines) + '\n'
+
+    xmlPath = os.path.join(nalPath, 'NAL_Thesaurus_2015.xml')
+    fillFile(xmlPath, targetBytes, concept)
+    with open(xmlPath, 'a') as xmlFile:
+        xmlFile.write('</THESAURUS>\n')
+
+
+##################################################################################################################
+##########################################   NCBI Entrez Gene   ################################################
+##################################################################################################################
+
+NCBI_CONFIG = OrderedDict([
+    ('All_Mammalia.gene_info', ['tax_id', '+GeneID', '$Symbol', '$LocusTag', '+Synonyms', 'dbXrefs', 'chromosome',
+                                'map_location', '+description', 'type_of_gene']),
+    ('All_Plants.gene_info', ['tax_id', '+GeneID', '$Symbol', '$LocusTag', '+Synonyms', 'dbXrefs', 'chromosome',
+                              'map_location', '+description', 'type_of_gene']),
+    ('gene2go', ['tax_id', '+GeneID', '+GO_ID', 'Evidence', 'Qualifier', 'GO_term', '+PubMed', '+Category']),
+    ('gene_group', ['+tax_id', '+GeneID', '+relationship', '+Other_tax_id', '+Other_GeneID']),
+    ('mim2gene_medgen', ['+MIM number', '+GeneID', 'type', 'Source', 'MedGenCUI', 'Comment']),
+    ('gene2pubmed', ['tax_id', '+GeneID', '+PubMed_ID'])])
+
+
+def iterGeneRows(rng, geneIDs, rowsPerGene, formatRow):
+    """ Returns recordFunction walking geneIDs in order, formatRow(geneID, rng) repeated 1..rowsPerGene times per gene """
+    state = {'position': 0}
+
+    def row(i):
+        if not geneIDs:
+            return None
+        if state['position'] >= len(geneIDs):
+            state['position'] = 0
+        geneID = geneIDs[state['position']]
+        state['position'] += rng.randint(1, 3)
+        return ''.join(formatRow(geneID, rng) for n in range(rng.randint(1, rowsPerGene)))
+    return row
+
+
+def generateNCBI(topDir, targetBytes, seed):
+    """ gene_info node files and gene2go, gene_group, mim2gene_medgen, gene2pubmed in GeneID order, plus jsonFiles config """
+    rng = random.Random(seed)
+    genePath = makeSourceDir(topDir, 'NCBIEntrezGene')
+    writeJsonConfig(topDir, 'NCBIEntrezGene', NCBI_CONFIG)
+    geneIDs = []
+
+    def geneInfo(taxID, firstGeneID):
+        def row(i):
+            if i == 0:
+                return '#tax_id\tGeneID\tSymbol\tLocusTag\tSynonyms\tdbXrefs\tchromosome\tmap_location\tdescription\ttype_of_gene\n'
+            geneID = firstGeneID + i
+            geneIDs.append(geneID)
+            synonyms = '|'.join('S%d_%d' % (geneID, n) for n in range(rng.randint(0, 3))) or '-'
+            return '%d\t%d\tSYM%d\t-\t%s\tMIM:%d\t%d\t%dp\tdescription of gene %d\tprotein-coding\n' % (
+                taxID, geneID, geneID, synonyms, geneID, i % 23 + 1, i % 40, geneID)
+        return row
+
+    fillFile(os.path.join(genePath, 'All_Mammalia.gene_info'), targetBytes * 35 // 100, geneInfo(9606, 0))
+    fillFile(os.path.join(genePath, 'All_Plants.gene_info'), targetBytes * 10 // 100, geneInfo(3702, 50000000))
+    # a few genes missing from gene_info, so relationship writers filter rows
+    rowGeneIDs = sorted(geneIDs + [geneID + 40000000 for geneID in geneIDs[::50]])
+
+    def headerThen(header, recordFunction):
+        def row(i):
+            return header if i == 0 else recordFunction(i)
+        return row
+
+    categories = ['Component', 'Function', 'Process']
+    gene2go = iterGeneRows(rng, rowGeneIDs, 4, lambda geneID, rng: '9606\t%d\tGO:%07d\tIEA\t-\tterm\t%s\t%s\n' % (
+        geneID, rng.randint(1, 40000), '|'.join(str(rng.randint(1, 9000000)) for n in range(rng.randint(0, 3))) or '-',
+        rng.choice(categories)))
+    fillFile(os.path.join(genePath, 'gene2go'), targetBytes * 20 // 100, headerThen(
+        '#tax_id\tGeneID\tGO_ID\tEvidence\tQualifier\tGO_term\tPubMed\tCategory\n', gene2go))
+    geneGroup = iterGeneRows(rng, rowGeneIDs, 3, lambda geneID, rng: '9606\t%d\tOrtholog\t%d\t%d\n' % (
+        geneID, rng.choice([10090, 10116, 7955]), rng.randint(1, 9000000)))
+    fillFile(os.path.join(genePath, 'gene_group'), targetBytes * 10 // 100, headerThen(
+        '#tax_id\tGeneID\trelationship\tOther_tax_id\tOther_GeneID\n', geneGroup))
+    mimGene = iterGeneRows(rng, rowGeneIDs, 1, lambda geneID, rng: '%d\t%d\tgene\t-\tC%07d\t-\n' % (
+        rng.randint(100000, 999999), geneID, geneID))
+    fillFile(os.path.join(genePath, 'mim2gene_medgen'), targetBytes * 5 // 100, headerThen(
+        '#MIM number\tGeneID\ttype\tSource\tMedGenCUI\tComment\n', mimGene))
+    genePubmed = iterGeneRows(rng, rowGeneIDs, 5, lambda geneID, rng: '9606\t%d\t%d\n' % (geneID, rng.randint(1, 30000000)))
+    fillFile(os.path.join(genePath, 'gene2pubmed'), targetBytes * 20 // 100, headerThen(
+        '#tax_id\tGeneID\tPubMed_ID\n', genePubmed))
+
+
+##################################################################################################################
+##########################################   CTD   #############################################################
+##################################################################################################################
+
+CTD_CONFIG = OrderedDict([
+    ('CTD_chem_gene_ixn_types.tsv', ['+TypeName', '+Code', '+Description', '+ParentCode']),
+    ('CTD_chem_gene_ixns.tsv', ['ChemicalName', '+ChemicalID', 'CasRN', 'GeneSymbol', '+GeneID', 'GeneForms', '+Organism',
+                                '+OrganismID', '+Interaction', '+InteractionActions', '+PubMedIDs']),
+    ('CTD_chemicals_diseases.tsv', ['ChemicalName', '+ChemicalID', 'CasRN', 'DiseaseName', '+DiseaseID', '+DirectEvidence',
+                                    '+InferenceGeneSymbol', '+InferenceScore', '+OmimIDs', 'PubMedIDs']),
+    ('CTD_genes_pathways.tsv', ['GeneSymbol', '+GeneID', 'PathwayName', '+PathwayID']),
+    ('CTD_diseases_pathways.tsv', ['DiseaseName', '+DiseaseID', 'PathwayName', '+PathwayID', '+InferenceGeneSymbol']),
+    ('CTD_chem_pathways_enriched.tsv', ['ChemicalName', '+ChemicalID', 'CasRN', 'PathwayName', '+PathwayID', '+PValue',
+                                        '+CorrectedPValue', 'TargetMatchQty', 'TargetTotalQty', 'BackgroundMatchQty',
+                                        'BackgroundTotalQty']),
+    ('CTD_chem_go_enriched.tsv', ['ChemicalName', '+ChemicalID', 'CasRN', 'Ontology', 'GOTermName', '+GOTermID',
+                                  'HighestGOLevel', '+PValue', '+CorrectedPValue', 'TargetMatchQty', 'TargetTotalQty',
+                                  'BackgroundMatchQty', 'BackgroundTotalQty'])])
+
+CTD_IXN_TYPES = [('abundance', 'abu', ''), ('activity', 'act', ''), ('binding', 'b', ''), ('cotreatment', 'ct', ''),
+                 ('expression', 'exp', ''), ('metabolic processing', 'met', ''), ('methylation', 'mth', 'met'),
+                 ('phosphorylation', 'pho', 'met'), ('reaction', 'rxn', ''), ('transport', 'trt', '')]
+
+
+def generateCTD(topDir, targetBytes, seed):
+    """ CTD chemical-gene, chemical-disease, pathway and enrichment TSVs, plus jsonFiles config """
+    rng = random.Random(seed)
+    ctdPath = makeSourceDir(topDir, 'CTD')
+    writeJsonConfig(topDir, 'CTD', CTD_CONFIG)
+    comment = '# Comparative Toxicogenomics Database synthetic corpus\n#\n'
+    with open(os.path.join(ctdPath, 'CTD_chem_gene_ixn_types.tsv'), 'w') as typeFile:
+        typeFile.write(comment + '# TypeName\tCode\tDescription\tParentCode\n')
+        for typeName, code, parentCode in CTD_IXN_TYPES:
+            typeFile.write('%s\t%s\t%s of a chemical\t%s\n' % (typeName, code, typeName, parentCode))
+
+    def withComment(recordFunction):
+        def row(i):
+            return comment if i == 0 else recordFunction(i)
+        return row
+
+    def chemGene(i):
+        actions = '|'.join('%s^%s' % (rng.choice(['increases', 'decreases', 'affects']), rng.choice(CTD_IXN_TYPES)[0])
+                           for n in range(rng.randint(1, 3)))
+        return 'chemical %d\tD%06d\t\tGENE%d\t%d\tprotein\tHomo sapiens\t9606\tchemical %d results in %s\t%s\t%d\n' % (
+            i % 5000, i % 5000, i % 20000, i % 20000, i % 5000, actions.replace('^', ' '), actions, rng.randint(1, 30000000))
+
+    def chemDisease(i):
+        direct = rng.choice(['marker/mechanism', 'therapeutic', ''])
+        return 'chemical %d\tD%06d\t\tdisease %d\tMESH:D%06d\t%s\tGENE%d\t%.2f\t%s\t%d\n' % (
+            i % 5000, i % 5000, i % 3000, i % 3000, direct, rng.randint(1, 20000), rng.random() * 100,
+            rng.randint(100000, 999999) if rng.random() < 0.2 else '', rng.randint(1, 30000000))
+
+    def genePathway(i):
+        return 'GENE%d\t%d\tpathway %d\tKEGG:hsa%05d\n' % (i % 20000, i % 20000, i % 400, i % 400)
+
+    def diseasePathway(i):
+        return 'disease %d\tMESH:D%06d\tpathway %d\tREACT:%d\tGENE%d\n' % (i % 3000, i % 3000, i % 400, i % 400, rng.randint(1, 20000))
+
+    def chemPathway(i):
+        return 'chemical %d\tD%06d\t\tpathway %d\tKEGG:hsa%05d\t%.3g\t%.3g\t3\t10\t20\t20000\n' % (
+            i % 5000, i % 5000, i % 400, i % 400, rng.random() / 100, rng.random() / 10)
+
+    def chemGo(i):
+        return 'chemical %d\tD%06d\t\tBiological Process\tterm %d\tGO:%07d\t3\t%.3g\t%.3g\t3\t10\t20\t20000\n' % (
+            i % 5000, i % 5000, i % 9000, i % 9000, rng.random() / 100, rng.random() / 10)
+
+    for name, share, recordFunction in [('CTD_chem_gene_ixns.tsv', 45, chemGene), ('CTD_chemicals_diseases.tsv', 25, chemDisease),
+                                        ('CTD_genes_pathways.tsv', 10, genePathway), ('CTD_diseases_pathways.tsv', 10, diseasePathway),
+                                        ('CTD_chem_pathways_enriched.tsv', 5, chemPathway), ('CTD_chem_go_enriched.tsv', 5, chemGo)]:
+        fillFile(os.path.join(ctdPath, name), targetBytes * share // 100, withComment(recordFunction))
+
+
+GENERATORS = OrderedDict([('mesh', generateMesh), ('ontology', generateOntology), ('taxonomy', generateTaxonomy),
+                          ('ttd', generateTTD), ('nal', generateNAL), ('ncbi', generateNCBI), ('ctd', generateCTD)])
+
+
+def generateCorpus(topDir, targetBytes, seed, names=None):
+    """ Runs the named generators (all by default), each writing about targetBytes under topDir """
+    for name in names or GENERATORS.keys():
+        GENERATORS[name](topDir, targetBytes, seed)
+
+
+def howToRun():
+    """
+    Instructs users how to use script.
+    opts/args: -h, help
+    """
+    print "\n\t\t * Run as: python benchmarks/generators.py -o /path/to/corpus -s SIZE_MB"
+    print "\n\t\t * Optional: -g %s (default all), --seed N (default 1)\n" % ','.join(GENERATORS.keys())
+    sys.exit()
+
+
+def main(argv):
+    """ If run as main script, function executes with user input """
+    topDir = None
+    sizeMB = None
+    names = None
+    seed = 1
+    try:
+        opts, args = getopt.getopt(argv, 'ho:s:g:', ['help', 'outDir=', 'size=', 'generators=', 'seed='])
+    except getopt.GetoptError:
+        howToRun()
+    for opt, arg in opts:
+        if opt in ['-h', '--help']:
+            howToRun()
+        elif opt in ['-o', '--outDir']:
+            topDir = arg
+        elif opt in ['-s', '--size']:
+            sizeMB = float(arg)
+        elif opt in ['-g', '--generators']:
+            names = arg.split(',')
+        elif opt == '--seed':
+            seed = int(arg)
+    if not topDir or not sizeMB or any(name not in GENERATORS for name in names or []):
+        howToRun()
+    generateCorpus(topDir, int(sizeMB * (1 << 20)), seed, names)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,316 @@
+#!/usr/bin/python
+
+import os
+import sys
+import json
+import time
+import getopt
+import shutil
+import platform
+import resource
+import tempfile
+import traceback
+import subprocess
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import batchWriter
+import meshParser
+import ontologyParser
+import taxonomyParser
+import ttdParser
+import nalParser
+import refactor
+from benchmarks import generators
+
+"""
+##################################################################################################################
+##########################################   Benchmark Runner   ################################################
+##################################################################################################################
+
+* Generates a seeded corpus per size with generators.py, then times the parser entry points on it
+    (meshData/parseTree, parseOntologyFile, parseNodes/parseNames/parseCitations/writeTaxData, mergeTaxData,
+    the ttdParser functions, iterConcepts/writeNodes, and NCBIEntrezGene/CTD checkFile() through refactor.runFileJob()).
+* Every run happens in a forked child, so peak RSS (ru_maxrss of the child and its pool workers)
+    belongs to that benchmark alone. Corpus generation is not timed.
+* parseCache.enable() is not called, so parsed records go to temporary tables and every run parses its infiles.
+* Records wall time, input rows, rows/sec and peak RSS per benchmark and size as JSON, see compare.py.
+* Run as: python benchmarks/runner.py -s 5,50 [-b mesh,ncbi] [-r 3] [-o results.json] [-w /scratch] [-k] [-v]
+"""
+
+
+def benchMesh(topDir, outDir):
+    """ meshData() over the descriptor, qualifier and supplemental files, then parseTree() over mtrees2016.bin """
+    meshPath = os.path.join(topDir, 'MeSH')
+    bigRelnDict = dict()
+    with batchWriter.openOutput(os.path.join(outDir, 'meshNodeOut.csv')) as meshNodeOutFile:
+        for meshFile in ['c2016.bin', 'd2016.bin', 'q2016.bin']:
+            treeRelnDict, fileNodeSet = meshParser.meshData(os.path.join(meshPath, meshFile), meshNodeOutFile)
+            bigRelnDict.update(treeRelnDict)
+    with batchWriter.openOutput(os.path.join(outDir, 'meshRelnOut.csv')) as meshRelnOutFile:
+        meshParser.parseTree(os.path.join(meshPath, 'mtrees2016.bin'), bigRelnDict, meshRelnOutFile)
+
+
+def benchOntology(topDir, outDir):
+    """ parseOntologyFile() for every .obo file, then writeOntologyRelationships() """
+    oboPath = os.path.join(topDir, 'Ontologies')
+    bigUniqueNodeSet = set()
+    bigRelnSet = set()
+    for oboFile in sorted(os.listdir(oboPath)):
+        uniqueNodeSet, relnSet, nodeCount, nodeOutFile = ontologyParser.parseOntologyFile((topDir, os.path.join(oboPath, oboFile)))
+        bigUniqueNodeSet.update(uniqueNodeSet)
+        bigRelnSet.update(relnSet)
+    ontologyParser.writeOntologyRelationships(os.path.join(outDir, 'oboRelnOut.csv'), bigUniqueNodeSet, bigRelnSet)
+
+
+def openTaxOutfiles(outDir):
+    """ Returns taxonomy node and relationship outfiles with headers written """
+    taxNodeOutFile = batchWriter.openOutput(os.path.join(outDir, 'taxNodeOut.csv'))
+    taxRelnOutFile = batchWriter.openOutput(os.path.join(outDir, 'taxRelnOut.csv'))
+    taxonomyParser.writeTaxHeaders(taxNodeOutFile, taxRelnOutFile)
+    return taxNodeOutFile, taxRelnOutFile
+
+
+def benchTaxonomy(topDir, outDir):
+    """ parseNodes(), parseNames(), parseCitations() and writeTaxData() """
+    taxPath = os.path.join(topDir, 'NCBITaxonomy')
+    taxNodeOutFile, taxRelnOutFile = openTaxOutfiles(outDir)
+    taxStore = taxonomyParser.parseNodes(os.path.join(taxPath, 'nodes.dmp'))
+    taxonomyParser.parseNames(os.path.join(taxPath, 'names.dmp'), taxStore)
+    taxonomyParser.parseCitations(os.path.join(taxPath, 'citations.dmp'), taxStore)
+    taxonomyParser.writeTaxData(taxStore, taxNodeOutFile, taxRelnOutFile)
+    taxNodeOutFile.close()
+    taxRelnOutFile.close()
+
+
+def benchTaxonomyMerge(topDir, outDir):
+    """ mergeTaxData(), the taxonomyParser.py -m path """
+    taxPath = os.path.join(topDir, 'NCBITaxonomy')
+    taxNodeOutFile, taxRelnOutFile = openTaxOutfiles(outDir)
+    taxonomyParser.mergeTaxData(os.path.join(taxPath, 'nodes.dmp'), os.path.join(taxPath, 'names.dmp'),
+                                os.path.join(taxPath, 'citations.dmp'), taxNodeOutFile, taxRelnOutFile)
+    taxNodeOutFile.close()
+    taxRelnOutFile.close()
+
+
+def benchTTD(topDir, outDir):
+    """ ttdParser node, target-disease, KEGG and Wiki pathway functions, as run by ttdMeshParser.py """
+    ttdPath = os.path.join(topDir, 'TTD')
+    outFileList = [batchWriter.openOutput(os.path.join(outDir, name)) for name in
+                   ['ttdNodeOut.csv', 'ttdNodeOut2.csv', 'KEGGNodeOut.csv', 'targetKEGGRelnOut.csv', 'wikiNodeOut.csv',
+                    'targetWikiRelnOut.csv']]
+    ttdNodeOutFile, targetDiseaseNodeOutFile, KEGGNodeOutFile, KEGGRelnOutFile, wikiNodeOutFile, wikiRelnOutFile = outFileList
+    ttdFilePath = os.path.join(ttdPath, 'TTD_download_raw.txt')
+    with ttdParser.loadTTDNodes(ttdFilePath) as nodeTable:
+        ttdParser.writeTTDNodes(nodeTable, ttdNodeOutFile)
+        nodeSet = set(nodeTable.getColumn('TTDID'))
+    with ttdParser.loadTargetDisease(os.path.join(ttdPath, 'target-disease_TTD2016.txt'), nodeSet, ttdFilePath) as targetTable:
+        ttdParser.writeTargetDiseaseNodes(targetTable, targetDiseaseNodeOutFile)
+    ttdParser.parseTargetKEGG(os.path.join(ttdPath, 'Target-KEGGpathway_all.txt'), KEGGNodeOutFile, KEGGRelnOutFile)
+    ttdParser.parseTargetWiki(os.path.join(ttdPath, 'Target-wikipathway_all.txt'), wikiNodeOutFile, wikiRelnOutFile)
+    for outFile in outFileList:
+        outFile.close()
+
+
+def benchNAL(topDir, outDir):
+    """ writeNodes() over iterConcepts() of the thesaurus, then writeRelns() """
+    nalNodeOutFile = batchWriter.openOutput(os.path.join(outDir, 'nalNodeOut.csv'))
+    nalRelnOutFile = batchWriter.openOutput(os.path.join(outDir, 'nalRelnOut.csv'))
+    idDescriptorMap = dict()
+    broaderList = []
+    with open(os.path.join(topDir, 'NAL', 'NAL_Thesaurus_2015.xml'), 'rb') as inFile:
+        nalParser.writeNodes(nalParser.iterConcepts(inFile), nalNodeOutFile, idDescriptorMap, broaderList)
+    nalParser.writeRelns(idDescriptorMap, broaderList, nalRelnOutFile)
+    nalNodeOutFile.close()
+    nalRelnOutFile.close()
+
+
+def runSourceJobs(topDir, outDir, source):
+    """ checkFile() of every file configured for source, sequentially in refactor.planJobs() order """
+    for wave in refactor.planJobs(refactor.getFileJobs(topDir, outDir, source)):
+        for job in wave:
+            refactor.runFileJob(job)
+
+
+def benchNCBI(topDir, outDir):
+    """ NCBIEntrezGene.checkFile() for the gene_info files, then every relationship file """
+    runSourceJobs(topDir, outDir, 'NCBIEntrezGene')
+
+
+def benchCTD(topDir, outDir):
+    """ CTD.checkFile() for every configured CTD file """
+    runSourceJobs(topDir, outDir, 'CTD')
+
+
+# benchmark name: (generator name, input directory rows are counted in, benchmark function)
+BENCHMARKS = OrderedDict([('mesh', ('mesh', 'MeSH', benchMesh)),
+                          ('ontology', ('ontology', 'Ontologies', benchOntology)),
+                          ('taxonomy', ('taxonomy', 'NCBITaxonomy', benchTaxonomy)),
+                          ('taxonomy-merge', ('taxonomy', 'NCBITaxonomy', benchTaxonomyMerge)),
+                          ('ttd', ('ttd', 'TTD', benchTTD)),
+                          ('nal', ('nal', 'NAL', benchNAL)),
+                          ('ncbi', ('ncbi', 'NCBIEntrezGene', benchNCBI)),
+                          ('ctd', ('ctd', 'CTD', benchCTD))])
+
+
+def countRows(sourcePath):
+    """ Returns number of lines in the files of sourcePath """
+    rowCount = 0
+    for name in os.listdir(sourcePath):
+        with open(os.path.join(sourcePath, name), 'rb') as inFile:
+            for chunk in iter(lambda: inFile.read(1 << 20), ''):
+                rowCount += chunk.count('\n')
+    return rowCount
+
+
+def getPeakRss():
+    """ Returns peak RSS in KB of this process and its finished children (pool workers) """
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def runForked(benchFunction, topDir, verbose):
+    """
+    Runs benchFunction(topDir, outDir) in a forked child with a fresh topDir/csv_out.
+    Returns dict of seconds and peakRssKB, or of error when the benchmark raised or the child died.
+    """
+    outDir = os.path.join(topDir, 'csv_out')
+    if os.path.exists(outDir):
+        shutil.rmtree(outDir)
+    os.makedirs(outDir)
+    sys.stdout.flush()
+    readFD, writeFD = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(readFD)
+        status = 0
+        try:
+            if not verbose:
+                devNull = os.open(os.devnull, os.O_WRONLY)
+                os.dup2(devNull, 1)
+            startTime = time.time()
+            benchFunction(topDir, outDir)
+            sys.stdout.flush()
+            result = {'seconds': time.time() - startTime, 'peakRssKB': getPeakRss()}
+        except BaseException:
+            result = {'error': traceback.format_exc().strip().splitlines()[-1]}
+            status = 1
+        try:
+            os.write(writeFD, json.dumps(result))
+        finally:
+            os._exit(status)
+    os.close(writeFD)
+    chunkList = []
+    chunk = os.read(readFD, 1 << 16)
+    while chunk:
+        chunkList.append(chunk)
+        chunk = os.read(readFD, 1 << 16)
+    os.close(readFD)
+    pid, status = os.waitpid(pid, 0)
+    if not chunkList:
+        return {'error': 'benchmark process died with status %d' % status}
+    return json.loads(''.join(chunkList))
+
+
+def runBenchmarks(sizeList, nameList, repeats, seed, workDir, keepCorpus, verbose):
+    """ Returns list of result dicts, one per benchmark and size, best wall time of repeats runs """
+    resultList = []
+    for sizeMB in sizeList:
+        topDir = tempfile.mkdtemp(prefix='benchCorpus%gMB.' % sizeMB, dir=workDir) + '/'
+        try:
+            generatorNames = sorted(set(BENCHMARKS[name][0] for name in nameList))
+            print "\nGenerating %gMB corpus per source in %s (%s)" % (sizeMB, topDir, ', '.join(generatorNames))
+            generators.generateCorpus(topDir, int(sizeMB * (1 << 20)), seed, generatorNames)
+            for name in nameList:
+                generatorName, inputDir, benchFunction = BENCHMARKS[name]
+                rowCount = countRows(os.path.join(topDir, inputDir))
+                runList = [runForked(benchFunction, topDir, verbose) for n in range(repeats)]
+                result = OrderedDict([('benchmark', name), ('sizeMB', sizeMB), ('rows', rowCount)])
+                errorList = [run['error'] for run in runList if 'error' in run]
+                if errorList:
+                    result['error'] = errorList[0]
+                    print "\t%-16s %8gMB  ERROR %s" % (name, sizeMB, errorList[0])
+                else:
+                    result['seconds'] = min(run['seconds'] for run in runList)
+                    result['rowsPerSecond'] = rowCount / result['seconds'] if result['seconds'] else 0.0
+                    result['peakRssKB'] = max(run['peakRssKB'] for run in runList)
+                    print "\t%-16s %8gMB %10.3fs %12.0f rows/s %10d KB" % (name, sizeMB, result['seconds'],
+                                                                           result['rowsPerSecond'], result['peakRssKB'])
+                resultList.append(result)
+        finally:
+            if keepCorpus:
+                print "Corpus kept in %s" % topDir
+            else:
+                shutil.rmtree(topDir, ignore_errors=True)
+    return resultList
+
+
+def getRevision():
+    """ Returns git commit of the parsers being measured, None outside a git checkout """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def howToRun():
+    """
+    Instructs users how to use script.
+    opts/args: -h, help
+    """
+    print "\n\t\t * Run as: python benchmarks/runner.py -s 5,50 -o results.json"
+    print "\n\t\t * -s sizes in MB per source (default 5), -b benchmarks (default all): %s" % ','.join(BENCHMARKS.keys())
+    print "\t\t * -r repeats, best wall time is kept (default 1), --seed N (default 1)"
+    print "\t\t * -w directory for the generated corpora (default system temp), -k keeps them, -v shows parser output\n"
+    sys.exit()
+
+
+def main(argv):
+    """ If run as main script, function executes with user input """
+    sizeList = [5.0]
+    nameList = list(BENCHMARKS.keys())
+    repeats = 1
+    seed = 1
+    workDir = None
+    outPath = 'benchmarkResults.json'
+    keepCorpus = False
+    verbose = False
+    try:
+        opts, args = getopt.getopt(argv, 'hs:b:r:o:w:kv', ['help', 'sizes=', 'benchmarks=', 'repeats=', 'outFile=',
+                                                           'workDir=', 'keep', 'verbose', 'seed='])
+    except getopt.GetoptError:
+        howToRun()
+    for opt, arg in opts:
+        if opt in ['-h', '--help']:
+            howToRun()
+        elif opt in ['-s', '--sizes']:
+            sizeList = [float(size) for size in arg.split(',')]
+        elif opt in ['-b', '--benchmarks']:
+            nameList = arg.split(',')
+        elif opt in ['-r', '--repeats']:
+            repeats = int(arg)
+        elif opt in ['-o', '--outFile']:
+            outPath = arg
+        elif opt in ['-w', '--workDir']:
+            workDir = arg
+        elif opt in ['-k', '--keep']:
+            keepCorpus = True
+        elif opt in ['-v', '--verbose']:
+            verbose = True
+        elif opt == '--seed':
+            seed = int(arg)
+    if any(name not in BENCHMARKS for name in nameList):
+        howToRun()
+
+    resultList = runBenchmarks(sizeList, nameList, repeats, seed, workDir, keepCorpus, verbose)
+    report = OrderedDict([('created', time.strftime('%Y-%m-%dT%H:%M:%S')), ('revision', getRevision()),
+                          ('python', platform.python_version()), ('platform', platform.platform()),
+                          ('seed', seed), ('repeats', repeats), ('results', resultList)])
+    with open(outPath, 'w') as outFile:
+        json.dump(report, outFile, indent=1)
+    print "\nResults written to %s" % outPath
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
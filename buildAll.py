@@ -0,0 +1,248 @@
+#!/usr/bin/python
+
+import os
+import sys
+import time
+import getopt
+import shutil
+import importlib
+import traceback
+import multiprocessing
+import general
+import batchWriter
+import stageMetrics
+
+"""
+##################################################################################################################
+##########################################   Build All   #######################################################
+##################################################################################################################
+
+* One entry point for the whole build: finds the sources under the top directory and runs each one as a task,
+    the source's own parser main() (refactor.py, ttdMeshParser.py, ontologyParser.py, taxonomyParser.py, nalParser.py),
+    scheduled as a dependency graph on up to N concurrent processes.
+* Sources share no parser state, only csv_out/: the build manifest merges entries under a lock, parseCache tables
+    are per infile and the node index takes concurrent writers. The one ordering is NCBIEntrezGene after NCBITaxonomy
+    and Ontologies, whose node IDs its gene_group and gene2go relationships are checked against (nodeIndex.py).
+* Ready tasks start largest infiles first, so the longest task does not start last.
+* Each task process stages its outfiles in csv_out/.staging/<task>/ (batchWriter.stageOutputs()); they move into
+    csv_out/ one rename each as the build manifest records them, the rest once the task succeeds. Staged outfiles
+    of a failed task are discarded and the previous outfiles stay in place.
+* Parser output goes to csv_out/buildAll.<task>.log, one line is printed as each task starts and ends.
+    Run reports are written per task, csv_out/runReport.<parser>.<task>.json.
+"""
+
+# task and source directory name: (parser module, parser options, tasks which must finish first)
+TASKS = [('NCBITaxonomy', 'taxonomyParser', [], []),
+         ('Ontologies', 'ontologyParser', [], []),
+         ('MeSH', 'ttdMeshParser', ['-s', 'MeSH'], []),
+         ('TTD', 'ttdMeshParser', ['-s', 'TTD'], []),
+         ('NAL', 'nalParser', [], []),
+         ('NCBIEntrezGene', 'refactor', ['-s', 'NCBIEntrezGene'], ['NCBITaxonomy', 'Ontologies']),
+         ('CTD', 'refactor', ['-s', 'CTD'], [])]
+JSON_SOURCES = ['NCBIEntrezGene', 'CTD']  # refactor.py sources, which also need jsonFiles/<source>.json
+WORKER_PARSERS = ['refactor', 'ttdMeshParser', 'ontologyParser']  # parsers taking -j N worker processes
+STAGING_DIR = '.staging'
+POLL_INTERVAL = 0.2  # seconds between checks for finished tasks
+LOG_TAIL = 15  # log lines printed when a task fails
+
+
+def howToRun():
+    """
+    Instructs users how to use script.
+    opts/args: -h, help
+    """
+    print "\n\t\t * Run as: python /path/to/this/script.py -p /path/to/top/directory"
+    print "\n\t\t * Example top directory: /Users/username/KnowledgeBase/Sources"
+    print "\n\t\t * Runs the parser of every source directory found: %s" % ', '.join(task[0] for task in TASKS)
+    print "\n\t\t * Optional: -j N runs up to N sources at a time (default: number of CPUs)"
+    print "\t\t * Optional: -w N passes -j N worker processes to refactor.py, ttdMeshParser.py and ontologyParser.py"
+    print "\t\t * Optional: -s MeSH,NAL,... runs only these sources"
+    print "\t\t * Optional: -f rebuilds regardless of the build manifest, -z writes gzip compressed outfiles\n"
+    sys.exit()
+
+
+def getInputBytes(sourcePath):
+    """ Returns total size of the files under sourcePath """
+    total = 0
+    for root, dirs, files in os.walk(sourcePath, followlinks=True):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def findTasks(topDir, selectedList=None):
+    """ Returns list of (task name, parser module, parser options, dependencies, input bytes) for sources under topDir """
+    taskList = []
+    for taskName, moduleName, parserOptions, dependencies in TASKS:
+        sourcePath = os.path.join(topDir, taskName)
+        if selectedList and taskName not in selectedList:
+            continue
+        if not os.path.isdir(sourcePath):
+            continue
+        if taskName in JSON_SOURCES and not os.path.isfile(os.path.join(topDir, 'jsonFiles', taskName.lower() + '.json')):
+            print "\tSkipping %s, no jsonFiles/%s.json" % (taskName, taskName.lower())
+            continue
+        taskList.append((taskName, moduleName, parserOptions, dependencies, getInputBytes(sourcePath)))
+    taskNames = [task[0] for task in taskList]
+    # dependencies on sources which are not built this run are dropped
+    return [(taskName, moduleName, parserOptions, [name for name in dependencies if name in taskNames], inputBytes)
+            for taskName, moduleName, parserOptions, dependencies, inputBytes in taskList]
+
+
+def getStagingDir(outDir, taskName):
+    """ Returns directory the outfiles of taskName are staged in """
+    return os.path.join(outDir, STAGING_DIR, taskName)
+
+
+def getLogPath(outDir, taskName):
+    """ Returns path of the parser output log of taskName """
+    return os.path.join(outDir, 'buildAll.%s.log' % taskName)
+
+
+def runTask(taskName, moduleName, argv, outDir):
+    """
+    Task process: runs the parser main() with argv, output going to the task log and outfiles staged.
+    Outfiles the parser did not record in the build manifest are moved into place once it returns.
+    """
+    with open(getLogPath(outDir, taskName), 'w') as logFile:
+        os.dup2(logFile.fileno(), sys.stdout.fileno())
+        os.dup2(logFile.fileno(), sys.stderr.fileno())
+    stagingDir = getStagingDir(outDir, taskName)
+    batchWriter.stageOutputs(outDir, stagingDir)
+    stageMetrics.runLabel = taskName
+    exitCode = 0
+    try:
+        importlib.import_module(moduleName).main(argv)
+        batchWriter.publishOutputs([os.path.join(outDir, name) for name in os.listdir(stagingDir)])
+    except SystemExit as exit:
+        print "\n%s exited during the build (exit code %s)" % (moduleName, exit.code)
+        exitCode = exit.code or 1
+    except:
+        traceback.print_exc()
+        exitCode = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    sys.exit(exitCode)
+
+
+def startTask(task, topDir, outDir, parserArgs, workerCount):
+    """ Returns started process running task """
+    taskName, moduleName, parserOptions, dependencies, inputBytes = task
+    argv = ['-p', topDir] + parserOptions + parserArgs
+    if workerCount > 1 and moduleName in WORKER_PARSERS:
+        argv += ['-j', str(workerCount)]
+    stagingDir = getStagingDir(outDir, taskName)
+    if os.path.isdir(stagingDir):
+        shutil.rmtree(stagingDir)  # left behind by an interrupted build
+    print "Started  %-16s %10s of infiles  (python %s.py %s)" % (taskName, stageMetrics.formatBytes(inputBytes),
+                                                                  moduleName, ' '.join(argv))
+    sys.stdout.flush()
+    process = multiprocessing.Process(target=runTask, args=(taskName, moduleName, argv, outDir), name=taskName)
+    process.start()
+    return process
+
+
+def printLogTail(logPath):
+    """ Prints the last LOG_TAIL lines of a task log """
+    if not os.path.isfile(logPath):
+        return
+    with open(logPath, 'r') as logFile:
+        for line in logFile.readlines()[-LOG_TAIL:]:
+            print "\t| " + line.rstrip('\n')
+
+
+def runTasks(taskList, topDir, outDir, parserArgs, taskCount, workerCount):
+    """
+    Runs every task once its dependencies finished, up to taskCount at a time, largest ready task first.
+    Tasks depending on a failed task are skipped. Returns dict of task name to 'done', 'failed' or 'skipped'.
+    """
+    pendingList = sorted(taskList, key=lambda task: task[4], reverse=True)
+    runningDict = dict()  # task name to (process, start time)
+    stateDict = dict()
+    try:
+        while pendingList or runningDict:
+            for task in list(pendingList):
+                taskName, dependencies = task[0], task[3]
+                unfinishedList = [name for name in dependencies if stateDict.get(name) in ('failed', 'skipped')]
+                if unfinishedList:
+                    pendingList.remove(task)
+                    stateDict[taskName] = 'skipped'
+                    print "Skipped  %-16s %s did not finish" % (taskName, ', '.join(unfinishedList))
+                elif all(stateDict.get(name) == 'done' for name in dependencies) and len(runningDict) < taskCount:
+                    pendingList.remove(task)
+                    runningDict[taskName] = (startTask(task, topDir, outDir, parserArgs, workerCount), time.time())
+            time.sleep(POLL_INTERVAL)
+            for taskName, (process, startTime) in runningDict.items():
+                if process.is_alive():
+                    continue
+                process.join()
+                del runningDict[taskName]
+                duration = stageMetrics.formatDuration(time.time() - startTime)
+                if process.exitcode == 0:
+                    stateDict[taskName] = 'done'
+                    print "Finished %-16s %10s" % (taskName, duration)
+                else:
+                    stateDict[taskName] = 'failed'
+                    shutil.rmtree(getStagingDir(outDir, taskName), ignore_errors=True)
+                    print "FAILED   %-16s %10s, exit code %s, log %s:" % (taskName, duration, process.exitcode,
+                                                                         getLogPath(outDir, taskName))
+                    printLogTail(getLogPath(outDir, taskName))
+                sys.stdout.flush()
+    except KeyboardInterrupt:
+        for taskName, (process, startTime) in runningDict.items():
+            process.terminate()
+            process.join()
+            shutil.rmtree(getStagingDir(outDir, taskName), ignore_errors=True)
+        raise
+    return stateDict
+
+
+def main(argv):
+    """ If run as main script, function executes with user input """
+    topDir = ""
+    taskCount = multiprocessing.cpu_count()
+    workerCount = 1
+    selectedList = None
+    parserArgs = []
+    try:
+        opts, args = getopt.getopt(argv, "hp:j:w:s:fz", ["help", "dirPath=", "jobs=", "workers=", "source=", "force", "gzip"])
+        if len(argv) == 0:
+            howToRun()
+    except getopt.GetoptError:
+        howToRun()
+    for opt, arg in opts:
+        if opt in ['-h', '--help']:
+            howToRun()
+        elif opt in ['-p', '--dirPath']:
+            if not arg.endswith("/"):
+                arg = arg + "/"
+            topDir = arg
+        elif opt in ['-j', '--jobs']:
+            taskCount = int(arg)
+        elif opt in ['-w', '--workers']:
+            workerCount = int(arg)
+        elif opt in ['-s', '--source']:
+            selectedList = arg.strip().split(',')
+        elif opt in ['-f', '--force']:
+            parserArgs.append('-f')
+        elif opt in ['-z', '--gzip']:
+            parserArgs.append('-z')
+    if not topDir:
+        howToRun()
+    outDir = general.createOutDirectory(topDir)
+
+    print "\n\n=====================================  BUILDING %s =====================================\n" % topDir
+    taskList = findTasks(topDir, selectedList)
+    if not taskList:
+        print "No source directories found"
+        sys.exit(1)
+    startTime = time.time()
+    stateDict = runTasks(taskList, topDir, outDir, parserArgs, max(taskCount, 1), workerCount)
+    shutil.rmtree(os.path.join(outDir, STAGING_DIR), ignore_errors=True)
+    doneCount = stateDict.values().count('done')
+    print "\n%d of %d sources built in %s, parser logs in %sbuildAll.<source>.log" % (
+        doneCount, len(taskList), stageMetrics.formatDuration(time.time() - startTime), outDir)
+    if doneCount != len(taskList):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+
+import os
+import json
+import fcntl
+import hashlib
+import batchWriter
+
+"""
+##################################################################################################################
+##########################################   Build Manifest   ##################################################
+##################################################################################################################
+
+* Incremental rebuilds for every parser entry point (refactor.py, ttdMeshParser.py, ontologyParser.py,
+    taxonomyParser.py, nalParser.py).
+* csv_out/buildManifest.json records, per output key, the SHA-1 of each input file (raw dumps and JSON
+    attribute configs), a parser version hashed from the parser source files, and the outputs written.
+* A rerun skips an output key whose inputs, config and parser version are unchanged and whose outputs still exist.
+* File hashes are cached by (size, mtime), so unchanged multi-GB dumps are not rehashed on every run.
+* Several parsers may share one csv_out/, so saving merges this run's entries into the file under a lock.
+"""
+
+MANIFEST_NAME = 'buildManifest.json'
+
+
+class BuildManifest(object):
+    """
+    Holds manifest entries loaded from outDir, and entries recorded during this run.
+    With force=True every output is reported stale, but entries are still recorded.
+    """
+    def __init__(self, outDir, force=False):
+        self.path = os.path.join(outDir, MANIFEST_NAME)
+        self.force = force
+        manifest = self.load()
+        self.entries = manifest['entries']
+        self.hashCache = manifest['hashCache']
+        self.changedEntries = dict()
+
+    def load(self):
+        """ Returns manifest dict from disk, empty manifest if missing or unreadable """
+        try:
+            with open(self.path, 'r') as manifestFile:
+                manifest = json.load(manifestFile)
+            manifest.setdefault('entries', dict())
+            manifest.setdefault('hashCache', dict())
+            return manifest
+        except (IOError, ValueError):
+            return {'entries': dict(), 'hashCache': dict()}
+
+    def hashFile(self, filePath):
+        """ Returns SHA-1 hex digest of filePath, reusing the cached digest while size and mtime are unchanged """
+        fileStat = os.stat(filePath)
+        cached = self.hashCache.get(filePath)
+        if cached and cached[0] == fileStat.st_size and cached[1] == fileStat.st_mtime:
+            return cached[2]
+        digest = hashlib.sha1()
+        with open(filePath, 'rb') as inFile:
+            for chunk in iter(lambda: inFile.read(1 << 20), ''):
+                digest.update(chunk)
+        self.hashCache[filePath] = [fileStat.st_size, fileStat.st_mtime, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def getSignature(self, inputPaths, parserVersion):
+        """ Returns dict of input path to digest ('missing' for absent inputs) and parser version """
+        inputDict = dict()
+        for inputPath in inputPaths:
+            inputDict[inputPath] = self.hashFile(inputPath) if os.path.isfile(inputPath) else 'missing'
+        return {'inputs': inputDict, 'version': parserVersion}
+
+    def isCurrent(self, outputKey, inputPaths, parserVersion):
+        """ True if outputKey was built from identical inputs and parser version, and its outputs still exist """
+        if self.force:
+            return False
+        entry = self.entries.get(outputKey)
+        if not entry or entry['signature'] != self.getSignature(inputPaths, parserVersion):
+            return False
+        return all(os.path.isfile(outputPath) for outputPath in entry['outputs'])
+
+    def record(self, outputKey, inputPaths, parserVersion, outputPaths):
+        """
+        Records that outputPaths were built for outputKey from inputPaths, and saves the manifest.
+        Staged outputs (batchWriter.stageOutputs()) are moved into place first.
+        """
+        batchWriter.publishOutputs(outputPaths)
+        entry = {'signature': self.getSignature(inputPaths, parserVersion), 'outputs': list(outputPaths)}
+        self.entries[outputKey] = entry
+        self.changedEntries[outputKey] = entry
+        self.save()
+
+    def save(self):
+        """ Merges entries recorded in this run into the manifest on disk, written atomically under a lock """
+        with open(self.path + '.lock', 'w') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            manifest = self.load()
+            manifest['entries'].update(self.changedEntries)
+            manifest['hashCache'].update(self.hashCache)
+            with open(self.path + '.tmp', 'w') as manifestFile:
+                json.dump(manifest, manifestFile, indent=1, sort_keys=True)
+            os.rename(self.path + '.tmp', self.path)
+
+
+def getParserVersion(*sourcePaths):
+    """ Returns digest of parser source files (module __file__ paths), changes whenever the parser code does """
+    digest = hashlib.sha1()
+    for sourcePath in sourcePaths:
+        if sourcePath.endswith('.pyc'):
+            sourcePath = sourcePath[:-1]
+        with open(sourcePath, 'rb') as sourceFile:
+            digest.update(sourceFile.read())
+    digest.update(str(batchWriter.compressOutputs))  # plain and gzip outfiles are different builds
+    return digest.hexdigest()
+
+
+def listInputs(sourcePath):
+    """ Returns sorted paths of files directly inside sourcePath """
+    return sorted(os.path.join(sourcePath, name) for name in os.listdir(sourcePath)
+                  if os.path.isfile(os.path.join(sourcePath, name)))
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+
+import os
+import mmap
+import shutil
+import multiprocessing
+import batchWriter
+import inputReader
+
+"""
+##################################################################################################################
+##########################################   Chunked Ingestion   ###############################################
+##################################################################################################################
+
+* Memory maps large flat files (gene2pubmed, gene2go, CTD_chem_gene_ixns.tsv) and cuts them into
+    newline aligned byte ranges, so a single file can be parsed by every core.
+* Each range is parsed by a worker process through SourceClass.parseTsvRange(), which applies the same
+    comment skipping and column selection as SourceClass.parseTsvFile().
+* Row writers: each range writes to its own part file, parts are concatenated in order onto the .out file.
+    For .gz outfiles each part is a gzip member, and concatenated members are a valid gzip file.
+* Row aggregators: each range returns a partial aggregate which is merged in the parent process.
+* Workers are forked, so they see state filled beforehand (SourceClass.completeNodeSet, typeDict).
+"""
+
+# Set right before a pool is forked; read by rangeWriter() and rangeAggregator() in the workers.
+# Bound methods can not be pickled under Python 2, so the job is inherited instead of sent.
+activeJob = dict()
+
+
+def getByteRanges(filePath, chunkCount, separator='\n'):
+    """
+    Memory maps filePath and returns up to chunkCount (start, end) byte ranges covering the file.
+    Each range after the first starts right after the first character of a separator match,
+    '\\n' gives line aligned ranges, '\\n*NEWRECORD' gives MeSH record aligned ranges.
+    """
+    size = os.path.getsize(filePath)
+    if size == 0:
+        return []
+    boundaryList = [0]
+    with open(filePath, 'rb') as inFile:
+        fileMap = mmap.mmap(inFile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for i in range(1, chunkCount):
+                guess = max(size * i // chunkCount, boundaryList[-1])
+                found = fileMap.find(separator, guess)
+                if found == -1:
+                    break
+                if found + 1 > boundaryList[-1]:
+                    boundaryList.append(found + 1)
+        finally:
+            fileMap.close()
+    boundaryList.append(size)
+    return [(start, end) for start, end in zip(boundaryList[:-1], boundaryList[1:]) if start < end]
+
+
+def iterRangeLines(filePath, start, end):
+    """ Generator yielding lines of filePath from byte offset start up to byte offset end """
+    with open(filePath, 'rb') as inFile:
+        fileMap = mmap.mmap(inFile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            fileMap.seek(start)
+            while fileMap.tell() < end:
+                yield fileMap.readline()
+        finally:
+            fileMap.close()
+
+
+def canSplit(sourceInstance, chunkCount):
+    """
+    True if infile can be split into chunkCount ranges run by a process pool.
+    Pool workers are daemonic and can not fork pools of their own (refactor.py -j), so they parse whole files.
+    Compressed infiles can not be memory mapped and are parsed as a whole as well.
+    """
+    if chunkCount <= 1 or multiprocessing.current_process().daemon:
+        return False
+    return inputReader.isMappable(sourceInstance.filePath)
+
+
+def rangeWriter(rangeArgs):
+    """ Pool worker: writes formatted rows of one byte range to its part file """
+    index, start, end = rangeArgs
+    sourceInstance, formatRow = activeJob['source'], activeJob['formatRow']
+    partPath = "%s.part%d" % (sourceInstance.outPath, index)
+    if sourceInstance.outPath.endswith('.gz'):
+        partPath += '.gz'
+    rowCount = 0
+    writeCount = 0
+    with batchWriter.BatchWriter(partPath) as partFile:
+        for filteredRow in sourceInstance.parseTsvRange(start, end):
+            rowCount += 1
+            outString = formatRow(filteredRow)
+            if outString:
+                writeCount += 1
+                partFile.write(outString)
+    return partPath, rowCount, writeCount
+
+
+def rangeAggregator(rangeArgs):
+    """ Pool worker: returns partial aggregate of the rows in one byte range """
+    index, start, end = rangeArgs
+    sourceInstance, aggregateRows = activeJob['source'], activeJob['aggregateRows']
+    return aggregateRows(sourceInstance.parseTsvRange(start, end))
+
+
+def runRanges(worker, sourceInstance, chunkCount, **job):
+    """ Forks a pool over the byte ranges of sourceInstance.filePath, returns worker results in file order """
+    rangeList = getByteRanges(sourceInstance.filePath, chunkCount)
+    activeJob.clear()
+    activeJob.update(job, source=sourceInstance)
+    pool = multiprocessing.Pool(min(chunkCount, len(rangeList)) or 1)
+    try:
+        resultList = pool.map(worker, [(i, start, end) for i, (start, end) in enumerate(rangeList)], chunksize=1)
+    except:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+        activeJob.clear()
+    return resultList
+
+
+def writeRows(sourceInstance, formatRow, chunkCount=1):
+    """
+    Appends formatRow(filteredRow) for every row of sourceInstance's infile onto its outPath.
+    formatRow returns the finished output line(s), or None for rows that are filtered out.
+    Splits the infile into chunkCount ranges when possible.
+    Returns (rowCount, writeCount)
+    """
+    if not canSplit(sourceInstance, chunkCount):
+        rowCount = 0
+        writeCount = 0
+        with batchWriter.openOutput(sourceInstance.outPath, 'a') as outFile:
+            for filteredRow in sourceInstance.parseTsvFile():
+                rowCount += 1
+                outString = formatRow(filteredRow)
+                if outString:
+                    writeCount += 1
+                    outFile.write(outString)
+        return rowCount, writeCount
+
+    resultList = runRanges(rangeWriter, sourceInstance, chunkCount, formatRow=formatRow)
+    rowCount = 0
+    writeCount = 0
+    with open(batchWriter.getWritePath(sourceInstance.outPath), 'ab') as outFile:
+        for partPath, partRowCount, partWriteCount in resultList:
+            rowCount += partRowCount
+            writeCount += partWriteCount
+            partPath = batchWriter.getWritePath(partPath)
+            with open(partPath, 'rb') as partFile:
+                shutil.copyfileobj(partFile, outFile, 1 << 20)
+            os.remove(partPath)
+    return rowCount, writeCount
+
+
+def aggregateRows(sourceInstance, aggregate, merge, chunkCount=1):
+    """
+    Runs aggregate(rowIterable) over sourceInstance's infile and returns the result.
+    When split into ranges, partial results are combined in file order with merge(total, partial).
+    """
+    if not canSplit(sourceInstance, chunkCount):
+        return aggregate(sourceInstance.parseTsvFile())
+    resultList = runRanges(rangeAggregator, sourceInstance, chunkCount, aggregateRows=aggregate)
+    if not resultList:
+        return aggregate(iter([]))
+    total = resultList[0]
+    for partial in resultList[1:]:
+        merge(total, partial)
+    return total
@@ -1,12 +1,14 @@
 #!/usr/bin/python
 
-from collections import defaultdict
-from collections import OrderedDict
+import os
 import locale
-import time
-from sourceclass import SourceClass
+from parent import SourceClass
+import batchWriter
+import chunkedIngest
+import spillGroup
+import stageMetrics
 
-typeDict = defaultdict(dict)
+typeDict = dict()  # TypeName to pre-joined 'Code|Description|ParentCode|Source', see getChemGeneTypes()
 chemGeneHeader = list()
 
 
@@ -20,138 +22,152 @@ class CTD(SourceClass):
                                   inputAttributes, fileHeader, ignoredAttributes)
 
     def checkFile(self):
+        """ Dispatches on file name, the file is parsed as one stageMetrics stage """
+        self.plan = self.parent.getRowPlan()
+        with stageMetrics.stage(self.parent.file, [self.parent.filePath]) as self.stage:
+            if self.parent.file == 'CTD_chem_gene_ixn_types.tsv':
+                self.getChemGeneTypes()
 
-        # if self.parent.file == 'CTD_chem_gene_ixn_types.tsv':
-        #     self.getChemGeneTypes()
+            elif self.parent.file == 'CTD_chem_gene_ixns.tsv':
+                self.parent.writeHeader()
+                self.writeChemGeneRelationships()
 
-        # elif self.parent.file == 'CTD_chem_gene_ixns.tsv':
-        #     self.parent.writeHeader()
-        # #     self.writeChemGeneRelationships()
+            elif self.parent.file == 'CTD_chemicals_diseases.tsv':
+                self.parent.writeHeader()
+                self.writeChemDiseaseRelationships()
 
-        # if self.parent.file == 'CTD_chemicals_diseases.tsv':
-        #     self.parent.writeHeader()
-        #     self.writeChemDiseaseRelationships()
+            elif self.parent.file == 'CTD_genes_pathways.tsv':
+                self.parent.writeHeader()
+                self.writeGenePathwayRelationships()
 
-        # elif self.parent.file == 'CTD_genes_pathways.tsv':
-        #     self.parent.writeHeader()
-        # #     self.writeGenePathwayRelationships()
+            elif self.parent.file == 'CTD_diseases_pathways.tsv':
+                self.parent.writeHeader()
+                self.writeDiseasePathwayRelationships()
 
-        # elif self.parent.file == 'CTD_diseases_pathways.tsv':
-        #     self.parent.writeHeader()
-        # #     self.writeDiseasePathwayRelationships()
+            elif self.parent.file == 'CTD_chem_pathways_enriched.tsv':
+                self.parent.writeHeader()
+                self.writeChemPathwayRelationships()
 
-        # if self.parent.file == 'CTD_chem_pathways_enriched.tsv':
-        #     self.parent.writeHeader()
-        #     self.writeChemPathwayRelationships()
-
-        # elif self.parent.file == 'CTD_chem_go_enriched.tsv':
-        #     self.parent.writeHeader()
-        #     # self.writeChemGoRelationships()
+            elif self.parent.file == 'CTD_chem_go_enriched.tsv':
+                self.parent.writeHeader()
+                self.writeChemGoRelationships()
 
     def writeChemGoRelationships(self):
         """ CTD_chem_go_enriched.tsv """
-        with open(self.parent.outPath, 'a') as outFile:
+        plan = self.parent.getRowPlan()
+        getReln = plan.getter('ChemicalID', 'GOTermID', 'PValue', 'CorrectedPValue')
+        relnSuffix = '|involved_in|' + plan.sourceName + '\n'
+        with batchWriter.openOutput(self.parent.outPath, 'a') as outFile:
             for filteredRow in self.parent.parseTsvFile():
-                zippedRow = OrderedDict(zip(self.parent.outHeader, filteredRow))
-                relnString = '|'.join((zippedRow['ChemicalID'], zippedRow['GOTermID'], zippedRow['PValue'],
-                                       zippedRow['CorrectedPValue'], 'involved_in', self.parent.getFullSourceName()))
                 #  write rev reln
-                outFile.write(relnString + '\n')
+                outFile.write('|'.join(getReln(filteredRow)) + relnSuffix)
 
     def writeChemPathwayRelationships(self):
         """ CTD_chem_pathways_enriched.tsv """
-        with open(self.parent.outPath, 'a') as outFile:
+        plan = self.parent.getRowPlan()
+        getReln = plan.getter('ChemicalID', 'PathwayID', 'PValue')
+        relnSuffix = '|' + plan.sourceName + '|involved_in\n'
+        with batchWriter.openOutput(self.parent.outPath, 'a') as outFile:
             for filteredRow in self.parent.parseTsvFile():
-                zippedRow = OrderedDict(zip(self.parent.outHeader, filteredRow))
-                outString = '|'.join((zippedRow['ChemicalID'], zippedRow['PathwayID'], zippedRow['PValue'],
-                                      self.parent.getFullSourceName(), 'involved_in'))
                 #  write rev reln...or not?
                 #  forward reln....<Chemical> involved_in <pathway>...or use involved_in_pathway
                 #  then use <pathway> involves_chemical <chemical>??
-                outFile.write(outString + '\n')
+                outFile.write('|'.join(getReln(filteredRow)) + relnSuffix)
 
     def getChemGeneTypes(self):
-        """ CTD_chem_gene_ixn_types.tsv """
+        """
+        CTD_chem_gene_ixn_types.tsv
+        Fills typeDict with each TypeName's pre-joined 'Code|Description|ParentCode|Source' line ending,
+        so chemical-gene actions need one lookup and no joins.
+        """
+        typeNameIndex, codeIndex, descriptionIndex, parentCodeIndex = [
+            self.plan.index(header) for header in ['TypeName', 'Code', 'Description', 'ParentCode']]
+        typeCount = 0
         for filteredRow in self.parent.parseTsvFile():
-            zippedRow = OrderedDict(zip(self.parent.outHeader, filteredRow))
-            typeDict[zippedRow['TypeName']]
-            for header, attr in zippedRow.iteritems():
-                if header != 'TypeName':
-                    typeDict[zippedRow['TypeName']][header] = attr
+            typeCount += 1
+            typeDict[filteredRow[typeNameIndex]] = '|'.join((filteredRow[codeIndex], filteredRow[descriptionIndex],
+                                                             filteredRow[parentCodeIndex], self.plan.sourceName))
+        self.stage.count(rowsIn=typeCount, rowsOut=len(typeDict))
 
     def writeChemGeneRelationships(self):
-        """ CTD_chem_gene_ixns.tsv """
-        with open(self.parent.outPath, 'a') as outFile:
-            start = time.clock()
-            for filteredRow in self.parent.parseTsvFile():
-                zippedRow = self.addSourceNames(OrderedDict(zip(self.parent.outHeader, filteredRow)))
-                zippedRow['InteractionActions'] = zippedRow['InteractionActions'].replace('^', '_').split(';')
-                for action in zippedRow['InteractionActions']:
-                    typeName = action.split('_')[1]
-                    relnString = '|'.join((zippedRow['ChemicalID'], zippedRow['GeneID'], zippedRow['Organism'],
-                                           zippedRow['OrganismID'], zippedRow['Interaction'], action, zippedRow['PubMedIDs'],
-                                           typeDict[typeName]['Code'], typeDict[typeName]['Description'],
-                                           typeDict[typeName]['ParentCode'], self.parent.getFullSourceName()))
-                    outFile.write(relnString + '\n')
-                    #  no rev reln for now
-            end = time.clock()
-            print 'time: ', end - start
+        """
+        CTD_chem_gene_ixns.tsv
+        Rows are formatted by formatChemGeneRow(), through chunkedIngest.py: with refactor.py -c N
+        the file is sharded into N byte ranges written by parallel workers and merged in file order.
+        """
+        print "Parsing %s\n" % self.parent.filePath
+        self.getRelnStart = self.plan.getter('ChemicalID', 'GeneID', 'Organism', 'OrganismID', 'Interaction')
+        self.pubmedIndex, self.actionIndex = self.plan.index('PubMedIDs'), self.plan.index('InteractionActions')
+        rowCount, writeCount = chunkedIngest.writeRows(self.parent, self.formatChemGeneRow, self.parent.chunkCount)
+        self.stage.count(rowsIn=rowCount, rowsOut=writeCount, rowsFiltered=rowCount - writeCount)
+        print '\t%s chemical-gene interaction rows have been written.\n' % locale.format('%d', writeCount, True)
+
+    def formatChemGeneRow(self, filteredRow):
+        """ Returns one relationship line per interaction action of filteredRow, no rev reln for now """
+        row = self.plan.prefixRow(filteredRow)
+        relnStart = '|'.join(self.getRelnStart(row))
+        pubmedIDs = row[self.pubmedIndex]
+        lineList = []
+        for action in row[self.actionIndex].replace('^', '_').split(';'):
+            lineList.append('%s|%s|%s|%s\n' % (relnStart, action, pubmedIDs, typeDict[action.split('_')[1]]))
+        return ''.join(lineList)
 
     def writeChemDiseaseRelationships(self):
         """ CTD_chemicals_diseases.tsv """
-        with open(self.parent.outPath, 'a') as outFile:
-            relnDict = self.processRelationshipInfo()
-            for relnTup, nodeInfo in relnDict.iteritems():
+        relnCount = 0
+        with batchWriter.openOutput(self.parent.outPath, 'a') as outFile, self.processRelationshipInfo() as relnGroups:
+            for relnTup, nodeInfo in relnGroups.iteritems():
+                relnCount += 1
                 outString = '|'.join(('|'.join(relnTup), ';'.join(nodeInfo['DirectEvidence']),
                                       ';'.join(nodeInfo['InferenceGeneSymbol']), ';'.join(nodeInfo['InferenceScore']),
-                                      ';'.join(nodeInfo['OmimIDs']), 'associated_with', self.parent.getFullSourceName()))
-                print outString
+                                      ';'.join(nodeInfo['OmimIDs']), 'associated_with', self.plan.sourceName))
                 #  rev reln...forward is <chemical> 'associated_with' <disease>, rev also 'associated_with'?
-                # outFile.write(outString + '\n')
+                outFile.write(outString + '\n')
+        self.stage.count(rowsOut=relnCount)
 
     def writeGenePathwayRelationships(self):
         """ CTD_genes_pathways.tsv """
-        with open(self.parent.outPath, 'a') as outFile:
+        plan = self.parent.getRowPlan()
+        relnSuffix = '|' + plan.sourceName + '|involved_in\n'
+        with batchWriter.openOutput(self.parent.outPath, 'a') as outFile:
             for filteredRow in self.parent.parseTsvFile():
-                zippedRow = self.addSourceNames(OrderedDict(zip(self.parent.outHeader, filteredRow)))
-                outString = '|'.join(zippedRow.values()) + '|' + self.parent.getFullSourceName() + '|involved_in'
-                outFile.write(outString + '\n')
+                outFile.write('|'.join(plan.prefixRow(filteredRow)) + relnSuffix)
                 #  rev reln...forward is <gene> 'involved_in' <pathway>
 
     def writeDiseasePathwayRelationships(self):
         """ CTD_diseases_pathways.tsv """
-        with open(self.parent.outPath, 'a') as outFile:
-            relnDict = self.processRelationshipInfo()
-            for relnTup, nodeInfo in relnDict.iteritems():
+        relnCount = 0
+        with batchWriter.openOutput(self.parent.outPath, 'a') as outFile, self.processRelationshipInfo() as relnGroups:
+            for relnTup, nodeInfo in relnGroups.iteritems():
+                relnCount += 1
                 outString = ('|'.join(relnTup) + '|' + ';'.join(nodeInfo['InferenceGeneSymbol']) +
-                             '|' + self.parent.getFullSourceName() + '|involved_in')
+                             '|' + self.plan.sourceName + '|involved_in')
                 outFile.write(outString + '\n')
                 #  rev reln...forward is <disease> 'involved_in' <pathway>
+        self.stage.count(rowsOut=relnCount)
 
     def processRelationshipInfo(self):
-        """ """
-        relnDict = defaultdict(lambda: defaultdict(set))
+        """
+        Groups CTD_chemicals_diseases.tsv and CTD_diseases_pathways.tsv by relationship node ID tuple.
+        Returns SpillGroup holding a set of each other attribute's values per tuple, which spills to run files
+        next to the outfile once SourceClass.groupMemoryMB is reached, see spillGroup.py
+        """
         if self.parent.file == 'CTD_chemicals_diseases.tsv':
-            for filteredRow in self.parent.parseTsvFile():
-                zippedRow = self.addSourceNames(OrderedDict(zip(self.parent.outHeader, filteredRow)))
-                relnTup = (zippedRow['ChemicalID'], zippedRow['DiseaseID'])
-                for header, attr in zippedRow.iteritems():
-                    if header not in ['DiseaseID', 'ChemicalID']:
-                        if attr:
-                            relnDict[relnTup][header].add(attr)
-            return relnDict
-
+            relnHeaders, skippedHeaders = ['ChemicalID', 'DiseaseID'], ['DiseaseID', 'ChemicalID']
         elif self.parent.file == 'CTD_diseases_pathways.tsv':
-            for filteredRow in self.parent.parseTsvFile():
-                zippedRow = self.addSourceNames(OrderedDict(zip(self.parent.outHeader, filteredRow)))
-                relnTup = (zippedRow['DiseaseID'], zippedRow['PathwayID'])
-                for header, attr in zippedRow.iteritems():
-                    if header not in ['DiseaseID', 'PathwayID', 'PathwayName', 'DiseaseName']:
-                        if attr:
-                            relnDict[relnTup][header].add(attr)
-            return relnDict
-
-
-
-
-
+            relnHeaders, skippedHeaders = ['DiseaseID', 'PathwayID'], ['DiseaseID', 'PathwayID', 'PathwayName', 'DiseaseName']
+        else:
+            return None
+        getRelnTup = self.plan.getter(*relnHeaders)
+        attrColumns = [(header, index) for header, index in sorted(self.plan.columns.items(), key=lambda item: item[1])
+                       if header not in skippedHeaders]
+        getAttrs = self.plan.getter(*[header for header, index in attrColumns])
+        relnGroups = spillGroup.SpillGroup([header for header, index in attrColumns], self.parent.groupMemoryMB << 20,
+                                           os.path.dirname(self.parent.outPath))
+        rowCount = 0
+        for filteredRow in self.parent.parseTsvFile():
+            rowCount += 1
+            row = self.plan.prefixRow(filteredRow)
+            relnGroups.add(getRelnTup(row), getAttrs(row))
+        self.stage.count(rowsIn=rowCount)
+        return relnGroups
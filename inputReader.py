@@ -0,0 +1,154 @@
+#!/usr/bin/python
+
+import os
+import sys
+import gzip
+import errno
+import signal
+import shutil
+import threading
+import subprocess
+import stageMetrics
+
+"""
+##################################################################################################################
+##########################################   Input Reader   ####################################################
+##################################################################################################################
+
+* Shared input layer for every parser reading upstream dumps.
+* openInput() reads plain files, gzip compressed dumps (gene_info.gz, gene2go.gz, CTD_*.tsv.gz, ...) and '-' for stdin,
+    so dumps no longer need a decompressed copy on scratch disk. Parsers taking one infile pass '-' through (nalParser.py -i -).
+* .gz files are decompressed by a 'gzip -dc' subprocess, which runs on its own core while the parser
+    reads its output through a pipe. Without a gzip binary a background thread decompresses into the pipe instead.
+* resolveInput() finds 'names.dmp.gz' when 'names.dmp' is asked for, stripCompression() gives the name
+    parsers match on ('TTD_download_raw.txt' for 'TTD_download_raw.txt.gz').
+* Byte range splitting (chunkedIngest.py, meshParser.py -j) needs a plain file, see isMappable().
+"""
+
+PIPE_BUFFER = 1 << 20
+
+
+def stripCompression(path):
+    """ Returns path without a trailing .gz """
+    if path.endswith('.gz'):
+        return path[:-3]
+    return path
+
+
+def resolveInput(path):
+    """ Returns path if it exists, otherwise path + '.gz' if that exists, otherwise path unchanged """
+    if path == '-' or os.path.exists(path) or not os.path.exists(path + '.gz'):
+        return path
+    return path + '.gz'
+
+
+def isMappable(path):
+    """ True if path is a plain file which can be memory mapped and split into byte ranges """
+    return path != '-' and not path.endswith('.gz') and os.path.isfile(path)
+
+
+def openInput(path, mode='r'):
+    """
+    Returns readable file object for path: '-' reads stdin, .gz is decompressed while being read,
+    any other path is opened with mode. Raises IOError like open() if path can not be read.
+    The infile is watched by the running stageMetrics stage, for progress lines.
+    """
+    if path == '-':
+        return StdinInput()
+    if not path.endswith('.gz'):
+        inFile = open(path, mode)
+        stageMetrics.watchInput(inFile, path)
+        return inFile
+    if not os.path.isfile(path):
+        raise IOError(2, 'No such file or directory', path)
+    try:
+        process = subprocess.Popen(['gzip', '-dc', path], stdout=subprocess.PIPE, bufsize=PIPE_BUFFER,
+                                   close_fds=True, preexec_fn=restoreSigpipe)
+    except OSError:
+        inFile = ThreadInput(path)
+        stageMetrics.watchInput(inFile, path)
+        return inFile
+    inFile = PipeInput(process.stdout, path, process)
+    stageMetrics.watchInput(inFile, path, process)
+    return inFile
+
+
+def restoreSigpipe():
+    """ Runs in the gzip child: python ignores SIGPIPE, gzip should die quietly when the reader stops early """
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+
+class PipeInput(object):
+    """
+    File like reader over the read end of a decompression pipe.
+    close() waits for the decompressor and raises IOError if it failed (corrupt or truncated .gz).
+    """
+    def __init__(self, pipeFile, path, process=None, thread=None):
+        self.pipeFile = pipeFile
+        self.name = path
+        self.process = process
+        self.thread = thread
+        self.error = None
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.pipeFile)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close(excType is None)
+
+    def read(self, size=-1):
+        return self.pipeFile.read(size)
+
+    def readline(self, size=-1):
+        return self.pipeFile.readline(size)
+
+    def close(self, checkStatus=True):
+        """ Closes the pipe and reaps the decompressor, raises IOError if it did not finish cleanly """
+        if self.closed:
+            return
+        self.closed = True
+        self.pipeFile.close()  # a decompressor still writing gets EPIPE and exits
+        if self.process:
+            status = self.process.wait()
+            if checkStatus and status not in (0, -13):  # -13: SIGPIPE, reader stopped early
+                raise IOError("gzip -dc %s exited with status %d" % (self.name, status))
+        if self.thread:
+            self.thread.join()
+            if checkStatus and self.error and getattr(self.error, 'errno', None) != errno.EPIPE:
+                raise IOError("could not decompress %s: %s" % (self.name, self.error))
+
+
+class ThreadInput(PipeInput):
+    """ PipeInput fed by a background thread decompressing with the gzip module """
+    def __init__(self, path):
+        readFD, writeFD = os.pipe()
+        PipeInput.__init__(self, os.fdopen(readFD, 'rb', PIPE_BUFFER), path)
+        self.thread = threading.Thread(target=self.decompress, args=(os.fdopen(writeFD, 'wb', PIPE_BUFFER),))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def decompress(self, pipeOut):
+        """ Thread: copies decompressed bytes of the .gz file into the pipe """
+        try:
+            with gzip.open(self.name, 'rb') as gzFile:
+                shutil.copyfileobj(gzFile, pipeOut, PIPE_BUFFER)
+        except (IOError, EOFError, OSError) as error:
+            self.error = error
+        finally:
+            try:
+                pipeOut.close()
+            except IOError:
+                pass
+
+
+class StdinInput(PipeInput):
+    """ PipeInput over sys.stdin, closing it leaves stdin open """
+    def __init__(self):
+        PipeInput.__init__(self, sys.stdin, '<stdin>')
+
+    def close(self, checkStatus=True):
+        self.closed = True
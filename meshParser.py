@@ -5,6 +5,10 @@ import os
 import getopt
 import locale
 import time
+import multiprocessing
+import chunkedIngest
+import inputReader
+import parseCache
 # import general
 from collections import defaultdict
 """
@@ -73,10 +77,76 @@ Written by: Brandon Burciaga
 #     return totalMeshNodeSet
 
 
-def meshData(meshFilePath, meshNodeOutFile):
+MESH_FIELDS = ['unique_id', 'term', 'synonyms', 'semantic_type', 'mesh_tree_number', 'semantic_relationship']
+TREE_FIELDS = ['heading', 'tree_number']
+
+
+def meshData(meshFilePath, meshNodeOutFile, workerCount=1):
+    """
+    Writes MeSH nodes of meshFilePath from its parse cache table, parsed through iterMeshRecords() unless cached.
+    With workerCount > 1 records of a plain (not .gz) file are parsed in parallel by parseMeshParallel().
+    Returns treeRelnDict of tree number to unique ID, and set of unique IDs in this file.
+    """
+    treeRelnDict = dict()
+    fileNodeSet = set()
+    codeVersion = parseCache.getCodeVersion(getBlock, parseBlocks, getMeshRecord)
+    with parseCache.getTable(meshFilePath, 'nodes', codeVersion,
+                             lambda: (MESH_FIELDS, iterMeshRecords(meshFilePath, workerCount))) as meshTable:
+        for meshNodeDict in meshTable.iterDicts():
+            indexMeshNode(meshNodeDict, treeRelnDict, fileNodeSet)
+            writeMeSHNodes(meshNodeDict, meshNodeOutFile)
+    return treeRelnDict, fileNodeSet
+
+
+def iterMeshRecords(meshFilePath, workerCount=1):
+    """ Yields a record of MESH_FIELDS values for each MeSH block of meshFilePath, in file order """
+    if workerCount > 1 and inputReader.isMappable(meshFilePath):
+        for recordList in parseMeshParallel(meshFilePath, workerCount):
+            for record in recordList:
+                yield record
+        return
+    with inputReader.openInput(meshFilePath, 'rU') as meshFile:
+        for meshNodeDict in parseBlocks(getBlock(meshFile)):
+            yield getMeshRecord(meshNodeDict)
+
+
+def parseMeshParallel(meshFilePath, workerCount):
+    """
+    Splits MeSH file into workerCount byte ranges at *NEWRECORD boundaries, parsed by parseMeshRange() in a pool.
+    Returns record lists of the ranges in file order.
+    """
+    rangeList = chunkedIngest.getByteRanges(meshFilePath, workerCount, '\n*NEWRECORD')
+    pool = multiprocessing.Pool(min(workerCount, len(rangeList)) or 1)
+    try:
+        resultList = pool.map(parseMeshRange, [(meshFilePath, start, end) for start, end in rangeList], chunksize=1)
+    except:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+    return resultList
+
+
+def parseMeshRange(rangeArgs):
+    """
+    Pool worker for parseMeshParallel(), returns the records of one byte range of a MeSH file,
+    value sets as lists so joined values keep the order they had in the worker.
     """
-    Creates defaultdict of MeSH block attributes.
-    Feeds dict and outfile into writeMeSHNodes() function.
+    meshFilePath, start, end = rangeArgs
+    blockList = getBlock(chunkedIngest.iterRangeLines(meshFilePath, start, end))
+    return [[list(values) for values in getMeshRecord(meshNodeDict)] for meshNodeDict in parseBlocks(blockList)]
+
+
+def getMeshRecord(meshNodeDict):
+    """ Returns MESH_FIELDS value sets of meshNodeDict """
+    return [meshNodeDict[field] for field in MESH_FIELDS]
+
+
+def parseBlocks(blockList):
+    """
+    Yields defaultdict of MeSH block attributes for each block from getBlock().
 
     Attributes:
     MH, NM, SH = MeSH Heading, Name of substance, Subheading (preferred term)
@@ -86,46 +156,43 @@ def meshData(meshFilePath, meshNodeOutFile):
     ST = Semantic Type
     ENTRY, PRINT ENTRY, SY = Synonyms
     """
-    treeRelnDict = dict()
-    fileNodeSet = set()
-
-    with open(meshFilePath, 'rU') as meshFile:
-        for block in getBlock(meshFile):  # generator object
-            meshNodeDict = defaultdict(set)
-
-            for attribute in block:
-                split = attribute.split(' = ')
-                if not len(split) == 1:
-                    key = split[0]
-                    value = split[1]
-                    if key in ['MH', 'NM', 'SH']:
-                        meshNodeDict['term'].add(value)
-                    elif key == 'UI':
-                        meshNodeDict['unique_id'].add(value)
-                        fileNodeSet.add(value)
-                    elif key in ['MH', 'RN', 'NM']:
-                        meshNodeDict['synonyms'].add(value)
-                    elif key == 'MN':
-                        meshNodeDict['mesh_tree_number'].add(value)
-                    elif key == 'ST':
-                        meshNodeDict['semantic_type'].add(value)
-                    elif key in ['ENTRY', 'PRINT ENTRY', 'SY']:
-                        splitValue = value.split("|")
-                        if len(splitValue) == 1:
-                            meshNodeDict['synonyms'].add(splitValue[0])
-                        else:
-                            header = splitValue[-1]
-                            meshNodeDict['synonyms'].add(splitValue[0])
-                            headerIndex = header.index('d')
-                            semanticRelationship = splitValue[headerIndex]
-                            meshNodeDict['semantic_relationship'].add(semanticRelationship)
-            uniqueID = "".join(meshNodeDict['unique_id'])
-            treeNums = meshNodeDict['mesh_tree_number']
-            if treeNums:
-                for treeNum in treeNums:
-                    treeRelnDict[treeNum] = uniqueID
-            writeMeSHNodes(meshNodeDict, meshNodeOutFile)
-    return treeRelnDict, fileNodeSet
+    for block in blockList:  # generator object
+        meshNodeDict = defaultdict(set)
+
+        for attribute in block:
+            split = attribute.split(' = ')
+            if not len(split) == 1:
+                key = split[0]
+                value = split[1]
+                if key in ['MH', 'NM', 'SH']:
+                    meshNodeDict['term'].add(value)
+                elif key == 'UI':
+                    meshNodeDict['unique_id'].add(value)
+                elif key in ['MH', 'RN', 'NM']:
+                    meshNodeDict['synonyms'].add(value)
+                elif key == 'MN':
+                    meshNodeDict['mesh_tree_number'].add(value)
+                elif key == 'ST':
+                    meshNodeDict['semantic_type'].add(value)
+                elif key in ['ENTRY', 'PRINT ENTRY', 'SY']:
+                    splitValue = value.split("|")
+                    if len(splitValue) == 1:
+                        meshNodeDict['synonyms'].add(splitValue[0])
+                    else:
+                        header = splitValue[-1]
+                        meshNodeDict['synonyms'].add(splitValue[0])
+                        headerIndex = header.index('d')
+                        semanticRelationship = splitValue[headerIndex]
+                        meshNodeDict['semantic_relationship'].add(semanticRelationship)
+        yield meshNodeDict
+
+
+def indexMeshNode(meshNodeDict, treeRelnDict, fileNodeSet):
+    """ Adds tree number to unique ID mapping of meshNodeDict to treeRelnDict, and its unique IDs to fileNodeSet """
+    fileNodeSet.update(meshNodeDict['unique_id'])
+    uniqueID = "".join(meshNodeDict['unique_id'])
+    for treeNum in meshNodeDict['mesh_tree_number']:
+        treeRelnDict[treeNum] = uniqueID
 
 
 def getBlock(meshFile):
@@ -143,47 +210,64 @@ def getBlock(meshFile):
 
 
 def writeMeSHNodes(meshNodeDict, meshNodeOutFile):
-    """
-    Creates node string using properties from meshNodeDict.
-    Writes nodes to meshNodeOutFile.
-    """
+    """ Writes node string from formatMeSHNode() to meshNodeOutFile. """
+    meshNodeOutFile.write(formatMeSHNode(meshNodeDict))
+
+
+def formatMeSHNode(meshNodeDict):
+    """ Creates node string using properties from meshNodeDict. """
     nodeString = ("%s|MeSH|%s|%s|%s|%s|Medical_Heading\n" %
                   (''.join(meshNodeDict['unique_id']), ''.join(meshNodeDict['term']),
                    ';'.join(meshNodeDict['synonyms']), ';'.join(meshNodeDict['semantic_type']),
                    ';'.join(meshNodeDict['mesh_tree_number'])))
-    meshNodeOutFile.write(nodeString)
+    return nodeString
 
 
 def parseTree(meshFilePath, bigRelnDict, meshRelnOutFile):
     """
-    Parses MeSH Tree and creates a set of unique relationships.
-    Uses bigRelnDict to map mesh tree numbers back to unique node IDs.
-    Writes relationship from unique set.
+    Parses MeSH Tree and streams unique relationships between each tree number and every one of its ancestors.
+    Uses bigRelnDict to map mesh tree numbers back to unique node IDs, ancestors are found by walking
+    parent tree numbers ('A01.236' is the parent of 'A01.236.500') once per line.
+    Descriptors are numbered so written relationships are deduplicated as integer pairs, not full strings.
+    Tree numbers without a descriptor record are skipped and counted instead of raising KeyError.
+    (heading, tree number) pairs are read from the parse cache table, parsed by readTreeNumbers() unless cached.
     """
-    uniqueRelnSet = set()
-    with open(meshFilePath, 'rU') as inFile:
+    descriptorIndex = dict()
+    writtenPairDict = defaultdict(set)  # tree letter: set of (startIndex << 32 | endIndex)
+    relnCount = 0
+    missingCount = 0
+    with parseCache.getTable(meshFilePath, 'tree', parseCache.getCodeVersion(readTreeNumbers),
+                             lambda: (TREE_FIELDS, readTreeNumbers(meshFilePath))) as treeTable:
+        for heading, treeNum in treeTable.iterRows():
+            endNode = bigRelnDict.get(treeNum)
+            if endNode is None:
+                missingCount += 1
+                continue
+            endIndex = descriptorIndex.setdefault(endNode, len(descriptorIndex))
+            writtenPairs = writtenPairDict[treeNum[0]]
+            relnType = None
+            parentNum = treeNum.rpartition('.')[0]
+            while parentNum:
+                startNode = bigRelnDict.get(parentNum)
+                if startNode is not None:
+                    pair = (descriptorIndex.setdefault(startNode, len(descriptorIndex)) << 32) | endIndex
+                    if pair not in writtenPairs:
+                        writtenPairs.add(pair)
+                        relnType = relnType or getType(treeNum[0])
+                        meshRelnOutFile.write("%s|MeSH|%s|%s|contains\n" % (startNode, endNode, relnType))
+                        meshRelnOutFile.write("%s|MeSH|%s|%s|is_a_part_of\n" % (endNode, startNode, relnType))
+                        relnCount += 2
+                parentNum = parentNum.rpartition('.')[0]
+    if missingCount:
+        print "\t%s tree numbers have no MeSH record and were skipped" % locale.format('%d', missingCount, True)
+    return relnCount
+
+
+def readTreeNumbers(meshFilePath):
+    """ Yields (heading, tree number) of each line of MeSH Tree file """
+    with inputReader.openInput(meshFilePath, 'rU') as inFile:
         for line in inFile:
-            heading, treeNumStart = line.strip().split(';')
-            if not len(treeNumStart) == 3:
-                splitNumbers = treeNumStart.split('.')
-                while len(splitNumbers) > 1:
-                    treeNumEnd = treeNumStart[:-4]
-                    typeLetter = treeNumStart[0]
-                    relnType = getType(typeLetter)
-                    for i in range(len(splitNumbers)):
-                        node1 = ".".join(splitNumbers[0:i])
-                        if node1:
-                            relnString1 = ("%s|MeSH|%s|%s|contains\n" %
-                                           (bigRelnDict[node1], bigRelnDict[treeNumStart], relnType))
-                            relnString2 = ("%s|MeSH|%s|%s|is_a_part_of\n" %
-                                           (bigRelnDict[treeNumStart], bigRelnDict[node1], relnType))
-                            uniqueRelnSet.add(relnString1)
-                            uniqueRelnSet.add(relnString2)
-                    del splitNumbers[-1]
-                    treeNumStart = treeNumEnd
-    for reln in uniqueRelnSet:
-        meshRelnOutFile.write(reln)
-    return len(uniqueRelnSet)
+            yield line.strip().rsplit(';', 1)
 
 
 def getType(typeLetter):
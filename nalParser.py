@@ -4,9 +4,13 @@ import sys
 import os
 import getopt
 import locale
-import re
-import time
+from xml.etree import cElementTree
 from collections import defaultdict
+import buildManifest
+import batchWriter
+import inputReader
+import stageMetrics
+import nodeIndex
 
 
 """
@@ -21,80 +25,93 @@ Written by: Brandon Burciaga
 * Outfiles are .csv (pipe delimited) and generated with first line header demonstrating
     the format of the rest of the file (in columns)
 * See howToRun() method for instructions using this script.
+    NAL is skipped when its files are unchanged since the last build, add -f to rebuild it.
+    Add -z to write gzip compressed outfiles (.csv.gz).
+    Node IDs are published to csv_out/nodeIndex.sqlite for relationship checks of other parsers.
+    Add -i /path/to/thesaurus.xml[.gz] to parse that file instead of NAL/, -i - reads it from stdin
+    (stdin is parsed on every run, it can not be checked against the build manifest).
+* <CONCEPT> elements are parsed incrementally (cElementTree.iterparse) and written as they are read; only the
+    descriptor to ID map and the BT pairs are kept for the relationships.
 * Infile(s) [NAL Thesaurus, 2015 versions used]:
     * NAL_Thesaurus_2015.xml, http://agclass.nal.usda.gov/download.shtml
-* Outfile(s): nalNodeOut.csv
+* Outfile(s): nalNodeOut.csv, nalRelnOut.csv
 """
 
 
-def getBlock(nalFile):
-    """ Generator function which yields <CONCEPT> blocks """
-    block = []
-    for line in nalFile:
-        line = line.strip()
-        if line.startswith("<!") or line.startswith("<?") or line == "<THESAURUS>":
-            continue
-        if line.startswith("<CONCEPT>"):
-            if block:
-                yield block
-            block = []
-        if line and line != "</CONCEPT>":
-            block += [line]
-    if block:
-        yield block
+def getText(element):
+    """ Returns text of element as a UTF-8 str, '' if it has none """
+    text = element.text
+    if not text:
+        return ''
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
 
 
-def parseNAL(blockList, nalMap):
+def iterConcepts(nalFile):
     """
-    Populates nalMap with the key being the unique NAL ID and the value being myMap, a defaultdict(str) of attributes of each block.
-    myMap has sets for "UF" and "BT" keys for synonyms and relationships, respectively.
+    Generator function which yields a dict of the attributes of each <CONCEPT> element, parsed incrementally.
+    "UF" and "BT" hold sets of synonyms and broader term descriptors, missing attributes are ''.
+    Each concept is cleared from the tree once read, so memory does not grow with the thesaurus.
     """
-    for block in blockList:
-        myMap = defaultdict(str)
-        myMap["UF"] = set()
-        myMap["BT"] = set()
-        for item in block[1:]:
-            temp = re.split(">", item)[0]
-            key = temp[1:]
-            match = re.search(">(.+)<", item)
-            if match:
-                if key in ['UF', 'BT']:
-                    myMap[key].add(match.group(1))
+    context = cElementTree.iterparse(nalFile, events=('start', 'end'))
+    event, root = next(context)
+    for event, element in context:
+        if event != 'end' or element.tag != 'CONCEPT':
+            continue
+        attributes = defaultdict(str)
+        attributes["UF"] = set()
+        attributes["BT"] = set()
+        for child in element:
+            text = getText(child)
+            if text:
+                if child.tag in ['UF', 'BT']:
+                    attributes[child.tag].add(text)
                 else:
-                    myMap[key] = match.group(1)
-            uniqueID = "NAL:" + myMap["TNR"]
-            nalMap[uniqueID] = myMap
-    return nalMap
+                    attributes[child.tag] = text
+        yield attributes
+        root.clear()
 
 
-def writeNodes(nalMap, nalNodeOutFile):
+def writeNodes(concepts, nalNodeOutFile, idDescriptorMap, broaderList, publisher=None):
     """
-    Iterates nalMap, calls desired attributes and writes node to outfile.
-    Populates idDescriptorMap with descriptor as key and uniqueID as value, to be used to write relationships.
+    Writes a node for each concept of concepts as it is parsed, and returns the number written.
+    Fills idDescriptorMap with descriptor as key and uniqueID as value, and broaderList with (uniqueID, BT descriptor)
+    pairs, all writeRelns() needs. A concept whose uniqueID was already written is skipped.
+    Node IDs are added to publisher (nodeIndex.Publisher) if given.
     """
-    idDescriptorMap = dict()
-    for uniqueID, attributes in nalMap.iteritems():
+    count = 0
+    writtenIDs = set(idDescriptorMap.itervalues())
+    for attributes in concepts:
+        uniqueID = "NAL:" + attributes["TNR"]
+        if uniqueID in writtenIDs:
+            continue
+        writtenIDs.add(uniqueID)
         idDescriptorMap[attributes["DESCRIPTOR"]] = uniqueID
+        broaderList.extend((uniqueID, relationship) for relationship in attributes["BT"])
         node = ("%s|National_Agricultural_Library|%s|%s|%s|Plant\n" %
                 (uniqueID, attributes["DESCRIPTOR"], attributes["SC"],
                  ";".join(attributes["UF"])))
         nalNodeOutFile.write(node)
-    return idDescriptorMap
+        if publisher is not None:
+            publisher.add(uniqueID)
+        count += 1
+    return count
 
 
-def writeRelns(idDescriptorMap, nalMap, nalRelnOutFile):
-    """ Iterates nalMap and idDescription map to create and write relationships. """
+def writeRelns(idDescriptorMap, broaderList, nalRelnOutFile):
+    """ Writes relationships of the (uniqueID, BT descriptor) pairs of broaderList, returns relationship count. """
     count = 0
-    for startNode, attributes in nalMap.iteritems():
-        for relationship in attributes["BT"]:
-            count += 2
-            endNode = idDescriptorMap[relationship]
-            reln = "%s|National_Agricultural_Library|%s|is_a\n" % (startNode, endNode)
-            revReln = "%s|National_Agricultural_Library|%s|includes\n" % (endNode, startNode)
-            nalRelnOutFile.write(reln)
-            nalRelnOutFile.write(revReln)
+    for startNode, relationship in broaderList:
+        count += 2
+        endNode = idDescriptorMap[relationship]
+        reln = "%s|National_Agricultural_Library|%s|is_a\n" % (startNode, endNode)
+        revReln = "%s|National_Agricultural_Library|%s|includes\n" % (endNode, startNode)
+        nalRelnOutFile.write(reln)
+        nalRelnOutFile.write(revReln)
     print ("\n%s National Agricultural Library relationships have been created.\n" %
            locale.format('%d', count, True))
+    return count
 
 ##################################################################################################################
 ##########################################   General   #########################################################
@@ -126,56 +143,85 @@ def howToRun():
     print "\n\t\t * Top directory structure: \n\t\t\t * /Users/username/KnowledgeBase/<subdir>/<files>"
     print "\t\t\t\t * <subdir> : NAL/"
     print "\t\t\t\t * <subfiles> : *.xml\n"
+    print "\t\t * Optional: -i /path/to/thesaurus.xml parses this file instead of NAL/, -i - reads it from stdin\n"
     sys.exit()
 
 
 def main(argv):
     """ If run as main script, function executes with user input """
     topDir = ""
+    force = False
+    infilePath = None
     try:
-        opts, args = getopt.getopt(argv, "hp:", ["help", "dirPath="])
+        opts, args = getopt.getopt(argv, "hp:i:fz", ["help", "dirPath=", "infile=", "force", "gzip"])
         if len(argv) == 0:
             howToRun()
     except getopt.GetoptError:
         howToRun()
+    for opt, arg in opts:
+        if opt in ['-f', '--force']:
+            force = True
+        elif opt in ['-z', '--gzip']:
+            batchWriter.compressOutputs = True
+        elif opt in ['-i', '--infile']:
+            infilePath = arg
     for opt, arg in opts:
         if opt in ['-h', '--help']:
             howToRun()
         elif opt in ["-p", "--dirPath"]:
             if not arg.endswith("/"):
                 arg = arg + "/"
-            startTime = time.clock()
             topDir = arg
             locale.setlocale(locale.LC_ALL, "")
             outPath = createOutDirectory(topDir)
 
-            nalNodeOutFile = open((outPath + "nalNodeOut.csv"), 'w')
-            nalRelnOutFile = open((outPath + "nalRelnOut.csv"), 'w')
-            nalRoot = topDir + "NAL/"
-
-            nalNodeOutFile.write("Source_ID:ID|Source|Descriptor|Subject_Category|Synonyms:string[]|:LABEL\n")
-            nalRelnOutFile.write(":START_ID|Source|:END_ID|:TYPE\n")
-            print "\n\n\n===================  PARSING National Agricultural Library Thesaurus ====================="
-            print "\nProcessing files in:\n\n%s\n" % nalRoot
-            print "\nFiles processed: "
-
-            nalMap = defaultdict(lambda: defaultdict(set))
-            for root, dirs, files in os.walk(topDir):
-                if root.endswith("NAL"):
-                    for nalFile in files:
-                        if nalFile.endswith(".xml"):
-                            nalFilePath = os.path.join(root, nalFile)
-                            print "\n%s" % nalFilePath
-                            with open(nalFilePath, 'ru') as inFile:
-                                blockList = getBlock(inFile)
-                                nalMap = parseNAL(blockList, nalMap)
-                                print ("\n%s National Agricultural Library nodes have been created." %
-                                       locale.format('%d', len(nalMap), True))
-            idDescriptorMap = writeNodes(nalMap, nalNodeOutFile)
-            writeRelns(idDescriptorMap, nalMap, nalRelnOutFile)
-            endTime = time.clock()
-            duration = endTime - startTime
-            print "It took %s seconds to parse the files and create all NAL nodes and relationships \n" % duration
+            manifest = buildManifest.BuildManifest(outPath, force)
+            if infilePath:
+                nalFilePaths = [infilePath]
+                nalInputs = [] if infilePath == '-' else [infilePath]
+            else:
+                nalFilePaths = [os.path.join(root, nalFile) for root, dirs, files in os.walk(topDir) if root.endswith("NAL")
+                                for nalFile in files if inputReader.stripCompression(nalFile).endswith(".xml")]
+                nalInputs = buildManifest.listInputs(topDir + "NAL") if os.path.isdir(topDir + "NAL") else []
+            nalVersion = buildManifest.getParserVersion(__file__, nodeIndex.__file__, batchWriter.__file__, inputReader.__file__)
+            nalOutPaths = [batchWriter.getOutputPath(outPath + name) for name in ["nalNodeOut.csv", "nalRelnOut.csv"]]
+            if infilePath != '-' and manifest.isCurrent('nalParser.py:NAL', nalInputs, nalVersion):
+                print "\nNAL is up to date, skipping"
+                continue
+            stageMetrics.startRun('nalParser', outPath)
+            try:
+                nodeIndex.enable(outPath)
+                publisher = nodeIndex.publish('nalParser.py:NAL')
+
+                nalNodeOutFile = batchWriter.openOutput(outPath + "nalNodeOut.csv")
+                nalRelnOutFile = batchWriter.openOutput(outPath + "nalRelnOut.csv")
+                nalRoot = infilePath or topDir + "NAL/"
+
+                nalNodeOutFile.write("Source_ID:ID|Source|Descriptor|Subject_Category|Synonyms:string[]|:LABEL\n")
+                nalRelnOutFile.write(":START_ID|Source|:END_ID|:TYPE\n")
+                print "\n\n\n===================  PARSING National Agricultural Library Thesaurus ====================="
+                print "\nProcessing files in:\n\n%s\n" % nalRoot
+                print "\nFiles processed: "
+
+                idDescriptorMap = dict()
+                broaderList = []
+                for nalFilePath in nalFilePaths:
+                    print "\n%s" % nalFilePath
+                    with stageMetrics.stage(os.path.basename(nalFilePath), [nalFilePath]) as stage, \
+                            inputReader.openInput(nalFilePath, 'rb') as inFile:
+                        nodeCount = writeNodes(iterConcepts(inFile), nalNodeOutFile, idDescriptorMap, broaderList, publisher)
+                        stage.count(rowsOut=nodeCount)
+                        print ("\n%s National Agricultural Library nodes have been created." %
+                               locale.format('%d', nodeCount, True))
+                with stageMetrics.stage('NAL write') as stage:
+                    stage.count(rowsOut=writeRelns(idDescriptorMap, broaderList, nalRelnOutFile))
+                nalNodeOutFile.close()
+                nalRelnOutFile.close()
+                publisher.close()
+                manifest.record('nalParser.py:NAL', nalInputs, nalVersion, nalOutPaths)
+            finally:
+                stageMetrics.finishRun()
+                nodeIndex.close()
 
 if __name__ == "__main__":
     main(sys.argv[1:])
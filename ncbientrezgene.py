@@ -1,10 +1,24 @@
 #!/usr/bin/python
 
 from collections import defaultdict
-from collections import OrderedDict
+from itertools import groupby
+from operator import itemgetter
 import locale
-import time
-from sourceclass import SourceClass
+from parent import SourceClass
+from nodeRegistry import NodeRegistry
+import chunkedIngest
+import stageMetrics
+import batchWriter
+import nodeIndex
+
+# endpoint of relationship files checked against nodes other parsers published to the node index:
+# (namespace, position in relnTup)
+INDEX_ENDPOINTS = {'gene2go': ('GO', 1),
+                   'gene_group': ('NCBI_TAXONOMY', 0)}
+
+
+class UngroupedInput(ValueError):
+    """ Raised by iterGeneGroups() when the infile is not grouped by GeneID """
 
 
 class NCBIEntrezGene():
@@ -20,149 +34,170 @@ class NCBIEntrezGene():
                                   inputAttributes, fileHeader, ignoredAttributes)
 
     def checkFile(self):
+        """ Dispatches on file name, the file is parsed as one stageMetrics stage """
+        self.plan = self.parent.getRowPlan()
+        with stageMetrics.stage(self.parent.file, [self.parent.filePath]) as self.stage:
+            if self.parent.file.endswith('gene_info'):
+                self.parent.writeHeader()
+                nodeRegistry = self.writeGeneNodes()
+                self.parent.completeNodeSet.update(nodeRegistry)
 
-        if self.parent.file.endswith('gene_info'):
-            self.parent.writeHeader()
-            nodeSet = self.writeGeneNodes()
-            self.parent.completeNodeSet.update(nodeSet)
+            elif self.parent.file.endswith('gene2go'):
+                self.parent.writeHeader()
+                self.writeGeneToGOrelationships()
 
-        elif self.parent.file.endswith('gene2go'):
-            self.parent.writeHeader()
-            self.writeGeneToGOrelationships()
+            elif self.parent.file.endswith('gene_group'):
+                self.parent.writeHeader()
+                self.writeGeneToTaxonomyRelationships()
 
-        elif self.parent.file.endswith('gene_group'):
-            self.parent.writeHeader()
-            self.writeGeneToTaxonomyRelationships()
+            elif self.parent.file.endswith('mim2gene_medgen'):
+                self.parent.writeHeader()
+                self.writeGeneToMIMrelationships()
 
-        elif self.parent.file.endswith('mim2gene_medgen'):
-            self.parent.writeHeader()
-            self.writeGeneToMIMrelationships()
-
-        elif self.parent.file.endswith('gene2pubmed'):
-            self.parent.writeHeader()
-            self.writeGeneToPubmedRelationships()
+            elif self.parent.file.endswith('gene2pubmed'):
+                self.parent.writeHeader()
+                self.writeGeneToPubmedRelationships()
 
     def writeGeneNodes(self):
         """
         Processes row yielded from parseTsvFile() generator function
-        Gathers synonyms based on user selection in .json
-        Uses list comprehension to create and alter outString for node writing to out file
+        Gathers synonyms based on user selection in .json, node lines are formatted by the file's RowPlan
+        Gene IDs are published to the node index. Returns NodeRegistry of raw gene IDs written
         """
-        start = time.clock()
-        nodeSet = set()
+        nodeRegistry = NodeRegistry()
         print "Parsing %s\n" % self.parent.filePath
-        with open(self.parent.outPath, 'a') as outFile:
+        with batchWriter.openOutput(self.parent.outPath, 'a') as outFile, \
+                nodeIndex.publish('refactor.py:' + self.parent.file) as publisher:
+            formatGeneNode = self.plan.formatGeneNode
             for filteredRow in self.parent.parseTsvFile():
-                ignoredIndexList = [i for i, n in enumerate(self.parent.inputAttributes) if n in self.parent.ignoredAttributes]
-                syndexList = [index for index, attr in enumerate(self.parent.inputAttributes) if attr.lower() in ['synonym', 'synonyms']]
-                ignoredIndexList.extend(syndexList)
-                tempList = [n for i, n in enumerate(filteredRow) if i not in ignoredIndexList and n != '-']
-                synonyms = ";".join([filteredRow[i] for i in ignoredIndexList if filteredRow[i] != '-'])
-                tempList.insert(self.parent.outHeader.index('Synonyms'), synonyms)
-                tempList[0] = 'ENTREZ:' + tempList[0]
-                nodeSet.add(tempList[0])  # before adding entrez gene label below
-                outString = '|'.join(tempList)
-                outFile.write(outString + '|' + self.parent.getFullSourceName() + '|Gene\n')
-        end = time.clock()
-        duration = end - start
-        print "\n\tIt took %s seconds to parse this file.\n" % duration
-        print '\t%s ENTREZ Gene nodes have been created.\n' % locale.format('%d', len(nodeSet), True)
-        return nodeSet
+                geneID, nodeString = formatGeneNode(filteredRow)
+                nodeRegistry.add('ENTREZ', geneID)
+                publisher.add('ENTREZ:' + geneID)
+                outFile.write(nodeString)
+        self.stage.count(rowsOut=len(nodeRegistry))
+        print '\t%s ENTREZ Gene nodes have been created.\n' % locale.format('%d', len(nodeRegistry), True)
+        return nodeRegistry
 
     def writeGeneToMIMrelationships(self):
         """
         Processes filteredRow from parseTsvFile() generator located in base class.
-        Ensures gene node exists before writing to outfile.
-        Times execution and reports that and number of relationships created.
+        Ensures gene node exists before writing to outfile, see formatMIMRow().
+        Reports number of relationships created to the stage.
         """
-        start = time.clock()
         print "Parsing %s\n" % self.parent.filePath
-        relnCount = 0
-        with open(self.parent.outPath, 'a') as outFile:
-            for filteredRow in self.parent.parseTsvFile():
-                zippedRow = OrderedDict(zip(self.parent.outHeader, filteredRow))
-                zippedRow = self.parent.addSourceNames(zippedRow)
-                if zippedRow['GeneID'] != '-' and zippedRow['GeneID'] in self.parent.completeNodeSet:
-                    relnCount += 1
-                    outString = ('|'.join(zippedRow.values()) + '|' + 'belongs_to' + '|' + self.parent.getFullSourceName())
-                    outFile.write(outString + '\n')
-        end = time.clock()
-        duration = end - start
-        print "\n\tIt took %s seconds to parse this file.\n" % duration
+        self.geneIndex = self.plan.index('GeneID')
+        rowCount, relnCount = chunkedIngest.writeRows(self.parent, self.formatMIMRow, self.parent.chunkCount)
+        self.stage.count(rowsIn=rowCount, rowsOut=relnCount, rowsFiltered=rowCount - relnCount)
         print '\t%s Mendelian Inheritance in Man to NCBI Taxonomy relationships have been created.\n' % locale.format('%d', relnCount, True)
 
+    def formatMIMRow(self, filteredRow):
+        """ Returns MIM to gene relationship line for filteredRow, None if gene node does not exist """
+        if self.parent.completeNodeSet.contains('ENTREZ', filteredRow[self.geneIndex]):
+            return '|'.join(self.plan.prefixRow(filteredRow)) + '|belongs_to|' + self.plan.sourceName + '\n'
+
     def writeGeneToTaxonomyRelationships(self):
         """
-        Processes filteredRow from parseTsvFile() generator located in base class.
-        Ensures gene node exists before writing to outfile.
-        Joins together altGeneIDs and altTaxIDs arrays using ';' for proper reading by neo4j-import.
-        Times execution and reports that and number of relationships created.
+        Writes gene_group relationships grouped by writeGroupedRelationships(), see formatTaxonomyReln().
+        Reports number of relationships created to the stage.
         """
-        start = time.clock()
-        relnCount = 0
         print "Parsing %s\n" % self.parent.filePath
-        with open(self.parent.outPath, 'a') as outFile:
-            relnDict = self.processRelationshipInfo()
-            for relnTup, alternateIDs in relnDict.iteritems():
-                if relnTup[1] in self.parent.completeNodeSet:
-                    relnCount += 1
-                    relnList = list(relnTup)
-                    altGeneIDs = ';'.join(alternateIDs['Other_GeneID'])
-                    altTaxIDs = ';'.join(alternateIDs['Other_tax_id'])
-                    outFile.write('|'.join(relnList) + "|" + altGeneIDs + '|' + altTaxIDs + '|' + self.parent.getFullSourceName() + '\n')
-        end = time.clock()
-        duration = end - start
-        print "\n\tIt took %s seconds to parse this file.\n" % duration
+        relnCount = self.writeGroupedRelationships(self.aggregateGroupRows, self.formatTaxonomyReln)
         print '\t%s ENTREZ Gene to NCBI Taxonomy relationships have been created.\n' % locale.format('%d', relnCount, True)
 
+    def formatTaxonomyReln(self, relnTup, alternateIDs):
+        """
+        Returns gene_group relationship line, None if gene node does not exist.
+        Joins together altGeneIDs and altTaxIDs arrays using ';' for proper reading by neo4j-import.
+        """
+        if self.parent.completeNodeSet.containsPrefixed(relnTup[1]):
+            altGeneIDs = ';'.join(alternateIDs['Other_GeneID'])
+            altTaxIDs = ';'.join(alternateIDs['Other_tax_id'])
+            return '|'.join(relnTup) + "|" + altGeneIDs + '|' + altTaxIDs + '|' + self.plan.sourceName + '\n'
+
     def writeGeneToGOrelationships(self):
         """
-        Processes filteredRow from parseTsvFile() generator located in base class.
-        Ensures gene node exists before writing to outfile.
+        Writes gene2go relationships grouped by writeGroupedRelationships(), see formatGOreln().
+        Reports number of relationships created to the stage.
+        """
+        print "Parsing %s\n" % self.parent.filePath
+        relnCount = self.writeGroupedRelationships(self.aggregateGOrows, self.formatGOreln)
+        print '\t%s ENTREZ Gene to Gene Ontology relationships have been created.\n' % locale.format('%d', relnCount, True)
+
+    def formatGOreln(self, relnTup, idSet):
+        """
+        Returns gene2go relationship line, None if gene node does not exist.
         Joins together PubMed ID's rom idSet arrays using ';' for proper reading by neo4j-import.
-        Times execution and reports that and number of relationships created.
         """
-        start = time.clock()
+        if self.parent.completeNodeSet.containsPrefixed(relnTup[0]):
+            relnList = list(relnTup)
+            relnList.insert(-1, ';'.join(idSet))
+            relnList.append(self.plan.sourceName)
+            return '|'.join(relnList) + '\n'
+
+    def writeGroupedRelationships(self, aggregate, formatReln):
+        """
+        Writes formatReln(relnTup, values) for every relationship aggregate(rowIterable) groups the infile into.
+        gene2go and gene_group are grouped by GeneID upstream, so unsplit files are streamed through iterGeneGroups()
+        and written one gene at a time. If a GeneID turns up again after its group, the outfile is started over
+        and the whole file is grouped by processRelationshipInfo().
+        Returns number of relationships written.
+        """
+        if not chunkedIngest.canSplit(self.parent, self.parent.chunkCount):
+            try:
+                return self.writeRelationships(iterGeneGroups(self.parent.parseTsvFile(), self.plan.index('GeneID'), aggregate),
+                                               formatReln)
+            except UngroupedInput as error:
+                print "\n%s, falling back to grouping the whole file\n" % error
+                self.parent.writeHeader()
+        return self.writeRelationships(self.processRelationshipInfo().iteritems(), formatReln)
+
+    def writeRelationships(self, relnItems, formatReln):
+        """
+        Appends formatReln() of every (relnTup, values) in relnItems to the outfile, returns number written.
+        Relationships whose INDEX_ENDPOINTS endpoint is missing from the node index are skipped, once some
+        parser published nodes of its namespace (ontologyParser.py GO terms, taxonomyParser.py taxa).
+        """
+        relnTotal = 0
         relnCount = 0
-        print "Parsing %s\n" % self.parent.filePath
-        with open(self.parent.outPath, 'a') as outFile:
-            relnDict = self.processRelationshipInfo()
-            for relnTup, idSet in relnDict.iteritems():
-                if relnTup[0] in self.parent.completeNodeSet:
+        missingCount = 0
+        endpoint = INDEX_ENDPOINTS.get(self.parent.file)
+        if endpoint and nodeIndex.isPublished(endpoint[0]):
+            checkedItems = nodeIndex.checkNodes(relnItems, lambda relnItem: relnItem[0][endpoint[1]])
+        else:
+            checkedItems = ((relnItem, True) for relnItem in relnItems)
+        with batchWriter.openOutput(self.parent.outPath, 'a') as outFile:
+            for (relnTup, values), nodeExists in checkedItems:
+                relnTotal += 1
+                if not nodeExists:
+                    missingCount += 1
+                    continue
+                outString = formatReln(relnTup, values)
+                if outString:
                     relnCount += 1
-                    fullIDList = ';'.join([medID for medID in idSet])
-                    relnList = list(relnTup)
-                    relnList.insert(-1, fullIDList)
-                    relnList.append(self.parent.getFullSourceName())
-                    outString = '|'.join(relnList)
-                    outFile.write(outString + '\n')
-        end = time.clock()
-        duration = end - start
-        print "\n\tIt took %s seconds to parse this file.\n" % duration
-        print '\t%s ENTREZ Gene to Gene Ontology relationships have been created.\n' % locale.format('%d', relnCount, True)
+                    outFile.write(outString)
+        if missingCount:
+            print '\t%s relationships to %s nodes missing from the node index were skipped' % (
+                locale.format('%d', missingCount, True), endpoint[0])
+        self.stage.count(rowsOut=relnCount, rowsFiltered=relnTotal - relnCount)
+        return relnCount
 
     def writeGeneToPubmedRelationships(self):
-        """ """
-        start = time.clock()
-        relnCount = 0
-        badCount = 0
+        """
+        Processes filteredRow from parseTsvFile() generator located in base class.
+        Ensures gene node exists before writing to outfile, see formatPubmedRow().
+        Reports number of relationships created to the stage.
+        """
         print "Parsing %s\n" % self.parent.filePath
-        with open(self.parent.outPath, 'a') as outFile:
-            for filteredRow in self.parent.parseTsvFile():
-                geneID = "ENTREZ:" + filteredRow[0]
-                if geneID in self.parent.completeNodeSet:
-                    genePubmedReln = "%s|%s|associated_with|%s\n" % (geneID, filteredRow[1], self.parent.getFullSourceName())
-                    outFile.write(genePubmedReln)
-                    relnCount += 1
-                else:
-                    badCount += 1
-                    #  make missing gene nodes here? why are they missing?
-        end = time.clock()
-        duration = end - start
-        print badCount
-        print "\n\tIt took %s seconds to parse this file.\n" % duration
+        rowCount, relnCount = chunkedIngest.writeRows(self.parent, self.formatPubmedRow, self.parent.chunkCount)
+        badCount = rowCount - relnCount  # make missing gene nodes here? why are they missing?
+        self.stage.count(rowsIn=rowCount, rowsOut=relnCount, rowsFiltered=badCount)
         print '\t%s ENTREZ Gene to PubMed relationships have been created.\n' % locale.format('%d', relnCount, True)
 
+    def formatPubmedRow(self, filteredRow):
+        """ Returns gene to PubMed relationship line for filteredRow, None if gene node does not exist """
+        if self.parent.completeNodeSet.contains('ENTREZ', filteredRow[0]):
+            return "ENTREZ:%s|%s|associated_with|%s\n" % (filteredRow[0], filteredRow[1], self.plan.sourceName)
+
     def getPredicate(self, predicate):
         """ Hard codes text as string according to the disorder's phene mapping key. """
         predicateOptions = {'Component': 'is_a',
@@ -180,20 +215,49 @@ class NCBIEntrezGene():
         mim2gene_medgen relationships not included because they are written line by line and not aggregated.
         """
         if self.parent.file == 'gene2go':
-            relnDict = defaultdict(set)
-            for filteredRow in self.parent.parseTsvFile():
-                zippedRow = OrderedDict(zip(self.parent.outHeader, filteredRow))
-                zippedRow = self.parent.addSourceNames(zippedRow)
-                relnTuple = (zippedRow['GeneID'], zippedRow['GO_ID'], self.getPredicate(zippedRow['Category']))
-                relnDict[relnTuple].update([medID for medID in zippedRow['PubMed'].split(';') if medID != '-'])
-            return relnDict
+            return chunkedIngest.aggregateRows(self.parent, self.aggregateGOrows, mergeRelnDicts, self.parent.chunkCount)
 
         elif self.parent.file == 'gene_group':
-            relnDict = defaultdict(lambda: defaultdict(set))
-            for filteredRow in self.parent.parseTsvFile():
-                zippedRow = OrderedDict(zip(self.parent.outHeader, filteredRow))
-                zippedRow = self.parent.addSourceNames(zippedRow)
-                relnTup = (zippedRow['tax_id'], zippedRow['GeneID'], zippedRow['relationship'].replace(' ', '_'))
-                relnDict[relnTup]['Other_GeneID'].add(zippedRow['Other_GeneID'])
-                relnDict[relnTup]['Other_tax_ID'].add(zippedRow['Other_tax_id'])
-            return relnDict
+            return self.aggregateGroupRows(self.parent.parseTsvFile())
+
+    def aggregateGroupRows(self, rowIterable):
+        """ Returns defaultdict with (tax_id, GeneID, relationship) as composite key for aggregated alternate IDs """
+        relnDict = defaultdict(lambda: defaultdict(set))
+        taxIndex, geneIndex, relationshipIndex, otherGeneIndex, otherTaxIndex = [
+            self.plan.index(header) for header in ['tax_id', 'GeneID', 'relationship', 'Other_GeneID', 'Other_tax_id']]
+        for filteredRow in rowIterable:
+            row = self.plan.prefixRow(filteredRow)
+            relnTup = (row[taxIndex], row[geneIndex], row[relationshipIndex].replace(' ', '_'))
+            relnDict[relnTup]['Other_GeneID'].add(row[otherGeneIndex])
+            relnDict[relnTup]['Other_tax_ID'].add(row[otherTaxIndex])
+        return relnDict
+
+    def aggregateGOrows(self, rowIterable):
+        """ Returns defaultdict with (geneID, GO_ID, relationship) as composite key for aggregated pubmed IDs """
+        relnDict = defaultdict(set)
+        geneIndex, goIndex, categoryIndex, pubmedIndex = [self.plan.index(header) for header in ['GeneID', 'GO_ID', 'Category', 'PubMed']]
+        for filteredRow in rowIterable:
+            row = self.plan.prefixRow(filteredRow)
+            relnTuple = (row[geneIndex], row[goIndex], self.getPredicate(row[categoryIndex]))
+            relnDict[relnTuple].update([medID for medID in row[pubmedIndex].split(';') if medID != '-'])
+        return relnDict
+
+
+def mergeRelnDicts(relnDict, partialDict):
+    """ Merges partial gene2go relnDict from one byte range into relnDict """
+    for relnTuple, idSet in partialDict.iteritems():
+        relnDict[relnTuple].update(idSet)
+
+
+def iterGeneGroups(rowIterable, geneIndex, aggregate):
+    """
+    Streams rows grouped by raw GeneID at geneIndex, yields (relnTup, values) items of aggregate(groupRows) per gene.
+    Raises UngroupedInput if a GeneID turns up again after its group ended.
+    """
+    seenGenes = NodeRegistry()
+    for geneID, groupRows in groupby(rowIterable, itemgetter(geneIndex)):
+        if seenGenes.contains('ENTREZ', geneID):
+            raise UngroupedInput("Infile is not grouped by GeneID at %s" % geneID)
+        seenGenes.add('ENTREZ', geneID)
+        for relnItem in aggregate(groupRows).iteritems():
+            yield relnItem
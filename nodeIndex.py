@@ -0,0 +1,295 @@
+#!/usr/bin/python
+
+import os
+import time
+import Queue
+import sqlite3
+import threading
+from collections import defaultdict
+
+"""
+##################################################################################################################
+##########################################   Node Index   ######################################################
+##################################################################################################################
+
+* Persistent index of the node IDs every parser wrote, kept in csv_out/nodeIndex.sqlite (sqlite3, standard library).
+    Separate parser runs on one top directory share it, so relationship writers can check endpoints against nodes
+    of other sources (gene2go GO terms against ontologyParser.py, gene_group taxa against taxonomyParser.py).
+* Node IDs are stored by namespace, the part of the ID before its first ':' ('ENTREZ', 'NCBI_TAXONOMY', 'GO');
+    IDs without one ('D000001', 'TTDC00001') have namespace ''.
+* Node writers publish under a producer name, their build manifest key ('taxonomyParser.py:NCBITaxonomy'),
+    stored once in producers; nodes rows carry its integer producerID and have no rowid, keeping the table compact.
+* A Publisher inserts IDs in batches of PUBLISH_BATCH, each its own short transaction, tagged with a new generation
+    of the producer. Batches are sorted and inserted on a background thread with its own connection (sqlite3 releases
+    the GIL while it works), so the node writer keeps parsing meanwhile. Once every ID is in, IDs of the producer's earlier generations are deleted, so nodes no longer
+    written drop out; an interrupted run leaves the earlier IDs in place.
+* Lookups read the index without loading it: checkNodes() queries the IDs of CHECK_BATCH items at a time.
+* namespaces records which producers published IDs in each namespace. getNamespaceState() returns their generation
+    and publication time, which relationship writers checking a namespace fold into their build manifest signature
+    (refactor.py getJobVersion()), so their outfiles are rebuilt once the nodes they were checked against change.
+* Every process opens its own connection (forked pool workers publish too); the database is in WAL mode,
+    so lookups do not wait for writers, and writers wait up to BUSY_TIMEOUT seconds for each other.
+    Parser mains call close() when their run ends, the last connection closed removes the -wal and -shm files.
+    A connection must not cross fork(): mains close theirs before forking a pool, and a connection a forked process
+    inherited anyway is kept referenced and never used or closed there, closing it would drop the parent's locks.
+* Without enable() (benchmarks/runner.py) nothing is published and no endpoint is checked.
+"""
+
+INDEX_NAME = 'nodeIndex.sqlite'
+PUBLISH_BATCH = 20000  # IDs inserted per transaction
+QUEUE_DEPTH = 4  # batches waiting for the publishing thread before add() blocks
+CHECK_BATCH = 10000  # items whose node IDs checkNodes() looks up together
+LOOKUP_BATCH = 500  # IDs per query, below the SQLite limit of 999 host parameters
+BUSY_TIMEOUT = 600  # seconds a connection waits for the write transaction of another process
+
+indexState = dict()  # path; inherited by forked workers
+connectionState = {'pid': None, 'connection': None}  # connection of the process it was opened in
+inheritedConnections = []  # connections of the parent process, held so a forked process never closes them
+
+
+def enable(outDir):
+    """ Publishes and checks node IDs in outDir/nodeIndex.sqlite """
+    indexState['path'] = os.path.join(outDir, INDEX_NAME)
+
+
+def isEnabled():
+    """ True once enable() was called in this process or the one it was forked from """
+    return 'path' in indexState
+
+
+def getConnection():
+    """ Returns the connection of this process, opened and the schema created on first use """
+    if connectionState['pid'] != os.getpid():
+        if connectionState['connection'] is not None:
+            inheritedConnections.append(connectionState['connection'])
+        connection = openConnection()
+        with connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS producers (producerID INTEGER PRIMARY KEY, '
+                               'producer TEXT NOT NULL UNIQUE, generation INTEGER NOT NULL, published TEXT)')
+            connection.execute('CREATE TABLE IF NOT EXISTS nodes (namespace TEXT NOT NULL, id TEXT NOT NULL, '
+                               'producerID INTEGER NOT NULL, generation INTEGER NOT NULL, '
+                               'PRIMARY KEY (namespace, id, producerID)) WITHOUT ROWID')
+            connection.execute('CREATE TABLE IF NOT EXISTS namespaces (namespace TEXT NOT NULL, producerID INTEGER NOT NULL, '
+                               'PRIMARY KEY (namespace, producerID)) WITHOUT ROWID')
+        connectionState.update(pid=os.getpid(), connection=connection)
+    return connectionState['connection']
+
+
+def close():
+    """ Closes the connection of this process, if it opened one """
+    if connectionState['pid'] == os.getpid():
+        connectionState['connection'].close()
+    connectionState.update(pid=None, connection=None)
+
+
+def openConnection():
+    """ Returns a new connection to the index """
+    connection = sqlite3.connect(indexState['path'], timeout=BUSY_TIMEOUT)
+    connection.text_factory = str
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    return connection
+
+
+def splitNodeID(nodeID):
+    """ Returns (namespace, raw ID) of nodeID, namespace '' for IDs without one """
+    namespace, separator, rawID = nodeID.partition(':')
+    if separator:
+        return namespace, rawID
+    return '', nodeID
+
+
+def joinNodeID(namespace, rawID):
+    """ Returns node ID of rawID in namespace, as splitNodeID() took it apart """
+    if namespace:
+        return namespace + ':' + rawID
+    return rawID
+
+
+def publish(producer):
+    """ Returns Publisher of producer's node IDs, a NullPublisher when the index is not enabled """
+    if not isEnabled():
+        return NullPublisher()
+    return Publisher(producer)
+
+
+def isPublished(namespace):
+    """ True if any producer published IDs in namespace, False when the index is not enabled """
+    if not isEnabled():
+        return False
+    return getConnection().execute('SELECT 1 FROM nodes WHERE namespace = ? LIMIT 1', (namespace,)).fetchone() is not None
+
+
+def getNamespaceState(namespace):
+    """
+    Returns 'producer generation published' of every producer which published IDs in namespace, joined by ';'.
+    Changes whenever one of them starts or finishes publishing, '' when the index is not enabled.
+    """
+    if not isEnabled():
+        return ''
+    rowList = getConnection().execute('SELECT producer, generation, published FROM producers JOIN namespaces USING (producerID) '
+                                      'WHERE namespace = ? ORDER BY producer', (namespace,)).fetchall()
+    return ';'.join('%s %s %s' % row for row in rowList)
+
+
+def findNodes(nodeIDs):
+    """ Returns set of the nodeIDs in the index, looked up LOOKUP_BATCH IDs at a time """
+    connection = getConnection()
+    rawIDDict = defaultdict(set)
+    for nodeID in nodeIDs:
+        namespace, rawID = splitNodeID(nodeID)
+        rawIDDict[namespace].add(rawID)
+    foundSet = set()
+    for namespace, rawIDs in rawIDDict.iteritems():
+        rawIDs = list(rawIDs)
+        for start in xrange(0, len(rawIDs), LOOKUP_BATCH):
+            batch = rawIDs[start:start + LOOKUP_BATCH]
+            query = 'SELECT DISTINCT id FROM nodes WHERE namespace = ? AND id IN (%s)' % ','.join('?' * len(batch))
+            foundSet.update(joinNodeID(namespace, rawID) for rawID, in connection.execute(query, [namespace] + batch))
+    return foundSet
+
+
+def checkNodes(items, getNodeID):
+    """
+    Yields (item, True if node getNodeID(item) is in the index) for every item of items, in order.
+    Items are read CHECK_BATCH at a time and their node IDs looked up together through findNodes().
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= CHECK_BATCH:
+            for checked in checkBatch(batch, getNodeID):
+                yield checked
+            batch = []
+    for checked in checkBatch(batch, getNodeID):
+        yield checked
+
+
+def checkBatch(batch, getNodeID):
+    """ Returns list of (item, True if node getNodeID(item) is in the index) for batch """
+    nodeIDs = [getNodeID(item) for item in batch]
+    foundSet = findNodes(nodeIDs)
+    return [(item, nodeID in foundSet) for item, nodeID in zip(batch, nodeIDs)]
+
+
+class Publisher(object):
+    """
+    Publishes node IDs of one producer, as a new generation of it. close() deletes IDs of earlier generations;
+    used as a context manager it is called on exit unless the block raised.
+    """
+    def __init__(self, producer):
+        self.producer = producer
+        self.pendingList = []
+        self.namespaceSet = set()
+        self.error = None
+        self.connection = getConnection()
+        with self.connection:
+            row = self.connection.execute('SELECT producerID, generation FROM producers WHERE producer = ?',
+                                          (producer,)).fetchone()
+            if row:
+                self.producerID, self.generation = row[0], row[1] + 1
+                self.connection.execute('UPDATE producers SET generation = ?, published = NULL WHERE producerID = ?',
+                                        (self.generation, self.producerID))
+            else:
+                self.generation = 1
+                self.producerID = self.connection.execute('INSERT INTO producers (producer, generation) VALUES (?, ?)',
+                                                          (producer, self.generation)).lastrowid
+        self.queue = Queue.Queue(QUEUE_DEPTH)
+        self.thread = threading.Thread(target=self.insertBatches)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.close()
+        else:
+            self.stopThread()
+
+    def add(self, nodeID):
+        """ Publishes nodeID """
+        self.pendingList.append(nodeID)
+        if len(self.pendingList) >= PUBLISH_BATCH:
+            self.flush()
+
+    def update(self, nodeIDs):
+        """ Publishes every node ID of nodeIDs """
+        for nodeID in nodeIDs:
+            self.add(nodeID)
+
+    def flush(self):
+        """ Hands pending IDs to the publishing thread """
+        if not self.pendingList:
+            return
+        self.checkError()
+        self.queue.put(self.pendingList)
+        self.pendingList = []
+
+    def insertBatches(self):
+        """ Publishing thread: inserts queued batches, each in one transaction and key order, until None is queued """
+        connection = openConnection()
+        producerID = self.producerID
+        generation = self.generation
+        batch = self.queue.get()
+        while batch is not None:
+            if self.error is None:
+                try:
+                    rowList = sorted([splitNodeID(nodeID) + (producerID, generation) for nodeID in batch])
+                    self.namespaceSet.update(row[0] for row in rowList)
+                    with connection:
+                        connection.executemany('INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?)', rowList)
+                except Exception as error:
+                    self.error = error  # raised in the publishing thread, batches are drained so it never blocks
+            batch = self.queue.get()
+        connection.close()
+
+    def checkError(self):
+        """ Re-raises an error hit by the publishing thread """
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def stopThread(self):
+        """ Waits for the publishing thread to insert queued batches and close its connection """
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        """
+        Inserts pending IDs, deletes IDs of earlier generations of the producer, records the namespaces it published
+        and this generation as published
+        """
+        self.flush()
+        self.stopThread()
+        self.checkError()
+        with self.connection:
+            self.connection.execute('DELETE FROM nodes WHERE producerID = ? AND generation != ?',
+                                    (self.producerID, self.generation))
+            self.connection.execute('DELETE FROM namespaces WHERE producerID = ?', (self.producerID,))
+            self.connection.executemany('INSERT INTO namespaces VALUES (?, ?)',
+                                        [(namespace, self.producerID) for namespace in sorted(self.namespaceSet)])
+            self.connection.execute('UPDATE producers SET published = ? WHERE producerID = ?',
+                                    (time.strftime('%Y-%m-%dT%H:%M:%S'), self.producerID))
+
+
+class NullPublisher(object):
+    """ Publisher of a run without a node index, ignores every ID """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        pass
+
+    def add(self, nodeID):
+        pass
+
+    def update(self, nodeIDs):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+
+from collections import defaultdict
+
+"""
+##################################################################################################################
+##########################################   Node Registry   ###################################################
+##################################################################################################################
+
+* Compact replacement for a set of node ID strings like 'ENTREZ:12345'.
+* IDs are registered per namespace ('ENTREZ', 'NCBI_TAXONOMY', ...) as the raw ID without prefix.
+* Numeric IDs set one bit in a bytearray per namespace, so millions of genes cost a few MB
+    and membership needs no prefixed string. IDs which are not numeric, or have a leading zero, fall back to a set
+    per namespace.
+* Used as SourceClass.completeNodeSet. Prefixes are only added back when writing output.
+"""
+
+MAX_BITMAP_ID = 1 << 32  # larger numbers go to the fallback set instead of growing the bitmap
+BIT_COUNTS = str(bytearray(bin(byte).count('1') for byte in range(256)))  # translate() table, set bits per byte
+
+
+class NodeRegistry(object):
+    """
+    Holds one bitmap and one fallback set of registered IDs per namespace.
+    Picklable, so it can be returned from refactor.py pool workers and merged with update().
+    """
+    def __init__(self):
+        self.bitmaps = dict()
+        self.otherIDs = defaultdict(set)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, namespace, rawID):
+        """ Registers rawID in namespace """
+        number = toNumber(rawID)
+        if number is None:
+            if rawID not in self.otherIDs[namespace]:
+                self.otherIDs[namespace].add(rawID)
+                self.count += 1
+            return
+        bitmap = self.bitmaps.get(namespace)
+        if bitmap is None:
+            bitmap = self.bitmaps[namespace] = bytearray()
+        index = number >> 3
+        if index >= len(bitmap):
+            bitmap.extend(bytearray(max(index + 1 - len(bitmap), len(bitmap))))
+        bit = 1 << (number & 7)
+        if not bitmap[index] & bit:
+            bitmap[index] |= bit
+            self.count += 1
+
+    def contains(self, namespace, rawID):
+        """ True if rawID was registered in namespace """
+        number = toNumber(rawID)
+        if number is None:
+            return rawID in self.otherIDs.get(namespace, ())
+        bitmap = self.bitmaps.get(namespace)
+        index = number >> 3
+        return bitmap is not None and index < len(bitmap) and bool(bitmap[index] & (1 << (number & 7)))
+
+    def containsPrefixed(self, nodeID):
+        """ True if a prefixed node ID like 'ENTREZ:12345' was registered """
+        namespace, separator, rawID = nodeID.partition(':')
+        return bool(separator) and self.contains(namespace, rawID)
+
+    def update(self, other):
+        """ Registers every ID of NodeRegistry other """
+        for namespace, otherBitmap in other.bitmaps.iteritems():
+            bitmap = self.bitmaps.get(namespace)
+            if not bitmap:
+                self.bitmaps[namespace] = bytearray(otherBitmap)
+                continue
+            if len(otherBitmap) > len(bitmap):
+                bitmap.extend(bytearray(len(otherBitmap) - len(bitmap)))
+            for index, byte in enumerate(otherBitmap):
+                if byte:
+                    bitmap[index] |= byte
+        for namespace, idSet in other.otherIDs.iteritems():
+            self.otherIDs[namespace].update(idSet)
+        self.count = (sum(sum(bitmap.translate(BIT_COUNTS)) for bitmap in self.bitmaps.itervalues()) +
+                      sum(len(idSet) for idSet in self.otherIDs.itervalues()))
+
+
+def toNumber(rawID):
+    """
+    Returns rawID as a bitmap index, None if it is not a plain non negative number.
+    Digit strings with a leading zero ('0000009') are distinct IDs from the number ('9'), so they are None as well.
+    """
+    if not rawID.isdigit() or (len(rawID) > 1 and rawID[0] == '0'):
+        return None
+    number = int(rawID)
+    if number >= MAX_BITMAP_ID:
+        return None
+    return number
@@ -3,8 +3,16 @@
 import sys
 import getopt
 import os
-import time
 import locale
+import itertools
+import multiprocessing
+import ontologyClasses
+import buildManifest
+import batchWriter
+import inputReader
+import stageMetrics
+import parseCache
+import nodeIndex
 from collections import defaultdict
 from ontologyClasses import OntologyParser
 
@@ -19,6 +27,11 @@ Written by: Brandon Burciaga
 * Outfiles are .csv (pipe delimited) and generated with first line header of
     node IDs, attributes, types and labels for neo4j-import tool
 * See howToRun() method for instructions using this script.
+    Add -j N to parse the .obo files concurrently on N worker processes.
+    Ontologies are skipped when the .obo files are unchanged since the last build, add -f to rebuild them.
+    Add -z to write gzip compressed outfiles (.csv.gz).
+    Parsed term records are kept in csv_out/parseCache/, reruns after writer changes do not reparse the .obo files.
+    Node IDs are published to csv_out/nodeIndex.sqlite, where NCBI Entrez Gene gene2go checks its GO terms.
 * Infile(s) [ontology files in .obo format, 2015 versions used]:
     * CHEBI Ontology, https://www.ebi.ac.uk/chebi/downloadsForward.do
     * Disease Ontology, http://disease-ontologyorg/downloads/
@@ -33,6 +46,9 @@ Written by: Brandon Burciaga
 """
 
 
+TERM_FIELDS = ['id', 'name', 'definition', 'synonyms', 'label', 'relnStart', 'relnType', 'relnEnd']
+
+
 def getBlock(oboFile):
     """ Generator function which yields .obo blocks """
     block = []
@@ -48,22 +64,27 @@ def getBlock(oboFile):
         yield block
 
 
-def sortBlocks(blockList):
-    """ Sorts blocks into metadeta, terms, and typedefs """
+def streamBlocks(blockList):
+    """
+    Reads only the leading metadata block from blockList generator.
+    Returns generator of term blocks (without '[Term]' line) which are read as they are consumed,
+    and metadata list. Typedef blocks are skipped.
+    """
     metaData = list()
-    termList = list()
-    typedefList = list()
-    for block in blockList:
-        blockType = block[0]
-        if blockType == "format-version: 1.2":
-            metaData.append(block)
-        elif blockType == "[Term]":
-            del block[0]
-            termList.append(block)
-        else:
-            del block[0]
-            typedefList.append(block)
-    return termList, typedefList, metaData
+    firstBlock = next(blockList, None)
+    if firstBlock is None:
+        return iter([]), metaData
+    if firstBlock[0] == "format-version: 1.2":
+        metaData.append(firstBlock)
+        firstBlock = None
+
+    def iterTerms():
+        if firstBlock and firstBlock[0] == "[Term]":
+            yield firstBlock[1:]
+        for block in blockList:
+            if block[0] == "[Term]":
+                yield block[1:]
+    return iterTerms(), metaData
 
 
 def getSource(metaData):
@@ -81,7 +102,7 @@ def editSource(mySource, oboFilePath):
     """ Edits source of data to more readable format """
     editedSource = ""
     if mySource is None:
-        if oboFilePath.endswith("GOmfbp_to_ChEBI03092015.obo"):
+        if inputReader.stripCompression(oboFilePath).endswith("GOmfbp_to_ChEBI03092015.obo"):
             editedSource = "Gene_Ontology"
         else:
             editedSource = "molecular_function_xp_CHEBI_ontology"
@@ -109,12 +130,12 @@ def parseTagValue(block):
     return data
 
 
-def writeOntologyNodes(nodeOutFile, nodeSet):
-    """ Writes ontology nodes using attributes listed """
+def writeOntologyNodes(nodeOutFile, nodeStrings):
+    """ Writes ontology nodes from nodeStrings iterable as they are created """
     nodeCount = 0
-    with open(nodeOutFile, "w") as oboNodeOut:
+    with batchWriter.openOutput(nodeOutFile, "w") as oboNodeOut:
         oboNodeOut.write("Source_ID:ID|Name|Source|Definition|Synonyms:string[]|:LABEL\n")
-        for node in nodeSet:
+        for node in nodeStrings:
             node = clean(node)
             nodeCount += 1
             oboNodeOut.write(node)
@@ -124,81 +145,161 @@ def writeOntologyNodes(nodeOutFile, nodeSet):
 def writeOntologyRelationships(relnOutFile, bigUniqueNodeSet, bigRelnSet):
     """
     Writes header and relationships to oboRelnOut.csv if the nodes exist.
+    bigRelnSet holds (start, source, end, type) tuples from makeRelationship(), formatted and cleaned only here.
     """
     totalRelnCount = 0
-    with open(relnOutFile, "w") as oboRelnOut:
+    with batchWriter.openOutput(relnOutFile, "w") as oboRelnOut:
         oboRelnOut.write(":START_ID|Source|:END_ID|:TYPE\n")
         for reln in bigRelnSet:
-            splitReln = reln.split("|")
-            splitReln[0] = splitReln[0].split(' ! ')[0]
-            reln = '|'.join(splitReln)
-            endNode = reln.split("|")[2]
-            startNode = splitReln[0]
-            if startNode in bigUniqueNodeSet and endNode in bigUniqueNodeSet:
+            if reln[0] in bigUniqueNodeSet and reln[2] in bigUniqueNodeSet:
                 totalRelnCount += 1
-                reln = clean(reln)
-                oboRelnOut.write(reln + "\n")
-    print 'hehe', totalRelnCount
+                oboRelnOut.write(clean('|'.join(reln)) + "\n")
     return totalRelnCount
 
 
-def parseObo(topDir, oboFilePath, termList, editedSource):
+def parseObo(topDir, oboFilePath, termRecords, editedSource):
     """
-    Iterates terms in termList for the input .obo file, creates a dictionary of term information.
-    Creates OntologyParser object with dictionary as input.
-    Skips obsolete nodes, writes unique nodes to outfile, returns set of unique relationships.
+    Iterates term records of the input .obo file through iterNodeStrings().
+    Writes unique nodes to outfile as records are read, returns set of unique relationships
+    and the node outfile path (None for CTD).
     """
     uniqueNodeSet = set()
     nodeCount = 0
-    nodeSet = set()
     relnSet = set()
-    obsoleteNodeSet = set()
-    # creates OntologyParser object for each term block
-    for term in termList:
-        dataDict = parseTagValue(term)
-        ontologyObj = OntologyParser(**dataDict)
-
-        # Skips obsolete nodes
-        if ontologyObj.skipObsolete() is True:
-            obsoleteNodeSet.add(ontologyObj.getID())
-            continue
-
-        # creates node strings
-        nodeString = "%s|%s|%s|%s|%s|%s\n" % (ontologyObj.getID(), ontologyObj.getName(), editedSource, ontologyObj.getDef(), ontologyObj.getSynonyms(), ontologyObj.getLabel())
-        nodeString = nodeString.replace("None", "").replace("|p|", "|plant_ontology|").replace('MESH:', '')
-        nodeSet.add(nodeString)
-        uniqueNodeSet.add(ontologyObj.getID())
-
-        # creates relationship strings within ontology files, adds to relnSet
-        for reln in ontologyObj.getRelationships():
-            relnString = "%s|%s|%s|%s" % (reln[0], editedSource, reln[2], reln[1])
-            if 'MESH:' in relnString:
-                relnString = relnString.replace('MESH:', '')
-            relnSet.add(relnString)
+    nodeOutFile = None
+    nodeStrings = iterNodeStrings(termRecords, editedSource, uniqueNodeSet, relnSet)
 
     # writes nodes
     if "CTD" not in oboFilePath:
-        nodeOutFile = (topDir + "csv_out/" + editedSource + ".csv")
-        nodeCount = writeOntologyNodes(nodeOutFile, nodeSet)
+        nodeOutFile = batchWriter.getOutputPath(topDir + "csv_out/" + editedSource + ".csv")
+        nodeCount = writeOntologyNodes(nodeOutFile, nodeStrings)
         print "\t%s nodes and %s relationships have been created from this ontology." % (locale.format("%d", nodeCount, True), locale.format("%d", len(relnSet), True))
     else:
+        for nodeString in nodeStrings:
+            pass
         print "\t%s relationships have been created from this ontology." % locale.format("%d", len(relnSet), True)
-    return uniqueNodeSet, relnSet, nodeCount
+    return uniqueNodeSet, relnSet, nodeCount, nodeOutFile
 
 
-def parseRelnFiles(oboFilePath, termList, editedSource):
-    """ """
-    relnSet = set()
+def loadTerms(oboFilePath):
+    """
+    Returns parse cache table of the term records of an .obo file (TERM_FIELDS), its meta holds the edited source.
+    The file is parsed through iterTermRecords() unless the cache holds the records already.
+    """
+    codeVersion = parseCache.getCodeVersion(getBlock, streamBlocks, getSource, editSource, parseTagValue,
+                                            readTermRecords, iterTermRecords, isRelationFile, ontologyClasses)
+    termTable = parseCache.load(oboFilePath, 'terms', codeVersion)
+    if termTable is None:
+        meta = dict()
+        termRecords = readTermRecords(oboFilePath, meta)
+        next(termRecords)
+        termTable = parseCache.build(oboFilePath, 'terms', codeVersion, TERM_FIELDS, termRecords, meta)
+    return termTable
+
+
+def readTermRecords(oboFilePath, meta):
+    """
+    Generator holding the .obo file open while its term records are read through iterTermRecords().
+    The first next() reads the metadata block and sets meta['source'] to the edited source, and yields None.
+    """
+    with inputReader.openInput(oboFilePath, "rU") as inFile:
+        termList, metaData = streamBlocks(getBlock(inFile))
+        meta['source'] = editSource(getSource(metaData), oboFilePath)
+        yield None
+        for record in iterTermRecords(termList, not isRelationFile(oboFilePath)):
+            yield record
+
+
+def iterTermRecords(termList, nodeTerms):
+    """
+    Yields a record of TERM_FIELDS for each term in termList, relationships as (start, type, end) value lists.
+    With nodeTerms, obsolete terms and repeated IDs are skipped and the node attributes are kept,
+    as formatted by '%s' (None becomes 'None'); otherwise only relationships are.
+    """
+    uniqueIDs = set()
     for term in termList:
         dataDict = parseTagValue(term)
         ontologyObj = OntologyParser(**dataDict)
-        for reln in ontologyObj.getRelationships():
-            if "!" in reln[0]:
-                cleanedStartNode = reln[0].split(' ! ')[0]
-                relnString = "%s|%s|%s|%s" % (cleanedStartNode, editedSource, reln[2], reln[1])
-            else:
-                relnString = "%s|%s|%s|%s" % (reln[0], editedSource, reln[2], reln[1])
-            relnSet.add(relnString)
+        if nodeTerms:
+            # Skips obsolete nodes and duplicate IDs
+            if ontologyObj.skipObsolete() is True or ontologyObj.getID() in uniqueIDs:
+                continue
+            uniqueIDs.add(ontologyObj.getID())
+            nodeValues = ['%s' % value for value in (ontologyObj.getID(), ontologyObj.getName(), ontologyObj.getDef(),
+                                                      ontologyObj.getSynonyms(), ontologyObj.getLabel())]
+        else:
+            nodeValues = [None] * 5
+        relnList = list(ontologyObj.getRelationships())
+        yield nodeValues + [[reln[0] for reln in relnList], [reln[1] for reln in relnList], [reln[2] for reln in relnList]]
+
+
+def iterNodeStrings(termRecords, editedSource, uniqueNodeSet, relnSet):
+    """
+    Yields node string for each record of a node term from iterTermRecords(), adds its ID to uniqueNodeSet
+    and its relationships to relnSet.
+    """
+    for record in termRecords:
+        termID, name, definition, synonyms, label = [values[0] for values in record[:5]]
+        uniqueNodeSet.add(termID)
+
+        # creates relationship tuples within ontology files, adds to relnSet
+        for startNode, relnType, endNode in zip(*record[5:]):
+            relnSet.add(makeRelationship(startNode.replace('MESH:', ''), editedSource,
+                                         endNode.replace('MESH:', ''), relnType.replace('MESH:', '')))
+
+        # creates node strings
+        nodeString = "%s|%s|%s|%s|%s|%s\n" % (termID, name, editedSource, definition, synonyms, label)
+        yield nodeString.replace("None", "").replace("|p|", "|plant_ontology|").replace('MESH:', '')
+
+
+def makeRelationship(startNode, editedSource, endNode, relnType):
+    """
+    Returns (start, source, end, type) relationship tuple with ' ! ' comment trimmed from start node.
+    Strings are interned, so the few sources and types and node IDs repeated across relationships are stored once.
+    """
+    return (intern(startNode.split(' ! ')[0]), intern(editedSource), intern(endNode), intern(relnType))
+
+
+def parseOntologyFile(fileArgs):
+    """
+    Parses one .obo file and writes its node file, stanzas are parsed as they are read.
+    Returns unique node IDs (empty for CTD, whose nodes are not written), relationship set, node count
+    and node outfile path (None when no nodes are written).
+    Module level so it can be handed to multiprocessing.Pool workers.
+    """
+    topDir, oboFilePath = fileArgs
+    uniqueNodeSet = set()
+    nodeCount = 0
+    nodeOutFile = None
+    with stageMetrics.stage(os.path.basename(oboFilePath), [oboFilePath]) as stage, loadTerms(oboFilePath) as termTable:
+        editedSource = termTable.meta['source']
+
+        # write nodes and relationships from individual ontology files
+        if not isRelationFile(oboFilePath):
+            print "\n%s" % oboFilePath
+            uniqueNodeSet, relnSet, nodeCount, nodeOutFile = parseObo(topDir, oboFilePath, termTable.iterRecords(), editedSource)
+            if "CTD" in oboFilePath:
+                uniqueNodeSet = set()
+
+        # creates relationship strings for cross-ontology files
+        else:
+            print "\n%s" % oboFilePath
+            relnSet = parseRelnFiles(oboFilePath, termTable.iterRecords(), editedSource)
+        stage.count(rowsOut=nodeCount + len(relnSet))
+    return uniqueNodeSet, relnSet, nodeCount, nodeOutFile
+
+
+def isRelationFile(oboFilePath):
+    """ True for cross-ontology files, whose relationships are written but not their nodes """
+    return inputReader.stripCompression(oboFilePath).endswith(("GOmfbp_to_ChEBI03092015.obo", "molecular_function_xp_chebi03092015.obo"))
+
+
+def parseRelnFiles(oboFilePath, termRecords, editedSource):
+    """ Returns set of relationship tuples from term records of cross-ontology file, nodes are not written """
+    relnSet = set()
+    for record in termRecords:
+        for startNode, relnType, endNode in zip(*record[5:]):
+            relnSet.add(makeRelationship(startNode, editedSource, endNode, relnType))
     print "\t%s relationships have been created from this ontology\n" % locale.format("%d", len(relnSet), True)
     return relnSet
 
@@ -239,19 +340,27 @@ def howToRun():
 def main(argv):
     """ If run as main script, function executes with user input """
     topDir = ""
+    workerCount = 1
+    force = False
     try:
-        opts, args = getopt.getopt(argv, "hp:", ["help", "dirPath="])
+        opts, args = getopt.getopt(argv, "hp:j:fz", ["help", "dirPath=", "jobs=", "force", "gzip"])
         if len(argv) == 0:
             howToRun()
     except getopt.GetoptError:
         howToRun()
+    for opt, arg in opts:
+        if opt in ['-j', '--jobs']:
+            workerCount = int(arg)
+        elif opt in ['-f', '--force']:
+            force = True
+        elif opt in ['-z', '--gzip']:
+            batchWriter.compressOutputs = True
     for opt, arg in opts:
         if opt in ['-h', '--help']:
             howToRun()
         elif opt in ("-p", "--dirPath"):
             if not arg.endswith("/"):
                 arg = arg + "/"
-            startTime = time.clock()
             topDir = arg
             locale.setlocale(locale.LC_ALL, "")
 
@@ -266,37 +375,60 @@ def main(argv):
                 if sourcePath.endswith('Ontologies'):
                     print "\n\n\n=====================================  PARSING Ontologies ====================================="
                     print "\nProcessing files in:\n\t%s\n" % sourcePath
-                    fileList = os.listdir(sourcePath)
-                    for oboFile in fileList:
-                        oboFilePath = os.path.join(sourcePath, oboFile)
-                        with open(oboFilePath, "rU") as inFile:
-                            blockList = getBlock(inFile)
-                            termList, typedefList, metaData = sortBlocks(blockList)
-                        editedSource = editSource(getSource(metaData), oboFilePath)
-
-                        # write nodes and relationships from individual ontology files
-                        if not oboFilePath.endswith(("GOmfbp_to_ChEBI03092015.obo", "molecular_function_xp_chebi03092015.obo")):
-                            print "\n%s" % oboFilePath
-                            uniqueNodeSet, relnSet, nodeCount = parseObo(topDir, oboFilePath, termList, editedSource)
-                            if "CTD" not in oboFilePath:
+                    # relationships are filtered against nodes of every ontology, so all files are rebuilt together
+                    manifest = buildManifest.BuildManifest(createOutDirectory(topDir), force)
+                    oboInputs = buildManifest.listInputs(sourcePath)
+                    oboVersion = buildManifest.getParserVersion(__file__, ontologyClasses.__file__, parseCache.__file__,
+                                                              nodeIndex.__file__, batchWriter.__file__, inputReader.__file__)
+                    if manifest.isCurrent('ontologyParser.py:Ontologies', oboInputs, oboVersion):
+                        print "\nOntologies are up to date, skipping"
+                        continue
+                    stageMetrics.startRun('ontologyParser', createOutDirectory(topDir))
+                    try:
+                        parseCache.enable(createOutDirectory(topDir), manifest)
+                        nodeIndex.enable(createOutDirectory(topDir))
+                        outPathList = []
+                        fileArgs = [(topDir, os.path.join(sourcePath, oboFile)) for oboFile in os.listdir(sourcePath)]
+                        if workerCount > 1:
+                            # largest ontologies (ChEBI) first so they do not start last
+                            fileArgs.sort(key=lambda args: os.path.getsize(args[1]), reverse=True)
+                            pool = multiprocessing.Pool(min(workerCount, len(fileArgs)) or 1)
+                            resultList = pool.imap_unordered(parseOntologyFile, fileArgs)
+                        else:
+                            pool = None
+                            resultList = itertools.imap(parseOntologyFile, fileArgs)
+                        try:
+                            for uniqueNodeSet, relnSet, nodeCount, nodeOutFile in resultList:
                                 totalNodeCount += nodeCount
+                                if nodeOutFile:
+                                    outPathList.append(nodeOutFile)
                                 bigUniqueNodeSet.update(uniqueNodeSet)
-                            bigRelnSet.update(relnSet)
-
-                        # creates relationship strings for cross-ontology files, adds to relnSet
+                                bigRelnSet.update(relnSet)
+                        except:
+                            if pool:
+                                pool.terminate()
+                            raise
                         else:
-                            print "\n%s" % oboFilePath
-                            relnSet = parseRelnFiles(oboFilePath, termList, editedSource)
-                            bigRelnSet.update(relnSet)
-
-                    # write relationships
-                    relnOutFile = (topDir + "csv_out/oboRelnOut.csv")
-                    totalRelnCount = writeOntologyRelationships(relnOutFile, bigUniqueNodeSet, bigRelnSet)
-                    print 'lol', totalRelnCount
-                    endTime = time.clock()
-                    duration = endTime - startTime
-                    print "\n%s nodes and %s ontology relationships have been created." % (locale.format("%d", totalNodeCount, True), locale.format("%d", totalRelnCount, True))
-                    print "\nIt took %s seconds to create all ontology nodes and relationships. \n\n" % duration
+                            if pool:
+                                pool.close()
+                        finally:
+                            if pool:
+                                pool.join()
+
+                        # write relationships
+                        relnOutFile = batchWriter.getOutputPath(topDir + "csv_out/oboRelnOut.csv")
+                        with stageMetrics.stage('oboRelnOut') as stage:
+                            totalRelnCount = writeOntologyRelationships(relnOutFile, bigUniqueNodeSet, bigRelnSet)
+                            stage.count(rowsIn=len(bigRelnSet), rowsOut=totalRelnCount, rowsFiltered=len(bigRelnSet) - totalRelnCount)
+                        # published once the pool is joined, so no index connection is open while it forks;
+                        # files without a node outfile return no node IDs
+                        with nodeIndex.publish('ontologyParser.py:Ontologies') as publisher:
+                            publisher.update(nodeID.replace('MESH:', '') for nodeID in bigUniqueNodeSet)  # IDs as written
+                        manifest.record('ontologyParser.py:Ontologies', oboInputs, oboVersion, sorted(outPathList) + [relnOutFile])
+                        print "\n%s nodes and %s ontology relationships have been created." % (locale.format("%d", totalNodeCount, True), locale.format("%d", totalRelnCount, True))
+                    finally:
+                        stageMetrics.finishRun()
+                        nodeIndex.close()
 
 if __name__ == "__main__":
     main(sys.argv[1:])
\ No newline at end of file
@@ -1,6 +1,12 @@
 #!/usr/bin/python
 import csv
 from collections import defaultdict
+from operator import itemgetter
+import chunkedIngest
+import batchWriter
+import inputReader
+import rowPlans
+from nodeRegistry import NodeRegistry
 
 
 class SourceClass(object):
@@ -9,7 +15,9 @@ class SourceClass(object):
     Contains attributes passed in from main() function in refactor.py, and
     Class methods shared between the child classes for header fixing and generic tsv parsing
     """
-    completeNodeSet = set()
+    completeNodeSet = NodeRegistry()  # raw IDs of every node written, per namespace ('ENTREZ')
+    chunkCount = 1  # byte ranges large infiles are split into by chunkedIngest.py, set by refactor.py -c
+    groupMemoryMB = 1024  # memory ceiling of spillGroup.py group-bys before they spill to disk, set by refactor.py -m
 
     def __init__(self, file, source, outPath, filePath, outHeader, inputAttributes, fileHeader, ignoredAttributes):
         self.file = file
@@ -24,20 +32,17 @@ class SourceClass(object):
     def addSourceNames(self, zippedRow):
         """ Adds capitalized source identifier string to unique source ID """
         for header, attr in zippedRow.iteritems():
-            if attr:
-                if header in ['GeneID', 'Other_GeneID']:
-                    zippedRow[header] = 'ENTREZ:' + attr
-                elif header in ['tax_id', 'Other_tax_id', 'OrganismID']:
-                    zippedRow[header] = 'NCBI_TAXONOMY:' + attr
-                elif header == 'MIM number':
-                    zippedRow[header] = 'MIM:' + attr
+            if attr and header in rowPlans.ID_PREFIXES:
+                zippedRow[header] = rowPlans.ID_PREFIXES[header] + attr
         return zippedRow
 
     def getFullSourceName(self):
         """ Returns full name of source instead of condensed directory name """
-        fullNameDict = {'NCBIEntrezGene': 'NCBI_Entrez_Gene',
-                        'CTD': 'Comparative_Toxicogenomics_Database'}
-        return fullNameDict[self.source]
+        return rowPlans.FULL_SOURCE_NAMES[self.source]
+
+    def getRowPlan(self):
+        """ Returns RowPlan compiled from this file's JSON attribute config, see rowPlans.py """
+        return rowPlans.getRowPlan(self.source, self.outHeader, self.inputAttributes, self.ignoredAttributes)
 
     def writeHeader(self):
         """
@@ -45,7 +50,7 @@ class SourceClass(object):
         Keeps header attributes consistent throughout sources ('GO_ID' only instead of 'GO_ID' and 'GOTermID')
         Adds :Label to header as well to identify node label upon database creation
         """
-        with open(self.outPath, 'w') as outFile:
+        with batchWriter.openOutput(self.outPath, 'w') as outFile:
             fixedHeader = [None] * len(self.outHeader)
             fixedHeaderDict = {'CTD': {'GOTermID': 'GO_ID:END_ID', 'ChemicalID': 'ChemicalID:START_ID', 'GeneID': 'GeneID:START_ID',
                                        'PathwayID': 'PathwayID:END_ID', 'InferenceGeneSymbol': 'InferenceGeneSymbol:String[]',
@@ -83,43 +88,85 @@ class SourceClass(object):
             print fixedHeader
             outFile.write('|'.join(fixedHeader) + '\n')
 
+    def getColumnIndices(self):
+        """ Resolves user selected inputAttributes to integer column positions in fileHeader """
+        return [self.fileHeader.index(attr) for attr in self.inputAttributes]
+
+    def getRowProjector(self):
+        """
+        Returns function which picks the inputAttributes columns from a split row as a tuple.
+        itemgetter() returns a bare value for a single index, so that case is wrapped.
+        """
+        columnIndices = self.getColumnIndices()
+        if len(columnIndices) == 1:
+            index = columnIndices[0]
+            return lambda columns: (columns[index],)
+        return itemgetter(*columnIndices)
+
     def parseTsvFile(self):
         """
-        Register tab delimited dialect and open .tsv using csv.DictReader()
-        Filter row in .tsv according to user selected attributes in .json
-        Yields filteredRow from generator
+        Streams tab delimited file through projectTsvLines().
+        Yields filteredRow tuple from generator
         """
-        csv.register_dialect('tabs', delimiter='\t')
         try:
-            with open(self.filePath, 'r') as inFile:
-                try:
-                    tsvReader = csv.DictReader(filter(lambda row: row[0] != '#', inFile),
-                                               dialect='tabs', fieldnames=self.fileHeader)
-                    for row in tsvReader:
-                        filteredRow = [row[i].replace('|', ';') for i in self.inputAttributes]
-                        yield filteredRow  # filtered for only inputAttributes selected (synonyms and main attr)
-                except IOError:
-                    print "Could not properly read in .tsv using csv.DictReader()"
+            inFile = inputReader.openInput(self.filePath)
         except IOError:
-            print "Could not read infile in preparation for creating csv.DictReader() object"
+            print "Could not read infile %s" % self.filePath
+            return
+        # IOError of a corrupt or truncated .gz, raised on close, fails the job
+        with inFile:
+            for filteredRow in self.projectTsvLines(inFile):
+                yield filteredRow
+
+    def parseTsvRange(self, start, end):
+        """
+        Streams the lines of a byte range of the tab delimited file through projectTsvLines().
+        Used by chunkedIngest.py workers, range must start at the beginning of a line.
+        Yields filteredRow tuple from generator
+        """
+        for filteredRow in self.projectTsvLines(chunkedIngest.iterRangeLines(self.filePath, start, end)):
+            yield filteredRow
+
+    def projectTsvLines(self, lines):
+        """
+        Lazily skips '#' comment lines and blank lines.
+        Column positions of user selected attributes in .json are resolved once per file,
+        lines are split only as far as the last needed column.
+        Yields filteredRow tuple from generator
+        """
+        projectRow = self.getRowProjector()
+        lastIndex = max(self.getColumnIndices())
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if not line or line[0] == '#':
+                continue
+            columns = line.replace('|', ';').split('\t', lastIndex + 1)
+            if len(columns) <= lastIndex:
+                columns.extend([''] * (lastIndex + 1 - len(columns)))
+            yield projectRow(columns)  # filtered for only inputAttributes selected (synonyms and main attr)
 
     def parseCsvFile(self):
         """
-        Register comma delimited dialect and open .tsv using csv.DictReader()
-        Filter row in .tsv according to user selected attributes in .json
-        Yields filteredRow from generator
+        Register comma delimited dialect and open .csv using csv.reader() on lazily filtered lines
+        Filter row in .csv according to user selected attributes in .json, by column position
+        Yields filteredRow tuple from generator
         """
         csv.register_dialect('commas', delimiter=',')
+        projectRow = self.getRowProjector()
+        lastIndex = max(self.getColumnIndices())
         try:
-            with open(self.filePath, 'r') as inFile:
-                try:
-                    tsvReader = csv.DictReader(filter(lambda row: row[0] != '#', inFile),
-                                               dialect='commas', fieldnames=self.fileHeader)
-                    for row in tsvReader:
-                        filteredRow = [row[i].replace('|', ';') for i in self.inputAttributes]
-                        yield filteredRow  # filtered for only inputAttributes selected (synonyms and main attr)
-                except IOError:
-                    print "Could not properly read in .csv using csv.DictReader()"
+            inFile = inputReader.openInput(self.filePath)
         except IOError:
-            print "Could not read infile in preparation for creating csv.DictReader() object"
-
+            print "Could not read infile in preparation for creating csv.reader() object"
+            return
+        with inFile:
+            try:
+                csvReader = csv.reader((row for row in inFile if row[0] != '#'), dialect='commas')
+                for columns in csvReader:
+                    if not columns:
+                        continue
+                    if len(columns) <= lastIndex:
+                        columns.extend([''] * (lastIndex + 1 - len(columns)))
+                    yield tuple([attr.replace('|', ';') for attr in projectRow(columns)])
+            except csv.Error:
+                print "Could not properly read in .csv using csv.reader()"
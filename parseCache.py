@@ -0,0 +1,398 @@
+#!/usr/bin/python
+
+import os
+import json
+import mmap
+import locale
+import struct
+import inspect
+import hashlib
+import tempfile
+from array import array
+from itertools import izip
+from collections import defaultdict
+
+"""
+##################################################################################################################
+##########################################   Parse Cache   #####################################################
+##################################################################################################################
+
+* Parsed records (nodes, edges, attribute sets) of one input file are kept in a binary cache table, so the
+    writer stage can rerun from the table alone: a header or label change rewrites the outfiles without reparsing
+    the raw dumps (meshParser.py, ttdParser.py, ontologyParser.py).
+* A table is a list of records with fixed field names, each field holding a string or a list of strings. Strings
+    are stored once in a string pool, a list as one pool string of its values each prefixed by VALUE_SEPARATOR;
+    each field is an array of string IDs, one per record. The file is memory mapped on reload, strings are sliced
+    from the pool as blocks of records are iterated.
+* Tables are stored as csv_out/parseCache/<source>/<infile>.<table>.cache once a main calls enable(), and are
+    reused while the SHA-1 of the infile (through the build manifest hash cache) and the source code of the parsing
+    functions are unchanged. Edits to writer code do not invalidate them. Delete csv_out/parseCache/ to reparse.
+* Without enable() (benchmarks/runner.py, stdin infiles) tables are written to a temporary file, removed on close.
+* File layout: FILE_MAGIC, string pool, pool offsets, per field IDs, JSON header, header length, FILE_MAGIC.
+"""
+
+CACHE_VERSION = 1  # bump when the file layout changes
+CACHE_DIR = 'parseCache'
+FILE_MAGIC = 'PARSECACHE\n'
+ID_TYPE = 'I'  # string IDs
+OFFSET_TYPE = 'L'  # string pool byte offsets
+BLOCK_RECORDS = 1 << 14  # records decoded together by CacheTable
+VALUE_SEPARATOR = '\x1f'  # prefixes each value of a list field, infile values never hold it
+POOL_INDEX_LIMIT = 1 << 20  # distinct strings looked up for reuse, the lookup restarts beyond it to bound memory
+
+cacheState = dict()  # cacheDir, manifest; inherited by forked workers
+
+
+def enable(outDir, manifest):
+    """ Keeps tables in outDir/parseCache/, input files are hashed through manifest (a BuildManifest) """
+    cacheState.update(cacheDir=os.path.join(outDir, CACHE_DIR), manifest=manifest)
+
+
+def getCodeVersion(*sources):
+    """ Returns digest of the source code of parsing functions or modules, records change only when they do """
+    digest = hashlib.sha1(str(CACHE_VERSION))
+    for source in sources:
+        digest.update(inspect.getsource(source))
+    return digest.hexdigest()
+
+
+def getCachePath(inputPath, tableName):
+    """ Returns path of the cache table of inputPath, None when caching is not enabled or inputPath is not a file """
+    if not cacheState or not os.path.isfile(inputPath):
+        return None
+    sourceName = os.path.basename(os.path.dirname(os.path.abspath(inputPath)))
+    return os.path.join(cacheState['cacheDir'], sourceName, '%s.%s.cache' % (os.path.basename(inputPath), tableName))
+
+
+def getSignature(inputPath, codeVersion, dependPaths=()):
+    """ Returns signature of a table: digests of inputPath and dependPaths (infiles the parse filters on), code version """
+    return cacheState['manifest'].getSignature([inputPath] + list(dependPaths), codeVersion)
+
+
+def load(inputPath, tableName, codeVersion, dependPaths=()):
+    """ Returns cached CacheTable of inputPath, None when there is none or it is stale """
+    cachePath = getCachePath(inputPath, tableName)
+    if cachePath is None or not os.path.isfile(cachePath):
+        return None
+    try:
+        table = CacheTable(cachePath)
+    except (EnvironmentError, ValueError, KeyError, struct.error):
+        return None
+    if table.signature != getSignature(inputPath, codeVersion, dependPaths):
+        table.close()
+        return None
+    print "\tRead %s parsed records from %s" % (locale.format('%d', len(table), True), cachePath)
+    return table
+
+
+def build(inputPath, tableName, codeVersion, fieldNames, records, meta=None, dependPaths=()):
+    """
+    Returns TableBuild writing records (lists aligned with fieldNames) of inputPath into a table as they are read.
+    meta is a JSON serializable dict kept with the table (e.g. the source name of an empty file).
+    """
+    cachePath = getCachePath(inputPath, tableName)
+    if cachePath is None:
+        tempFD, cachePath = tempfile.mkstemp(prefix='parseCache.', suffix='.cache')
+        os.close(tempFD)
+        signature = None
+    else:
+        signature = getSignature(inputPath, codeVersion, dependPaths)
+        if not os.path.isdir(os.path.dirname(cachePath)):
+            try:
+                os.makedirs(os.path.dirname(cachePath))
+            except OSError:  # created meanwhile by a pool worker
+                pass
+    return TableBuild(TableWriter(cachePath, fieldNames, signature, meta), records, temporary=signature is None)
+
+
+def getTable(inputPath, tableName, codeVersion, parse, dependPaths=()):
+    """
+    Returns CacheTable of inputPath from the cache, or TableBuild of the records of parse(), which returns
+    (fieldNames, records) and is only called when the cache is missing or stale.
+    """
+    table = load(inputPath, tableName, codeVersion, dependPaths)
+    if table is None:
+        fieldNames, records = parse()
+        table = build(inputPath, tableName, codeVersion, fieldNames, records, dependPaths=dependPaths)
+    return table
+
+
+def getKeyedRecords(keyField, itemDict):
+    """
+    Returns (fieldNames, records) for a dict of key to dict of field to values, as ttdParser builds.
+    Fields are keyField then every inner field name, sorted.
+    """
+    fieldNames = sorted(set(field for valueDict in itemDict.itervalues() for field in valueDict))
+    records = ([key] + [valueDict.get(field) for field in fieldNames] for key, valueDict in itemDict.iteritems())
+    return [keyField] + fieldNames, records
+
+
+class RecordView(object):
+    """
+    Record views shared by CacheTable and TableBuild, built on the iterRecords() of the subclass, which yields
+    each record as a list of value lists, one per field. Use as a context manager.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def iterRows(self):
+        """ Yields each record as a tuple of the first value of every field, '' for fields without values """
+        for record in self.iterRecords():
+            yield tuple([values[0] if values else '' for values in record])
+
+    def iterDicts(self):
+        """ Yields each record as a defaultdict(list) of field name to values """
+        fieldNames = self.fieldNames
+        for record in self.iterRecords():
+            valueDict = defaultdict(list)
+            for fieldName, values in zip(fieldNames, record):
+                if values:
+                    valueDict[fieldName] = values
+            yield valueDict
+
+    def iteritems(self):
+        """ Yields (first value of the first field, defaultdict(list) of the other fields), for keyed tables """
+        keyField = self.fieldNames[0]
+        for valueDict in self.iterDicts():
+            key = valueDict.pop(keyField, [''])[0]
+            yield key, valueDict
+
+
+class TableBuild(RecordView):
+    """
+    Table being built from parsed records: iterRecords() adds each record to the TableWriter as the writer stage
+    reads it, so a cache miss parses once and does not read the table back. The table is complete once every
+    record is read; len() and getColumn() read any remaining records first, then use the finished table.
+    A build closed before then (an exception in the writer stage) is discarded.
+    """
+    def __init__(self, tableWriter, records, temporary=False):
+        self.tableWriter = tableWriter
+        self.records = records
+        self.temporary = temporary
+        self.fieldNames = tableWriter.fieldNames
+        self.meta = tableWriter.meta
+        self.started = False
+        self.table = None
+
+    def iterRecords(self):
+        """ Yields each parsed record, as CacheTable.iterRecords() would, after adding it to the table """
+        if self.started:
+            raise ValueError("Records of %s can only be read once while it is built" % self.tableWriter.path)
+        self.started = True
+        tableWriter = self.tableWriter
+        for record in self.records:
+            tableWriter.add(record)
+            yield [list(value or ()) if listField else [value] for value, listField in zip(record, tableWriter.listFields)]
+        self.tableWriter.close()
+        self.table = CacheTable(self.tableWriter.path, self.temporary)
+
+    def finish(self):
+        """ Reads the records not read yet, returns the finished CacheTable """
+        if self.table is None:
+            for record in self.iterRecords():
+                pass
+        return self.table
+
+    def __len__(self):
+        return len(self.finish())
+
+    def getColumn(self, fieldName):
+        """ Returns list of the first value of fieldName in every record, '' for records without one """
+        return self.finish().getColumn(fieldName)
+
+    def close(self):
+        """ Closes the finished table, or discards an unfinished one and closes the record source """
+        if self.table is not None:
+            self.table.close()
+            return
+        if hasattr(self.records, 'close'):
+            self.records.close()
+        self.tableWriter.abort()
+        if self.temporary and os.path.exists(self.tableWriter.path):
+            os.remove(self.tableWriter.path)
+
+
+class TableWriter(object):
+    """
+    Writes a table to path. String IDs and new pool strings are buffered in lists and flushed every BLOCK_RECORDS
+    records: pool strings to the file, IDs and pool offsets to the arrays kept in memory and written with the header
+    by close(). The file replaces path atomically on close(). A field is a list field unless its value in the first
+    record is a string.
+    """
+    def __init__(self, path, fieldNames, signature, meta=None):
+        self.path = path
+        self.fieldNames = list(fieldNames)
+        self.signature = signature
+        self.meta = meta or dict()
+        self.tempPath = '%s.%d.tmp' % (path, os.getpid())
+        self.outFile = open(self.tempPath, 'wb', 1 << 20)
+        self.outFile.write(FILE_MAGIC)
+        self.stringIDs = dict()
+        self.poolOffsets = array(OFFSET_TYPE, [len(FILE_MAGIC)])
+        self.values = [array(ID_TYPE) for fieldName in self.fieldNames]
+        self.listFields = None  # True for each list field, set by the first record
+        self.pendingIDs = []  # IDs of the records since the last flush, record by record
+        self.pendingStrings = []  # pool strings added since the last flush
+        self.nextID = 0  # ID of the first pending pool string
+        self.recordCount = 0
+
+    def add(self, record):
+        """ Adds record, one value per field: a string, or a list, tuple or set of strings (None for no values) """
+        if len(record) != len(self.fieldNames):
+            raise ValueError("Record has %d values for %d fields: %r" % (len(record), len(self.fieldNames), record))
+        if self.listFields is None:
+            self.listFields = [not isinstance(value, basestring) for value in record]
+        stringIDs = self.stringIDs
+        pendingIDs = self.pendingIDs
+        pendingStrings = self.pendingStrings
+        for value, listField in zip(record, self.listFields):
+            if listField:
+                value = VALUE_SEPARATOR + VALUE_SEPARATOR.join(value) if value else ''
+            elif not isinstance(value, basestring):
+                raise ValueError("%r in a string field of %s" % (value, self.path))
+            stringID = stringIDs.get(value)
+            if stringID is None:
+                stringID = stringIDs[value] = self.nextID + len(pendingStrings)
+                pendingStrings.append(value)
+            pendingIDs.append(stringID)
+        self.recordCount += 1
+        if not self.recordCount % BLOCK_RECORDS:
+            self.flush()
+
+    def flush(self):
+        """ Writes pending pool strings to the file, moves pending IDs and pool offsets to the arrays """
+        offset = self.poolOffsets[-1]
+        offsetList = []
+        for string in self.pendingStrings:
+            offset += len(string)
+            offsetList.append(offset)
+        self.outFile.write(''.join(self.pendingStrings))
+        self.poolOffsets.extend(offsetList)
+        self.nextID += len(offsetList)
+        fieldCount = len(self.fieldNames)
+        for index, valueArray in enumerate(self.values):
+            valueArray.extend(self.pendingIDs[index::fieldCount])
+        self.pendingIDs = []
+        self.pendingStrings = []
+        if len(self.stringIDs) >= POOL_INDEX_LIMIT:
+            self.stringIDs.clear()
+
+    def close(self):
+        """ Writes the arrays, header and trailer, and moves the table to path """
+        self.flush()
+        self.stringIDs = dict()
+        sectionList = []
+        offset = self.poolOffsets[-1]
+        for name, valueArray in [('poolOffsets', self.poolOffsets)] + zip(self.fieldNames, self.values):
+            sectionList.append([name, valueArray.typecode, valueArray.itemsize, offset, len(valueArray)])
+            valueArray.tofile(self.outFile)
+            offset += len(valueArray) * valueArray.itemsize
+        listFields = [fieldName for fieldName, listField in zip(self.fieldNames, self.listFields or ()) if listField]
+        header = json.dumps({'cacheVersion': CACHE_VERSION, 'signature': self.signature, 'fields': self.fieldNames,
+                             'listFields': listFields, 'recordCount': self.recordCount, 'meta': self.meta,
+                             'sections': sectionList})
+        self.outFile.write(header)
+        self.outFile.write(struct.pack('<Q', len(header)) + FILE_MAGIC)
+        self.outFile.close()
+        os.rename(self.tempPath, self.path)
+
+    def abort(self):
+        """ Removes the partly written table """
+        if not self.outFile.closed:
+            self.outFile.close()
+            os.remove(self.tempPath)
+
+
+class CacheTable(RecordView):
+    """
+    Memory mapped table written by TableWriter. Records are read in the order they were added,
+    BLOCK_RECORDS at a time: the strings of a block are sliced from the mapped pool field by field.
+    Supports len() and use as a context manager; a temporary table's file is removed on close().
+    """
+    def __init__(self, path, temporary=False):
+        self.path = path
+        self.temporary = temporary
+        with open(path, 'rb') as inFile:
+            self.pool = mmap.mmap(inFile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.readHeader()
+        except:
+            self.close()
+            raise
+
+    def __len__(self):
+        return self.recordCount
+
+    def readHeader(self):
+        """ Checks both magic strings, reads the JSON header and the ID and offset arrays """
+        trailerStart = len(self.pool) - 8 - len(FILE_MAGIC)
+        if self.pool[:len(FILE_MAGIC)] != FILE_MAGIC or self.pool[trailerStart + 8:] != FILE_MAGIC:
+            raise ValueError("%s is not a parse cache table" % self.path)
+        headerLength = struct.unpack('<Q', self.pool[trailerStart:trailerStart + 8])[0]
+        header = json.loads(self.pool[trailerStart - headerLength:trailerStart])
+        if header['cacheVersion'] != CACHE_VERSION:
+            raise ValueError("%s has cache version %s" % (self.path, header['cacheVersion']))
+        self.signature = header['signature']
+        self.fieldNames = [str(fieldName) for fieldName in header['fields']]
+        self.recordCount = header['recordCount']
+        self.meta = dict((str(key), value.encode('utf-8') if isinstance(value, unicode) else value)
+                         for key, value in header['meta'].iteritems())
+        arrayDict = dict()
+        for name, typecode, itemsize, offset, length in header['sections']:
+            valueArray = array(str(typecode))
+            if valueArray.itemsize != itemsize:
+                raise ValueError("%s was written with %d byte '%s' items" % (self.path, itemsize, typecode))
+            valueArray.fromstring(self.pool[offset:offset + length * itemsize])
+            arrayDict[name] = valueArray
+        self.poolOffsets = arrayDict['poolOffsets']
+        self.values = [arrayDict[fieldName] for fieldName in self.fieldNames]
+        self.listFields = [fieldName in header['listFields'] for fieldName in self.fieldNames]
+
+    def getStrings(self, valueArray, start, end):
+        """ Returns list of the pool strings of IDs valueArray[start:end] """
+        pool = self.pool
+        poolOffsets = self.poolOffsets
+        return [pool[poolOffsets[stringID]:poolOffsets[stringID + 1]] for stringID in valueArray[start:end]]
+
+    def iterBlocks(self):
+        """ Yields list of the pool strings of each field for each block of BLOCK_RECORDS records """
+        for blockStart in xrange(0, self.recordCount, BLOCK_RECORDS):
+            blockEnd = min(blockStart + BLOCK_RECORDS, self.recordCount)
+            yield [self.getStrings(values, blockStart, blockEnd) for values in self.values]
+
+    def iterRecords(self):
+        """ Yields each record as a list of value lists, one per field """
+        listFields = self.listFields
+        for columnList in self.iterBlocks():
+            for strings in izip(*columnList):
+                yield [string.split(VALUE_SEPARATOR)[1:] if listField else [string]
+                       for string, listField in zip(strings, listFields)]
+
+    def iterRows(self):
+        """ Yields each record as a tuple of the first value of every field, zipped by blocks when no field is a list """
+        if any(self.listFields):
+            for row in RecordView.iterRows(self):
+                yield row
+            return
+        for columnList in self.iterBlocks():
+            for row in izip(*columnList):
+                yield row
+
+    def getColumn(self, fieldName):
+        """ Returns list of the first value of fieldName in every record, '' for records without one """
+        fieldIndex = self.fieldNames.index(fieldName)
+        strings = self.getStrings(self.values[fieldIndex], 0, self.recordCount)
+        if self.listFields[fieldIndex]:
+            return [string.split(VALUE_SEPARATOR, 2)[1] if string else '' for string in strings]
+        return strings
+
+    def close(self):
+        """ Unmaps the table, and removes it if temporary """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+        if self.temporary and os.path.exists(self.path):
+            os.remove(self.path)
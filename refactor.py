@@ -8,21 +8,217 @@ import general
 import json
 import yaml
 import importlib
+import multiprocessing
+import buildManifest
+import batchWriter
+import inputReader
+import stageMetrics
+import nodeIndex
 from collections import OrderedDict
+from parent import SourceClass
 
 """
 Add docs ASAP
 RUN AS: python refactor.py -p ~/path/to/top/dir -s 'NCBIEntrezGene' for entrez
+Add -j N to run the files of every source through a pool of N worker processes
+Add -c N to split large row-wise files (gene2pubmed, gene2go, ...) into N byte ranges parsed in parallel
+Add -m MB to set the memory ceiling of CTD relationship group-bys, which spill to disk above it (default 1024)
+Files whose inputs are unchanged since the last build are skipped, add -f to rebuild everything
+Add -z to write gzip compressed outfiles (.out.gz)
+Per-file time, rows and memory are printed as each file finishes and written to csv_out/runReport.refactor.json
+Gene IDs are published to csv_out/nodeIndex.sqlite, gene2go and gene_group endpoints are checked against GO and
+taxonomy nodes other parsers published there; those files are rebuilt once the nodes they were checked against change
 Still working on CTD
 """
 
+# Files which must be finished before the keyed file can run. Relationship writers filter on
+# SourceClass.completeNodeSet, which is only filled once the gene_info node writers are done.
+FILE_DEPENDENCIES = {'gene2go': ['gene_info'],
+                     'gene_group': ['gene_info'],
+                     'mim2gene_medgen': ['gene_info'],
+                     'gene2pubmed': ['gene_info'],
+                     'CTD_chem_gene_ixns.tsv': ['CTD_chem_gene_ixn_types.tsv']}
+
+
+def getFileJobs(topDir, outDir, source):
+    """
+    Reads JSON attribute file for source and returns one job tuple per file to parse.
+    Job tuple holds the SourceClass constructor arguments.
+    """
+    jobList = list()
+    jsonPath = os.path.join(topDir, 'jsonFiles', source.lower() + '.json')
+    try:
+        # extract nested JSON data structure, safe_load ensures non unicode strings
+        with open(jsonPath, 'r') as jsonInfile:
+            jsonDump = json.dumps(json.load(jsonInfile, object_pairs_hook=OrderedDict))
+            jsonOrderedDict = general.ordered_load(jsonDump, yaml.SafeLoader)
+
+            #  Prepare attribute args for each file and upcoming class creation
+            for file, attributeList in jsonOrderedDict.iteritems():
+                filePath = inputReader.resolveInput(os.path.join(topDir, source, file))
+                outPath = batchWriter.getOutputPath(os.path.join(outDir, file + ".out"))
+                fileHeader = [attr.replace('+', '').replace('$', '') for attr in attributeList]
+                inputAttributes = [attr[1:] for attr in attributeList if '+' in attr or '$' in attr]
+                ignoredAttributes = [attr[1:] for attr in attributeList if '$' in attr]
+                outHeader = [attr for attr in inputAttributes if attr not in ignoredAttributes]
+                jobList.append((file, source, outPath, filePath, outHeader, inputAttributes, fileHeader, ignoredAttributes))
+    except IOError:
+        print "Could not properly load .json file."
+        sys.exit()
+    return jobList
+
+
+def getDependencies(job, jobList):
+    """ Returns jobs from jobList which must finish before job can run """
+    depSuffixes = list()
+    for fileName, suffixes in FILE_DEPENDENCIES.iteritems():
+        if job[0].endswith(fileName):
+            depSuffixes.extend(suffixes)
+    return [other for other in jobList if other is not job and other[0].endswith(tuple(depSuffixes))]
+
+
+def isProducer(job):
+    """ True if other files depend on state (node set, type table) filled while running job """
+    return any(job[0].endswith(tuple(suffixes)) for suffixes in FILE_DEPENDENCIES.values())
+
+
+def planJobs(jobList):
+    """
+    Plans jobList as a dependency graph and returns it as a list of waves.
+    Every job in a wave only depends on jobs in earlier waves, so a wave can run concurrently.
+    Within a wave, largest infiles are scheduled first so the long jobs start right away.
+    """
+    levelDict = dict()
+
+    def getLevel(job):
+        if job[0] not in levelDict:
+            depLevels = [getLevel(dep) for dep in getDependencies(job, jobList)]
+            levelDict[job[0]] = max(depLevels) + 1 if depLevels else 0
+        return levelDict[job[0]]
+
+    waveList = [list() for i in range(max(getLevel(job) for job in jobList) + 1)] if jobList else []
+    for job in jobList:
+        waveList[getLevel(job)].append(job)
+    for wave in waveList:
+        wave.sort(key=getJobSize, reverse=True)
+    return waveList
+
+
+def getJobSize(job):
+    """ Size of job infile in bytes, 0 if it can not be found """
+    try:
+        return os.path.getsize(job[3])
+    except OSError:
+        return 0
+
+
+def runFileJob(job):
+    """
+    Creates the source class instance for job and runs checkFile().
+    Returns job, and the state dependent jobs need when job is a producer, otherwise None.
+    Module level so it can be handed to multiprocessing.Pool workers.
+    """
+    file, source = job[0], job[1]
+    print '\n'
+    print file
+
+    #  Differentiate sources here by importing sourceClasses.py module
+    #  and dynamically calling source classes
+    classModule = importlib.import_module(source.lower())
+    MySourceClass = getattr(classModule, source)
+
+    print 'outHeader: ', job[4], '\n'
+    sourceInstance = MySourceClass(*job)
+    try:
+        sourceInstance.checkFile()
+    finally:
+        nodeIndex.close()  # pool workers exit without closing, the last connection closed removes the -wal file
+    if isProducer(job):
+        return job, (source, classModule.SourceClass.completeNodeSet, getattr(classModule, 'typeDict', None))
+    return job, None
+
+
+def mergeJobState(jobState):
+    """ Merges state returned from a producer job in a worker process into this process """
+    source, completeNodeSet, typeDict = jobState
+    classModule = importlib.import_module(source.lower())
+    classModule.SourceClass.completeNodeSet.update(completeNodeSet)
+    if typeDict:
+        classModule.typeDict.update(typeDict)
+
+
+def runParallel(jobList, jobs, jobDone):
+    """
+    Runs waves from planJobs() through a process pool of at most jobs workers.
+    A new pool is forked for each wave, after the previous wave's producer state
+    is merged, so workers see the filled SourceClass.completeNodeSet.
+    jobDone(job) is called in this process as each job finishes.
+    """
+    for wave in planJobs(jobList):
+        pool = multiprocessing.Pool(min(jobs, len(wave)))
+        try:
+            for job, jobState in pool.imap_unordered(runFileJob, wave, chunksize=1):
+                if jobState:
+                    mergeJobState(jobState)
+                jobDone(job)
+        except:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+
+def getJobInputs(job, jobList, topDir):
+    """ Returns paths job output is built from: its infile, the source JSON config and infiles of jobs it depends on """
+    inputPaths = [job[3], os.path.join(topDir, 'jsonFiles', job[1].lower() + '.json')]
+    inputPaths.extend(dep[3] for dep in getDependencies(job, jobList))
+    return inputPaths
+
+
+def getJobVersion(job):
+    """
+    Returns parser version of job, hashed from the modules its output depends on. Jobs whose relationships are
+    checked against the node index (INDEX_ENDPOINTS of the source module) add the state of the checked namespace.
+    """
+    moduleDir = os.path.dirname(os.path.abspath(__file__))
+    version = buildManifest.getParserVersion(*[os.path.join(moduleDir, name + '.py') for name in
+                                               ['refactor', 'parent', 'chunkedIngest', 'nodeRegistry', 'nodeIndex', 'rowPlans', 'spillGroup',
+                                                'batchWriter', 'inputReader', job[1].lower()]])
+    endpoint = getattr(importlib.import_module(job[1].lower()), 'INDEX_ENDPOINTS', dict()).get(job[0])
+    if endpoint:
+        version += '|' + nodeIndex.getNamespaceState(endpoint[0])
+    return version
+
+
+def selectStaleJobs(jobList, manifest, topDir, versionDict):
+    """
+    Returns jobs from jobList, in order, whose output is missing or built from changed inputs.
+    Jobs a stale job depends on are rerun as well, they fill SourceClass.completeNodeSet.
+    """
+    staleList = [job for job in jobList if not manifest.isCurrent('refactor.py:' + job[0], getJobInputs(job, jobList, topDir),
+                                                                  versionDict[job[0]])]
+    pendingList = list(staleList)
+    while pendingList:
+        for dep in getDependencies(pendingList.pop(), jobList):
+            if dep not in staleList:
+                staleList.append(dep)
+                pendingList.append(dep)
+    for job in jobList:
+        if job not in staleList:
+            print "\n%s is up to date, skipping" % job[0]
+    return [job for job in jobList if job in staleList]
+
 
 def main(argv):
     """ If run as main script, function executes with user input """
     topDir = ""
     source = ""
+    jobs = 1
+    force = False
     try:
-        opts, args = getopt.getopt(argv, 'hp:s:', ['help', 'dirPath=', 'source='])
+        opts, args = getopt.getopt(argv, 'hp:s:j:c:m:fz', ['help', 'dirPath=', 'source=', 'jobs=', 'chunks=', 'memory=', 'force', 'gzip'])
         if len(argv) == 0:
             general.howToRun()
     except getopt.GetoptError:
@@ -36,46 +232,49 @@ def main(argv):
             topDir = arg
         elif opt in ['-s', '--source']:
             sourceString = arg
-    # startTime = time.clock()
+        elif opt in ['-j', '--jobs']:
+            jobs = int(arg)
+        elif opt in ['-c', '--chunks']:
+            SourceClass.chunkCount = int(arg)
+        elif opt in ['-m', '--memory']:
+            SourceClass.groupMemoryMB = int(arg)
+        elif opt in ['-f', '--force']:
+            force = True
+        elif opt in ['-z', '--gzip']:
+            batchWriter.compressOutputs = True
     locale.setlocale(locale.LC_ALL, "")
     outDir = general.createOutDirectory(topDir)
 
     sourceList = sourceString.strip().split(',')
 
-    #  Runs for each source
+    #  Gathers jobs for each source
+    jobList = list()
     for source in sourceList:
         print '\n~~~~~~~~~~~~~~~~~~~~~~\n', source
-        jsonPath = os.path.join(topDir, 'jsonFiles', source.lower() + '.json')
+        jobList.extend(getFileJobs(topDir, outDir, source))
 
-        try:
-            # extract nested JSON data structure, safe_load ensures non unicode strings
-            with open(jsonPath, 'r') as jsonInfile:
-                jsonDump = json.dumps(json.load(jsonInfile, object_pairs_hook=OrderedDict))
-                jsonOrderedDict = general.ordered_load(jsonDump, yaml.SafeLoader)
-
-                #  Prepare attribute args for each file and upcoming class creation
-                for file, attributeList in jsonOrderedDict.iteritems():
-                    filePath = os.path.join(topDir, source, file)
-                    outPath = os.path.join(outDir, file + ".out")
-                    fileHeader = [attr.replace('+', '').replace('$', '') for attr in attributeList]
-                    inputAttributes = [attr[1:] for attr in attributeList if '+' in attr or '$' in attr]
-                    ignoredAttributes = [attr[1:] for attr in attributeList if '$' in attr]
-                    outHeader = [attr for attr in inputAttributes if attr not in ignoredAttributes]
-
-                    #  Differentiate sources here by importing sourceClasses.py module
-                    #  and dynamically calling source classes
-                    print '\n'
-                    print file
-                    classModule = importlib.import_module(source.lower())
-                    MySourceClass = getattr(classModule, source)
-
-                    print 'outHeader: ', outHeader, '\n'
-                    sourceInstance = MySourceClass(file, source, outPath, filePath, outHeader, inputAttributes, fileHeader, ignoredAttributes)
-                    sourceInstance.checkFile()
-
-        except IOError:
-            print "Could not properly load .json file."
-            sys.exit()
+    #  Skips files whose infile, JSON config, parser code and checked node index namespaces are unchanged since the last build.
+    #  Versions are taken once, before any job runs, so nodes published meanwhile make the next run rebuild.
+    nodeIndex.enable(outDir)
+    versionDict = dict((job[0], getJobVersion(job)) for job in jobList)
+    nodeIndex.close()  # not carried into the forked pool workers, they open their own
+    manifest = buildManifest.BuildManifest(outDir, force)
+    staleJobList = selectStaleJobs(jobList, manifest, topDir, versionDict)
+
+    def jobDone(job):
+        manifest.record('refactor.py:' + job[0], getJobInputs(job, jobList, topDir), versionDict[job[0]], [job[2]])
+
+    stageMetrics.startRun('refactor', outDir)
+    try:
+        if jobs > 1:
+            runParallel(staleJobList, jobs, jobDone)
+        else:
+            for job in staleJobList:
+                runFileJob(job)
+                jobDone(job)
+    finally:
+        stageMetrics.finishRun()
+        nodeIndex.close()
 
 if __name__ == "__main__":
     main(sys.argv[1:])
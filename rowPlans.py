@@ -0,0 +1,93 @@
+#!/usr/bin/python
+
+import json
+import hashlib
+
+"""
+##################################################################################################################
+##########################################   Row Plans   #######################################################
+##################################################################################################################
+
+* Compiles the JSON attribute config of one file (outHeader, inputAttributes, ignoredAttributes) into a RowPlan
+    once, instead of zipping every row into an OrderedDict and prefixing it key by key.
+* A RowPlan fixes column positions by header name, the (column, ID prefix) pairs of SourceClass.addSourceNames(),
+    the gene node synonym columns and the constant full source name, so each row is a flat tuple operation.
+* Plans are cached by a hash of the config: files sharing a config (All_Mammalia.gene_info, All_Plants.gene_info)
+    share one plan, and forked workers (refactor.py -j, chunkedIngest.py) inherit the compiled plans.
+"""
+
+# ID prefixes added to non empty values of these columns, as SourceClass.addSourceNames() does
+ID_PREFIXES = {'GeneID': 'ENTREZ:',
+               'Other_GeneID': 'ENTREZ:',
+               'tax_id': 'NCBI_TAXONOMY:',
+               'Other_tax_id': 'NCBI_TAXONOMY:',
+               'OrganismID': 'NCBI_TAXONOMY:',
+               'MIM number': 'MIM:'}
+
+# full names of sources instead of condensed directory names
+FULL_SOURCE_NAMES = {'NCBIEntrezGene': 'NCBI_Entrez_Gene',
+                     'CTD': 'Comparative_Toxicogenomics_Database'}
+
+planCache = dict()  # config hash to RowPlan
+
+
+def getConfigHash(source, outHeader, inputAttributes, ignoredAttributes):
+    """ Returns SHA-1 of the parts of a file's JSON config a RowPlan is compiled from """
+    config = json.dumps([source, list(outHeader), list(inputAttributes), list(ignoredAttributes)])
+    return hashlib.sha1(config).hexdigest()
+
+
+def getRowPlan(source, outHeader, inputAttributes, ignoredAttributes):
+    """ Returns the cached RowPlan for this config, compiling it on first use """
+    configHash = getConfigHash(source, outHeader, inputAttributes, ignoredAttributes)
+    if configHash not in planCache:
+        planCache[configHash] = RowPlan(source, outHeader, inputAttributes, ignoredAttributes)
+    return planCache[configHash]
+
+
+class RowPlan(object):
+    """
+    Row transform compiled from one JSON attribute config, for rows yielded by SourceClass.parseTsvFile().
+    Columns are named by outHeader position, as zip(outHeader, row) paired them.
+    """
+    def __init__(self, source, outHeader, inputAttributes, ignoredAttributes):
+        self.sourceName = FULL_SOURCE_NAMES[source]
+        self.width = len(outHeader)
+        self.columns = dict((header, index) for index, header in enumerate(outHeader))
+        self.prefixList = [(index, ID_PREFIXES[header]) for index, header in enumerate(outHeader) if header in ID_PREFIXES]
+
+        # gene node rows are inputAttributes ordered: ignored ($) and synonym columns are joined into Synonyms
+        synonymIndices = [index for index, attr in enumerate(inputAttributes) if attr in ignoredAttributes]
+        synonymIndices.extend(index for index, attr in enumerate(inputAttributes) if attr.lower() in ['synonym', 'synonyms'])
+        self.synonymIndices = synonymIndices
+        self.nodeIndices = [index for index in range(len(inputAttributes)) if index not in synonymIndices]
+        self.synonymPosition = outHeader.index('Synonyms') if 'Synonyms' in outHeader else None
+        self.nodeSuffix = '|%s|Gene\n' % self.sourceName
+
+    def index(self, header):
+        """ Returns column position of header in rows """
+        return self.columns[header]
+
+    def getter(self, *headers):
+        """ Returns function picking headers from a row as a tuple """
+        indices = [self.columns[header] for header in headers]
+        return lambda row: tuple([row[index] for index in indices])
+
+    def prefixRow(self, row):
+        """ Returns the outHeader columns of row as a list, ID prefixes added to non empty ID columns """
+        row = list(row[:self.width])
+        for index, prefix in self.prefixList:
+            if row[index]:
+                row[index] = prefix + row[index]
+        return row
+
+    def formatGeneNode(self, row):
+        """
+        Returns (raw gene ID, node line) for a gene_info row.
+        '-' placeholders are dropped, ignored and synonym columns are joined with ';' into Synonyms.
+        """
+        nodeList = [row[index] for index in self.nodeIndices if row[index] != '-']
+        nodeList.insert(self.synonymPosition, ';'.join([row[index] for index in self.synonymIndices if row[index] != '-']))
+        geneID = nodeList[0]
+        nodeList[0] = 'ENTREZ:' + geneID
+        return geneID, '|'.join(nodeList) + self.nodeSuffix
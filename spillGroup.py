@@ -0,0 +1,151 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+from collections import defaultdict
+
+"""
+##################################################################################################################
+##########################################   Spill Group   #####################################################
+##################################################################################################################
+
+* Group-by with a memory ceiling, for relationship files aggregated into a set of values per attribute and key
+    (CTD_chemicals_diseases.tsv keyed by (ChemicalID, DiseaseID), CTD_diseases_pathways.tsv, ...).
+* Rows are aggregated in memory until the estimated size of the groups reaches the ceiling. The groups are then
+    hash partitioned by key into PARTITION_COUNT run files and memory is cleared; this repeats as often as needed.
+* iteritems() yields finished groups. Without a spill they come straight from memory. After a spill, each partition
+    holds every run of its keys, so partitions are aggregated and yielded one at a time. A partition that is itself
+    over the ceiling is partitioned again with a different hash, up to MAX_LEVEL times.
+* Run files are tab separated, values of one attribute are joined by '\\x1e'. Infile values never hold tabs or newlines.
+"""
+
+PARTITION_COUNT = 16
+MAX_LEVEL = 3  # repartitioning depth, partitions at this depth are aggregated in memory whatever their size
+GROUP_BYTES = 400  # estimated bytes of one group's key tuple and value set list
+VALUE_BYTES = 80  # estimated bytes of one set entry, on top of its string
+VALUE_SEPARATOR = '\x1e'
+
+
+class SpillGroup(object):
+    """
+    Groups added rows by key, holding a set of values per field in fieldNames.
+    Yields (key, defaultdict(set) of field name to values) from iteritems(). Use as a context manager,
+    run files are removed on exit.
+    """
+    def __init__(self, fieldNames, memoryLimit, tempDir=None, level=0):
+        self.fieldNames = list(fieldNames)
+        self.memoryLimit = memoryLimit
+        self.tempDir = tempDir
+        self.level = level
+        self.groups = dict()
+        self.memoryBytes = 0
+        self.spillDir = None
+        self.spillCount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def add(self, key, values):
+        """ Adds values, aligned with fieldNames, to the group of key; empty values are skipped """
+        group = self.getGroup(key)
+        for index, value in enumerate(values):
+            if value:
+                valueSet = group[index]
+                if valueSet is None:
+                    valueSet = group[index] = set()
+                if value not in valueSet:
+                    valueSet.add(value)
+                    self.memoryBytes += VALUE_BYTES + len(value)
+        if self.memoryBytes >= self.memoryLimit and self.level < MAX_LEVEL:
+            self.spill()
+
+    def addRun(self, key, columns):
+        """ Adds one run file record, a joined value set per field, to the group of key """
+        group = self.getGroup(key)
+        for index, column in enumerate(columns):
+            if column:
+                valueSet = group[index]
+                if valueSet is None:
+                    valueSet = group[index] = set()
+                sizeBefore = len(valueSet)
+                values = column.split(VALUE_SEPARATOR)
+                valueSet.update(values)
+                if len(valueSet) != sizeBefore:
+                    self.memoryBytes += (len(valueSet) - sizeBefore) * VALUE_BYTES + len(column)
+        if self.memoryBytes >= self.memoryLimit and self.level < MAX_LEVEL:
+            self.spill()
+
+    def getGroup(self, key):
+        """ Returns value set list of key, created on first use """
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = [None] * len(self.fieldNames)
+            self.memoryBytes += GROUP_BYTES
+        return group
+
+    def spill(self):
+        """ Appends every group in memory to the run file of its partition and clears memory """
+        if self.spillDir is None:
+            self.spillDir = tempfile.mkdtemp(prefix='spillGroup.', dir=self.tempDir)
+        partitionFiles = [open(self.getPartitionPath(index), 'ab', 1 << 20) for index in range(PARTITION_COUNT)]
+        try:
+            level = self.level
+            for key, group in self.groups.iteritems():
+                record = '\t'.join(key) + '\t' + '\t'.join([VALUE_SEPARATOR.join(valueSet) if valueSet else ''
+                                                            for valueSet in group])
+                partitionFiles[hash((level,) + key) % PARTITION_COUNT].write(record + '\n')
+        finally:
+            for partitionFile in partitionFiles:
+                partitionFile.close()
+        if not self.spillCount and not self.level:
+            print "\tGroup-by memory ceiling of %d MB reached, spilling groups to %s" % (self.memoryLimit >> 20, self.spillDir)
+        self.spillCount += 1
+        self.groups = dict()
+        self.memoryBytes = 0
+
+    def getPartitionPath(self, index):
+        """ Returns path of run file holding partition index """
+        return os.path.join(self.spillDir, 'partition%d' % index)
+
+    def iteritems(self):
+        """ Yields (key, defaultdict(set) of field name to values) for every group """
+        if not self.spillCount:
+            for key, group in self.groups.iteritems():
+                yield key, self.getValueDict(group)
+            self.groups = dict()
+            return
+        if self.groups:
+            self.spill()
+        keyWidth = None
+        for index in range(PARTITION_COUNT):
+            partitionPath = self.getPartitionPath(index)
+            if not os.path.exists(partitionPath):
+                continue
+            with SpillGroup(self.fieldNames, self.memoryLimit, self.spillDir, self.level + 1) as partition:
+                with open(partitionPath, 'rb') as partitionFile:
+                    for line in partitionFile:
+                        columns = line.rstrip('\n').split('\t')
+                        if keyWidth is None:
+                            keyWidth = len(columns) - len(self.fieldNames)
+                        partition.addRun(tuple(columns[:keyWidth]), columns[keyWidth:])
+                os.remove(partitionPath)
+                for key, valueDict in partition.iteritems():
+                    yield key, valueDict
+
+    def getValueDict(self, group):
+        """ Returns defaultdict(set) of field name to values for group """
+        valueDict = defaultdict(set)
+        for fieldName, valueSet in zip(self.fieldNames, group):
+            if valueSet:
+                valueDict[fieldName] = valueSet
+        return valueDict
+
+    def close(self):
+        """ Removes run files """
+        if self.spillDir and os.path.isdir(self.spillDir):
+            shutil.rmtree(self.spillDir, ignore_errors=True)
+        self.spillDir = None
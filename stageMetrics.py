@@ -0,0 +1,274 @@
+#!/usr/bin/python
+
+import os
+import sys
+import json
+import time
+import locale
+import resource
+import threading
+
+"""
+##################################################################################################################
+##########################################   Stage Metrics   ###################################################
+##################################################################################################################
+
+* One instrumentation layer for every parser, replacing the scattered time.clock() prints.
+* Parsers wrap each stage (one infile, or one step over several) in 'with stageMetrics.stage(name, inputPaths) as stage:'
+    and report row counts with stage.count(rowsIn=..., rowsOut=..., rowsFiltered=...).
+* Each stage records wall and CPU time (including reaped pool workers), bytes read, rows in, out and filtered,
+    and peak RSS sampled while it runs. A one line summary is printed when the stage ends.
+* Infiles opened with inputReader.openInput() during a stage are watched: a background thread reads their
+    file offsets (no cost in the parsing loops) and prints a progress line with an ETA every PROGRESS_INTERVAL seconds.
+* startRun() / finishRun() in each main write csv_out/runReport.<script>.json, finishRun() from a finally block so
+    a failed run reports the stages it finished and removes its spool file too. Stages finished in forked
+    workers (refactor.py -j, ontologyParser.py -j) are appended to a spool file the report is built from.
+    buildAll.py sets runLabel to the source of each task, concurrent runs of one script then write
+    runReport.<script>.<source>.json each.
+"""
+
+PROGRESS_INTERVAL = 10.0  # seconds between progress lines of one stage
+SAMPLE_INTERVAL = 0.5  # seconds between RSS and offset samples
+
+runLabel = None  # set by buildAll.py, appended to the report name
+runState = dict()  # reportPath, spoolPath, script, startWall, startCpu; inherited by forked workers
+activeStages = list()  # stages running in this process
+monitorState = {'pid': None}  # process the sampling thread runs in
+
+
+def startRun(script, outDir):
+    """ Starts a run report for script (e.g. 'refactor'), written to outDir by finishRun() """
+    runState.clear()
+    reportName = '%s.%s' % (script, runLabel) if runLabel else script
+    runState.update(script=script, reportPath=os.path.join(outDir, 'runReport.%s.json' % reportName),
+                    startWall=time.time(), startCpu=getCpuSeconds(), started=time.strftime('%Y-%m-%dT%H:%M:%S'))
+    runState['spoolPath'] = runState['reportPath'] + '.stages'
+    if os.path.exists(runState['spoolPath']):
+        os.remove(runState['spoolPath'])
+
+
+def finishRun():
+    """ Writes the run report from every stage finished since startRun(), prints run totals """
+    if not runState:
+        return
+    stageList = []
+    if os.path.exists(runState['spoolPath']):
+        with open(runState['spoolPath'], 'r') as spoolFile:
+            stageList = [json.loads(line) for line in spoolFile if line.strip()]
+        os.remove(runState['spoolPath'])
+    wallSeconds = time.time() - runState['startWall']
+    cpuSeconds = getCpuSeconds() - runState['startCpu']
+    report = {'script': runState['script'], 'started': runState['started'], 'wallSeconds': wallSeconds,
+              'cpuSeconds': cpuSeconds, 'peakRssKB': getPeakRssKB(), 'stages': stageList}
+    with open(runState['reportPath'] + '.tmp', 'w') as reportFile:
+        json.dump(report, reportFile, indent=1, sort_keys=True)
+    os.rename(runState['reportPath'] + '.tmp', runState['reportPath'])
+    print "\n%s stages took %s wall, %s CPU, peak RSS %s. Run report: %s\n" % (
+        locale.format('%d', len(stageList), True), formatDuration(wallSeconds), formatDuration(cpuSeconds),
+        formatBytes(getPeakRssKB() * 1024), runState['reportPath'])
+    runState.clear()
+
+
+def stage(name, inputPaths=()):
+    """ Returns Stage context manager for name, reading inputPaths """
+    return Stage(name, inputPaths)
+
+
+def watchInput(inFile, path, process=None):
+    """ Called by inputReader.openInput(): lets the innermost running stage follow progress through inFile """
+    pid = os.getpid()
+    for activeStage in reversed(activeStages):
+        if activeStage.pid == pid:
+            activeStage.watch(inFile, path, process)
+            return
+
+
+def getCpuSeconds():
+    """ User and system CPU seconds of this process and its reaped children """
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+
+def getCurrentRssKB():
+    """ Current RSS in KB from /proc, peak RSS where /proc is not available """
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * (resource.getpagesize() // 1024)
+    except (IOError, ValueError, IndexError):
+        return getPeakRssKB()
+
+
+def getPeakRssKB():
+    """ Peak RSS in KB of this process and its largest reaped child """
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def formatBytes(byteCount):
+    """ Returns byteCount as a short human readable string """
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if byteCount < 1024:
+            return '%.1f %s' % (byteCount, unit)
+        byteCount /= 1024.0
+    return '%.1f TB' % byteCount
+
+
+def formatDuration(seconds):
+    """ Returns seconds as h:mm:ss, or as seconds below a minute """
+    if seconds < 60:
+        return '%.2fs' % seconds
+    minutes, seconds = divmod(int(seconds), 60)
+    return '%d:%02d:%02d' % (minutes // 60, minutes % 60, seconds)
+
+
+def ensureMonitor():
+    """ Starts the sampling thread in this process, once (forked workers start their own) """
+    if monitorState['pid'] == os.getpid():
+        return
+    monitorState['pid'] = os.getpid()
+    thread = threading.Thread(target=monitorStages)
+    thread.daemon = True
+    thread.start()
+
+
+def monitorStages():
+    """ Sampling thread: samples RSS of running stages and prints rate limited progress lines """
+    pid = os.getpid()
+    while True:
+        time.sleep(SAMPLE_INTERVAL)
+        now = time.time()
+        for activeStage in list(activeStages):
+            if activeStage.pid == pid:
+                activeStage.sample(now)
+
+
+def readProcessBytes(process):
+    """ Returns bytes read so far by a decompressing subprocess (Linux /proc), None if unknown """
+    try:
+        with open('/proc/%d/io' % process.pid, 'r') as ioFile:
+            for line in ioFile:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except (IOError, ValueError):
+        return None
+
+
+class Stage(object):
+    """
+    Metrics of one parser stage. Use as a context manager, the summary is printed and recorded on exit.
+    count() adds row counts; rows filtered are the rows read but not written (missing nodes, duplicates).
+    """
+    def __init__(self, name, inputPaths=()):
+        self.name = name
+        self.inputPaths = [path for path in inputPaths if path]
+        self.watchList = []
+        self.rowsIn = None
+        self.rowsOut = None
+        self.rowsFiltered = None
+        self.pid = None
+
+    def __enter__(self):
+        self.pid = os.getpid()
+        self.startWall = time.time()
+        self.startCpu = getCpuSeconds()
+        self.peakRssKB = getCurrentRssKB()
+        self.lastProgress = self.startWall
+        activeStages.append(self)
+        ensureMonitor()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        activeStages.remove(self)
+        self.wallSeconds = time.time() - self.startWall
+        self.cpuSeconds = getCpuSeconds() - self.startCpu
+        self.peakRssKB = max(self.peakRssKB, getCurrentRssKB())
+        record = self.toDict()
+        if excType is not None:
+            record['error'] = '%s: %s' % (excType.__name__, excValue)
+        else:
+            print self.getSummary()
+        if runState.get('spoolPath'):
+            spoolFD = os.open(runState['spoolPath'], os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+            try:
+                os.write(spoolFD, json.dumps(record, sort_keys=True) + '\n')
+            finally:
+                os.close(spoolFD)
+
+    def count(self, rowsIn=None, rowsOut=None, rowsFiltered=None):
+        """ Adds row counts to this stage """
+        if rowsIn is not None:
+            self.rowsIn = (self.rowsIn or 0) + rowsIn
+        if rowsOut is not None:
+            self.rowsOut = (self.rowsOut or 0) + rowsOut
+        if rowsFiltered is not None:
+            self.rowsFiltered = (self.rowsFiltered or 0) + rowsFiltered
+
+    def watch(self, inFile, path, process=None):
+        """ Follows progress through inFile; process is the decompressor of a .gz infile """
+        if path not in self.inputPaths:
+            self.inputPaths.append(path)
+        self.watchList.append((inFile, path, process))
+
+    def getBytesTotal(self):
+        """ Total size of this stage's infiles (compressed size for .gz) """
+        return sum(os.path.getsize(path) for path in set(self.inputPaths) if os.path.isfile(path))
+
+    def getBytesRead(self):
+        """ Bytes of the infiles consumed so far, from file offsets of watched infiles """
+        if not self.watchList:
+            return None
+        bytesRead = 0
+        for inFile, path, process in self.watchList:
+            size = os.path.getsize(path) if os.path.isfile(path) else 0
+            if inFile.closed:
+                bytesRead += size
+            elif process:
+                bytesRead += min(readProcessBytes(process) or 0, size)
+            else:
+                try:
+                    bytesRead += os.lseek(inFile.fileno(), 0, os.SEEK_CUR)
+                except (OSError, ValueError, AttributeError):
+                    pass
+        return bytesRead
+
+    def sample(self, now):
+        """ Updates peak RSS, prints a progress line once PROGRESS_INTERVAL passed since the last one """
+        self.peakRssKB = max(self.peakRssKB, getCurrentRssKB())
+        if now - self.lastProgress < PROGRESS_INTERVAL:
+            return
+        self.lastProgress = now
+        elapsed = now - self.startWall
+        bytesRead = self.getBytesRead()
+        bytesTotal = self.getBytesTotal()
+        if bytesRead and bytesTotal:
+            rate = bytesRead / elapsed
+            eta = formatDuration((bytesTotal - bytesRead) / rate) if rate else '?'
+            line = "\t[%s] %.1f%% of %s, %s/s, ETA %s\n" % (self.name, 100.0 * bytesRead / bytesTotal, formatBytes(bytesTotal),
+                                                            formatBytes(rate), eta)
+        else:
+            line = "\t[%s] running for %s, RSS %s\n" % (self.name, formatDuration(elapsed), formatBytes(self.peakRssKB * 1024))
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+    def toDict(self):
+        """ Returns run report record of this stage """
+        bytesTotal = self.getBytesTotal()
+        bytesRead = self.getBytesRead()
+        return {'name': self.name, 'pid': self.pid, 'startOffset': self.startWall - runState.get('startWall', self.startWall),
+                'wallSeconds': self.wallSeconds, 'cpuSeconds': self.cpuSeconds, 'bytesTotal': bytesTotal,
+                'bytesRead': bytesTotal if bytesRead is None else bytesRead,
+                'bytesPerSecond': bytesTotal / self.wallSeconds if self.wallSeconds else None,
+                'rowsIn': self.rowsIn, 'rowsOut': self.rowsOut, 'rowsFiltered': self.rowsFiltered,
+                'rowsPerSecond': (self.rowsIn or self.rowsOut or 0) / self.wallSeconds if self.wallSeconds else None,
+                'peakRssKB': self.peakRssKB}
+
+    def getSummary(self):
+        """ Returns one line summary of the finished stage """
+        partList = ['%s wall' % formatDuration(self.wallSeconds), '%s CPU' % formatDuration(self.cpuSeconds)]
+        for label, rowCount in [('rows in', self.rowsIn), ('rows out', self.rowsOut), ('filtered', self.rowsFiltered)]:
+            if rowCount is not None:
+                partList.append('%s %s' % (locale.format('%d', rowCount, True), label))
+        bytesTotal = self.getBytesTotal()
+        if bytesTotal and self.wallSeconds:
+            partList.append('%s at %s/s' % (formatBytes(bytesTotal), formatBytes(bytesTotal / self.wallSeconds)))
+        partList.append('peak RSS %s' % formatBytes(self.peakRssKB * 1024))
+        return "\t[%s] %s" % (self.name, ', '.join(partList))
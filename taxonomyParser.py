@@ -4,8 +4,14 @@ import sys
 import os
 import getopt
 import locale
-import time
+from array import array
+from itertools import groupby
 from collections import defaultdict
+import buildManifest
+import batchWriter
+import inputReader
+import stageMetrics
+import nodeIndex
 
 
 """
@@ -19,6 +25,10 @@ Written by: Brandon Burciaga
 * Outfiles are .csv (pipe delimited) and generated with first line header demonstrating
     the format of the rest of the file (in columns)
 * See howToRun() method for instructions using this script.
+    NCBI Taxonomy is skipped when its files are unchanged since the last build, add -f to rebuild it.
+    Add -z to write gzip compressed outfiles (.csv.gz).
+    Add -m to stream nodes.dmp and names.dmp as a merge-join, memory bounded by the citations index.
+    Tax IDs are published to csv_out/nodeIndex.sqlite, where NCBI Entrez Gene gene_group checks its taxa.
 * Infile(s) [NCBI Taxonomy files in .dmp format, 2015 versions used]:
     * nodes.dmp, ftp://ftp.ncbi.nlm.nih.gov/pub/taxonomy/
     * names.dmp, ftp://ftp.ncbi.nlm.nih.gov/pub/taxonomy/
@@ -52,41 +62,135 @@ class TaxNamesParser(object):
         return synonymSet
 
 
+class TaxonomyStore(object):
+    """
+    Columnar NCBI Taxonomy store indexed by integer tax ID, replaces a nested dict per taxon.
+    parents holds parent tax ID (-1 where the tax ID is not in nodes.dmp), ranks holds interned rank codes.
+    Term, preferred term, synonyms and medline IDs are (offset, length) pairs into one shared string pool.
+    """
+    stringFields = ('term', 'preferredTerm', 'synonyms', 'medlineID')
+
+    def __init__(self):
+        self.parents = array('i')
+        self.ranks = array('B')
+        self.rankList = list()
+        self.rankCodes = dict()
+        self.pool = bytearray()
+        self.offsets = dict((field, array('i')) for field in self.stringFields)
+        self.lengths = dict((field, array('i')) for field in self.stringFields)
+
+    def __contains__(self, taxID):
+        return 0 <= taxID < len(self.parents) and self.parents[taxID] != -1
+
+    def grow(self, taxID):
+        """ Extends every column so taxID can be indexed """
+        extra = taxID + 1 - len(self.parents)
+        if extra > 0:
+            extra = max(extra, len(self.parents) // 2)
+            self.parents.extend([-1] * extra)
+            self.ranks.extend([0] * extra)
+            for field in self.stringFields:
+                self.offsets[field].extend([0] * extra)
+                self.lengths[field].extend([0] * extra)
+
+    def setNode(self, taxID, parentTaxID, rank):
+        """ Adds taxon from nodes.dmp """
+        self.grow(taxID)
+        self.parents[taxID] = parentTaxID
+        if rank not in self.rankCodes:
+            self.rankCodes[rank] = len(self.rankList)
+            self.rankList.append(rank)
+        self.ranks[taxID] = self.rankCodes[rank]
+
+    def setString(self, taxID, field, value):
+        """ Appends value to string pool and points field of taxID at it """
+        self.offsets[field][taxID] = len(self.pool)
+        self.lengths[field][taxID] = len(value)
+        self.pool.extend(value)
+
+    def getString(self, taxID, field):
+        """ Returns field of taxID, '' if never set """
+        offset = self.offsets[field][taxID]
+        return str(self.pool[offset:offset + self.lengths[field][taxID]])
+
+    def getRank(self, taxID):
+        """ Returns rank name of taxID """
+        return self.rankList[self.ranks[taxID]]
+
+    def iterTaxIDs(self):
+        """ Yields tax IDs from nodes.dmp in ascending order """
+        parents = self.parents
+        for taxID in xrange(len(parents)):
+            if parents[taxID] != -1:
+                yield taxID
+
+
 def parseNodes(taxFilePath):
-    """ parses nodes.dmp and adds 'parentTaxID' and 'rank' properties to taxMap """
-    taxMap = defaultdict(lambda: defaultdict(set))
-    with open(taxFilePath, 'rU') as stream:
+    """ parses nodes.dmp and returns TaxonomyStore holding parent tax ID and rank of every taxon """
+    taxStore = TaxonomyStore()
+    with inputReader.openInput(taxFilePath, 'rU') as stream:
         for line in stream:
             columns = line.split("|")
-            node = 'NCBI_TAXONOMY:' + columns[0].strip()
-            taxMap[node]['parentTaxID'] = 'NCBI_TAXONOMY:' + columns[1].strip()
-            taxMap[node]['rank'] = columns[2].strip()
-    return taxMap
+            taxStore.setNode(int(columns[0]), int(columns[1]), columns[2].strip())
+    return taxStore
 
 
-def parseNames(namesFilePath, taxMap):
+def parseNames(namesFilePath, taxStore):
     """
-    Parses names.dmp and adds 'term', 'synonyms' and 'preferredTerm' properties to taxMap.
+    Parses names.dmp and sets 'term', 'synonyms' and 'preferredTerm' strings in taxStore.
     Synonyms come from typeclass atributes of synonym, equivalent name, common name, misspelling and acronym
+    Names are grouped by tax ID, so synonyms are collected for one taxon at a time.
     """
-    with open(namesFilePath, 'rU') as stream:
-        synonymDict = defaultdict(set)
+    with inputReader.openInput(namesFilePath, 'rU') as stream:
+        synonymTaxID = None
+        synonymList = list()
         for line in stream:
             columns = line.strip().split("|")
+            taxID = int(columns[0])
+            if taxID not in taxStore:
+                continue
+            if taxID != synonymTaxID:
+                addSynonyms(taxStore, synonymTaxID, synonymList)
+                synonymTaxID = taxID
+                synonymList = list()
             nameObj = TaxNamesParser(columns)
             if nameObj.typeclass in ['synonym', 'equivalent name', 'common name', 'acronym', 'misspelling']:
-                synonymDict[nameObj.node].add(nameObj.term)
+                synonymList.append(nameObj.term)
             elif nameObj.typeclass == 'scientific name':
-                taxMap[nameObj.node]['term'] = nameObj.term
-                taxMap[nameObj.node]['preferredTerm'] = nameObj.getPreferred()
-        for node, synonyms in synonymDict.iteritems():
-            taxMap[node]["synonyms"] = '; '.join(synonyms)
-    return taxMap
-
-
-def parseCitations(citationsFilePath, taxMap):
-    """ Gets medline IDs for each taxID and adds medlineID item to taxMap """
-    with open(citationsFilePath, 'ru') as stream:
+                taxStore.setString(taxID, 'term', nameObj.term)
+                taxStore.setString(taxID, 'preferredTerm', nameObj.getPreferred())
+        addSynonyms(taxStore, synonymTaxID, synonymList)
+    return taxStore
+
+
+def addSynonyms(taxStore, taxID, synonymList):
+    """ Sets unique synonyms of taxID, joined by '; ', keeping any set earlier for the same taxon """
+    if taxID is None or not synonymList:
+        return
+    earlier = taxStore.getString(taxID, 'synonyms')
+    if earlier:
+        synonymList = earlier.split('; ') + synonymList
+    uniqueList = list()
+    seen = set()
+    for synonym in synonymList:
+        if synonym not in seen:
+            seen.add(synonym)
+            uniqueList.append(synonym)
+    taxStore.setString(taxID, 'synonyms', '; '.join(uniqueList))
+
+
+def parseCitations(citationsFilePath, taxStore):
+    """ Gets medline IDs for each taxID and sets 'medlineID' string in taxStore """
+    for taxID, medlineIDs in parseCitationIndex(citationsFilePath).iteritems():
+        if taxID in taxStore:
+            taxStore.setString(taxID, 'medlineID', "; ".join(medlineIDs))
+    return taxStore
+
+
+def parseCitationIndex(citationsFilePath):
+    """ Returns defaultdict of integer taxID to set of medline IDs citing it """
+    medlineDict = defaultdict(set)
+    with inputReader.openInput(citationsFilePath, 'rU') as stream:
         for line in stream:
             columns = line.strip().split("|")
             medlineID = columns[3].strip()
@@ -94,38 +198,100 @@ def parseCitations(citationsFilePath, taxMap):
             if not medlineID == "0":
                 if nodeList[0] != '':
                     for node in nodeList:
-                        nodeID = ("NCBI_TAXONOMY:" + node)
-                        taxMap[nodeID]["medlineID"].add(medlineID)
-    return taxMap
+                        medlineDict[int(node)].add(medlineID)
+    return medlineDict
 
 
-def writeTaxData(taxMap, taxNodeOutFile, taxRelnOutFile):
+def writeTaxData(taxStore, taxNodeOutFile, taxRelnOutFile, publisher=None):
     """
-    Writes taxonomy nodes and relationships to outfiles.
+    Writes taxonomy nodes and relationships to outfiles in one pass over taxStore, in tax ID order.
     Outfiles: topDir/csv_out/taxNodeOutFile.csv, topDir/csv_out/taxRelnOutFile.csv
+    Node IDs are added to publisher (nodeIndex.Publisher) if given. Returns number of taxa written.
     """
     count = 0
-    relnCount = 0
     print "\nCreating and writing NCBI Taxonomy nodes and relationships..."
-    for taxID, properties in taxMap.iteritems():
-        relnCount += 2
+    for taxID in taxStore.iterTaxIDs():
         count += 1
-        if "synonyms" not in properties:
-            properties['synonyms'] = ''
-        if 'medlineID' not in properties:
-            properties['medlineID'] = ''
-        node = ('%s|NCBI_Taxonomy|%s|%s|%s|%s|%s|Plant\n' %
-                (taxID, properties["term"], properties["preferredTerm"],
-                 properties["rank"], properties["synonyms"],
-                 "; ".join(properties["medlineID"])))
-        node = clean(node)
-        taxNodeOutFile.write(node)
-        reln = clean('%s|NCBI_Taxonomy|%s|is_a\n' % (taxID, properties["parentTaxID"]))
-        reln2 = clean('%s|NCBI_Taxonomy|%s|contains\n' % (properties["parentTaxID"], taxID))
-        taxRelnOutFile.write(reln)
-        taxRelnOutFile.write(reln2)
+        if publisher is not None:
+            publisher.add('NCBI_TAXONOMY:%d' % taxID)
+        writeTaxon(taxNodeOutFile, taxRelnOutFile, taxID, taxStore.parents[taxID], taxStore.getRank(taxID),
+                   taxStore.getString(taxID, 'term'), taxStore.getString(taxID, 'preferredTerm'),
+                   taxStore.getString(taxID, 'synonyms'), taxStore.getString(taxID, 'medlineID'))
     print "\n\t%s NCBI Taxonomy nodes have been created.\n" % locale.format('%d', count, True)
-    print "\t%s NCBI Taxonomy relationships have been created.\n" % locale.format('%d', relnCount, True)
+    print "\t%s NCBI Taxonomy relationships have been created.\n" % locale.format('%d', count * 2, True)
+    return count
+
+
+def writeTaxon(taxNodeOutFile, taxRelnOutFile, taxID, parentTaxID, rank, term, preferredTerm, synonyms, medlineID):
+    """ Writes node and is_a/contains relationships of one taxon """
+    node = ('NCBI_TAXONOMY:%d|NCBI_Taxonomy|%s|%s|%s|%s|%s|Plant\n' %
+            (taxID, term, preferredTerm, rank, synonyms, medlineID))
+    node = clean(node)
+    taxNodeOutFile.write(node)
+    reln = 'NCBI_TAXONOMY:%d|NCBI_Taxonomy|NCBI_TAXONOMY:%d|is_a\n' % (taxID, parentTaxID)
+    reln2 = 'NCBI_TAXONOMY:%d|NCBI_Taxonomy|NCBI_TAXONOMY:%d|contains\n' % (parentTaxID, taxID)
+    taxRelnOutFile.write(reln)
+    taxRelnOutFile.write(reln2)
+
+
+def mergeTaxData(taxFilePath, namesFilePath, citationsFilePath, taxNodeOutFile, taxRelnOutFile, publisher=None):
+    """
+    Merge-join alternative to parseNodes(), parseNames() and writeTaxData().
+    Walks nodes.dmp and names.dmp, both ordered by tax_id, in lockstep and writes each taxon as soon as
+    its names are read. Only the citations index is held in memory. Node IDs are added to publisher if given.
+    Returns number of taxa written, raises ValueError if either file is out of tax_id order.
+    """
+    count = 0
+    medlineDict = parseCitationIndex(citationsFilePath)
+    print "\nMerging nodes and names, writing NCBI Taxonomy nodes and relationships..."
+    with inputReader.openInput(taxFilePath, 'rU') as nodeStream, inputReader.openInput(namesFilePath, 'rU') as nameStream:
+        nameGroups = iterNameGroups(nameStream)
+        nameTaxID, names = next(nameGroups, (None, None))
+        lastTaxID = -1
+        for line in nodeStream:
+            columns = line.split("|")
+            taxID = int(columns[0])
+            if taxID <= lastTaxID:
+                raise ValueError("%s is not sorted by tax_id at %d" % (taxFilePath, taxID))
+            lastTaxID = taxID
+            while nameTaxID is not None and nameTaxID < taxID:
+                nameTaxID, names = next(nameGroups, (None, None))  # names without a node are dropped
+            term, preferredTerm, synonyms = names if nameTaxID == taxID else ('', '', '')
+            medlineID = "; ".join(medlineDict.get(taxID, ()))
+            writeTaxon(taxNodeOutFile, taxRelnOutFile, taxID, int(columns[1]), columns[2].strip(),
+                       term, preferredTerm, synonyms, medlineID)
+            if publisher is not None:
+                publisher.add('NCBI_TAXONOMY:%d' % taxID)
+            count += 1
+    print "\n\t%s NCBI Taxonomy nodes have been created.\n" % locale.format('%d', count, True)
+    print "\t%s NCBI Taxonomy relationships have been created.\n" % locale.format('%d', count * 2, True)
+    return count
+
+
+def iterNameGroups(nameStream):
+    """
+    Yields (taxID, (term, preferredTerm, synonyms)) for each run of names.dmp lines sharing a tax_id.
+    Raises ValueError if tax_id decreases.
+    """
+    lastTaxID = -1
+    for taxID, lineGroup in groupby(nameStream, key=lambda line: int(line.split("|", 1)[0])):
+        if taxID <= lastTaxID:
+            raise ValueError("%s is not sorted by tax_id at %d" % (nameStream.name, taxID))
+        lastTaxID = taxID
+        term = ''
+        preferredTerm = ''
+        synonymList = list()
+        for line in lineGroup:
+            columns = line.split("|")
+            typeclass = columns[3].strip()
+            if typeclass in ['synonym', 'equivalent name', 'common name', 'acronym', 'misspelling']:
+                synonym = columns[1].strip()
+                if synonym not in synonymList:
+                    synonymList.append(synonym)
+            elif typeclass == 'scientific name':
+                term = columns[1].strip()
+                preferredTerm = columns[2].strip() or term
+        yield taxID, (term, preferredTerm, '; '.join(synonymList))
 
 
 ##################################################################################################################
@@ -147,6 +313,12 @@ def clean(string):
     return cleaned
 
 
+def writeTaxHeaders(taxNodeOutFile, taxRelnOutFile):
+    """ Writes header lines of node and relationship outfiles """
+    taxNodeOutFile.write("Source_ID:ID|Source|Term|Preferred_Term|Rank|Synonyms:string[]|Medline_ID|:LABEL\n")
+    taxRelnOutFile.write(":START_ID|Source|:END_ID|:TYPE\n")
+
+
 def howToRun():
     """
     Instructs users how to use script.
@@ -157,60 +329,103 @@ def howToRun():
     print "\n\t\t * Top directory structure: \n\t\t\t * /Users/username/KnowledgeBase/<subdir>/<files>"
     print "\t\t\t\t * <subdir> : NCBITaxonomy/"
     print "\t\t\t\t * <subfiles> : *.dmp\n"
+    print "\n\t\t * Add -m to merge-join nodes.dmp and names.dmp in tax_id order instead of loading the whole taxonomy\n"
     sys.exit()
 
 
 def main(argv):
     """ If run as main script, function executes with user input """
     topDir = ""
+    mergeJoin = False
+    force = False
     try:
-        opts, args = getopt.getopt(argv, "hp:", ["help", "dirPath="])
+        opts, args = getopt.getopt(argv, "hp:mfz", ["help", "dirPath=", "merge", "force", "gzip"])
         if len(argv) == 0:
             howToRun()
     except getopt.GetoptError:
         howToRun()
+    for opt, arg in opts:
+        if opt in ['-m', '--merge']:
+            mergeJoin = True
+        elif opt in ['-f', '--force']:
+            force = True
+        elif opt in ['-z', '--gzip']:
+            batchWriter.compressOutputs = True
     for opt, arg in opts:
         if opt in ['-h', '--help']:
             howToRun()
         elif opt in ("-p", "--dirPath"):
             if not arg.endswith("/"):
                 arg = arg + "/"
-            startTime = time.clock()
             topDir = arg
             locale.setlocale(locale.LC_ALL, "")
             outPath = createOutDirectory(topDir)
 
-            taxNodeOutFile = open((outPath + 'taxNodeOut.csv'), 'w')
-            taxRelnOutFile = open((outPath + 'taxRelnOut.csv'), 'w')
-            taxNodeOutFile.write("Source_ID:ID|Source|Term|Preferred_Term|Rank|Synonyms:string[]|Medline_ID|:LABEL\n")
-            taxRelnOutFile.write(":START_ID|Source|:END_ID|:TYPE\n")
-
-            taxRoot = topDir + "NCBITaxonomy/"
-            print "\n\n=====================================  PARSING NCBI Taxonomy ====================================="
-            print "\nProcessing files in:\n\n%s\n" % taxRoot
-            print "\nFiles processed: "
-
-            for root, dirs, files in os.walk(topDir):
-                if root.endswith("NCBITaxonomy"):
-                    for taxFile in files:
-                        taxFilePath = os.path.join(root, taxFile)
-                        if taxFilePath.endswith("nodes.dmp"):
-                            print "\n%s " % taxFilePath
-                            taxMap = parseNodes(taxFilePath)
-
-                            namesFilePath = os.path.join(root, "names.dmp")
-                            print "\n%s " % namesFilePath
-                            taxMap.update(parseNames(namesFilePath, taxMap))
-
-                            citationsFilePath = os.path.join(root, "citations.dmp")
-                            print "\n%s\n " % citationsFilePath
-                            taxMap.update(parseCitations(citationsFilePath, taxMap))
-
-                    writeTaxData(taxMap, taxNodeOutFile, taxRelnOutFile)
-
-            endTime = time.clock()
-            duration = endTime - startTime
-            print "It took %s seconds to create all NCBI Taxonomy nodes and relationships\n" % duration
+            manifest = buildManifest.BuildManifest(outPath, force)
+            taxInputs = buildManifest.listInputs(topDir + "NCBITaxonomy") if os.path.isdir(topDir + "NCBITaxonomy") else []
+            taxVersion = buildManifest.getParserVersion(__file__, nodeIndex.__file__, batchWriter.__file__, inputReader.__file__)
+            taxOutPaths = [batchWriter.getOutputPath(outPath + name) for name in ['taxNodeOut.csv', 'taxRelnOut.csv']]
+            if manifest.isCurrent('taxonomyParser.py:NCBITaxonomy', taxInputs, taxVersion):
+                print "\nNCBI Taxonomy is up to date, skipping"
+                continue
+            stageMetrics.startRun('taxonomyParser', outPath)
+            try:
+                nodeIndex.enable(outPath)
+                publisher = nodeIndex.publish('taxonomyParser.py:NCBITaxonomy')
+
+                taxNodeOutFile = batchWriter.openOutput(outPath + 'taxNodeOut.csv')
+                taxRelnOutFile = batchWriter.openOutput(outPath + 'taxRelnOut.csv')
+                writeTaxHeaders(taxNodeOutFile, taxRelnOutFile)
+
+                taxRoot = topDir + "NCBITaxonomy/"
+                print "\n\n=====================================  PARSING NCBI Taxonomy ====================================="
+                print "\nProcessing files in:\n\n%s\n" % taxRoot
+                print "\nFiles processed: "
+
+                for root, dirs, files in os.walk(topDir):
+                    if root.endswith("NCBITaxonomy"):
+                        for taxFile in files:
+                            taxFilePath = os.path.join(root, taxFile)
+                            if inputReader.stripCompression(taxFilePath).endswith("nodes.dmp"):
+                                namesFilePath = inputReader.resolveInput(os.path.join(root, "names.dmp"))
+                                citationsFilePath = inputReader.resolveInput(os.path.join(root, "citations.dmp"))
+                                if mergeJoin:
+                                    print "\n%s \n\n%s \n\n%s\n " % (taxFilePath, namesFilePath, citationsFilePath)
+                                    try:
+                                        with stageMetrics.stage('nodes.dmp merge', [taxFilePath, namesFilePath, citationsFilePath]) as stage:
+                                            count = mergeTaxData(taxFilePath, namesFilePath, citationsFilePath, taxNodeOutFile,
+                                                                 taxRelnOutFile, publisher)
+                                            stage.count(rowsOut=count * 3)
+                                        continue
+                                    except ValueError as error:
+                                        print "\n%s, falling back to loading the whole taxonomy\n" % error
+                                        for outFile in (taxNodeOutFile, taxRelnOutFile):
+                                            outFile.truncate()
+                                        writeTaxHeaders(taxNodeOutFile, taxRelnOutFile)
+
+                                print "\n%s " % taxFilePath
+                                with stageMetrics.stage('nodes.dmp', [taxFilePath]):
+                                    taxStore = parseNodes(taxFilePath)
+
+                                print "\n%s " % namesFilePath
+                                with stageMetrics.stage('names.dmp', [namesFilePath]):
+                                    parseNames(namesFilePath, taxStore)
+
+                                print "\n%s\n " % citationsFilePath
+                                with stageMetrics.stage('citations.dmp', [citationsFilePath]):
+                                    parseCitations(citationsFilePath, taxStore)
+
+                                with stageMetrics.stage('taxonomy write') as stage:
+                                    count = writeTaxData(taxStore, taxNodeOutFile, taxRelnOutFile, publisher)
+                                    stage.count(rowsOut=count * 3)
+
+                taxNodeOutFile.close()
+                taxRelnOutFile.close()
+                publisher.close()
+                manifest.record('taxonomyParser.py:NCBITaxonomy', taxInputs, taxVersion, taxOutPaths)
+            finally:
+                stageMetrics.finishRun()
+                nodeIndex.close()
 
 if __name__ == "__main__":
     main(sys.argv[1:])
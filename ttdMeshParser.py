@@ -3,27 +3,54 @@
 import sys
 import os
 import getopt
-import time
 import locale
 import ttdParser
 import meshParser
 import general
+import chunkedIngest
+import buildManifest
+import batchWriter
+import inputReader
+import stageMetrics
+import parseCache
+import nodeIndex
 
 """
 Need to write more here for docs. This script parses TTD and MeSH by importing meshParser.py
 and ttdParser.py, and uses general methods from general.py
+Add -j N to parse each MeSH .bin file with N worker processes
+TTD and MeSH are skipped when their files are unchanged since the last build, add -f to rebuild them
+Add -z to write gzip compressed outfiles (.csv.gz)
+Parsed records are kept in csv_out/parseCache/, so reruns after writer changes do not reparse the infiles
+Node IDs are published to csv_out/nodeIndex.sqlite for relationship checks of other parsers
+Add -s TTD or -s MeSH to parse only that source (buildAll.py runs them as separate tasks)
 """
 
+TTD_OUTFILES = ['ttdNodeOut.csv', 'ttdNodeOut2.csv', 'KEGGNodeOut.csv', 'targetKEGGRelnOut.csv',
+                'wikiNodeOut.csv', 'targetWikiRelnOut.csv']
+
 
 def main(argv):
     """ If run as main script, function executes with user input """
     topDir = ""
+    workerCount = 1
+    force = False
+    sourceFilter = None
     try:
-        opts, args = getopt.getopt(argv, 'hp:', ['help', 'dirPath='])
+        opts, args = getopt.getopt(argv, 'hp:j:s:fz', ['help', 'dirPath=', 'jobs=', 'source=', 'force', 'gzip'])
         if len(argv) == 0:
             general.howToRun()
     except getopt.GetoptError:
         general.howToRun()
+    for opt, arg in opts:
+        if opt in ['-j', '--jobs']:
+            workerCount = int(arg)
+        elif opt in ['-s', '--source']:
+            sourceFilter = arg.strip().split(',')
+        elif opt in ['-f', '--force']:
+            force = True
+        elif opt in ['-z', '--gzip']:
+            batchWriter.compressOutputs = True
     for opt, arg in opts:
         if opt in ['-h', '--help']:
             general.howToRun()
@@ -34,92 +61,125 @@ def main(argv):
             locale.setlocale(locale.LC_ALL, "")
             outPath = general.createOutDirectory(topDir)
 
-            """ Therapeutic Target Database (TTD) """
-            ttdNodeOutFile = open((outPath + 'ttdNodeOut.csv'), 'w')
-            targetDiseaseNodeOutFile = open((outPath + 'ttdNodeOut2.csv'), 'w')
-            KEGGNodeOutFile = open((outPath + 'KEGGNodeOut.csv'), 'w')
-            KEGGRelnOutFile = open((outPath + 'targetKEGGRelnOut.csv'), 'w')
-            wikiNodeOutFile = open((outPath + 'wikiNodeOut.csv'), 'w')
-            wikiRelnOutFile = open((outPath + 'targetWikiRelnOut.csv'), 'w')
-            ttdNodeOutFile.write("Source_ID:ID|Name|Source|Function|Diseases|Synonyms:string[]|KEGG_Pathway|Wiki_Pathway|:LABEL\n")
-            targetDiseaseNodeOutFile.write("Source_ID:ID|Name|Source|Diseases:String[]|:LABEL\n")
-            KEGGNodeOutFile.write("Source_ID:ID|Name|Source|:LABEL\n")
-            KEGGRelnOutFile.write(":START_ID|Source|:END_ID|:TYPE\n")
-            wikiNodeOutFile.write("Source_ID:ID|Name|Source|:LABEL\n")
-            wikiRelnOutFile.write(":START_ID|Source|:END_ID|:TYPE\n")
-
-            """ Medical Subject Headings Database (MeSH) """
-            meshNodeOutFile = open((outPath + 'meshNodeOut.csv'), 'w')
-            meshRelnOutFile = open((outPath + 'meshRelnOut.csv'), 'w')
-            meshNodeOutFile.write("Source_id:ID|Source|Term|Synonyms:string[]|Semantic_Type:string[]|Mesh_TreeNumber|:LABEL\n")
-            meshRelnOutFile.write(":START_ID|source|:END_ID|Category|:TYPE\n")
-
             totalMeshNodeSet = set()
-
-            sourceList = os.listdir(topDir)[::-1]
-
-            for source in sourceList:
-                sourcePath = os.path.join(topDir + source)
-                fileList = os.listdir(sourcePath)
-
-                """ Therapeutic Target Database """
-                if sourcePath.endswith('TTD'):
-                    startTime = time.clock()
-                    print "\n\n\n================================ PARSING THERAPEUTIC TARGET DATABASE (TTD) ==================================="
-                    print "\nProcessing files in:\n\t%s\n" % sourcePath
-                    for ttdFile in fileList:
-                        ttdFilePath = os.path.join(sourcePath, ttdFile)
-                        if ttdFilePath.endswith("TTD_download_raw.txt"):
-                            print ttdFilePath
-                            nodeDict, nodeSet = ttdParser.parseTTDNodes(ttdFilePath)
-                            nodeCount = ttdParser.writeTTDNodes(nodeDict, ttdNodeOutFile)
-
-                            tempPath = sourcePath + "/target-disease_TTD2016.txt"
-                            print tempPath
-                            targetDict = ttdParser.parseTargetDisease(tempPath, nodeSet)
-                            nodeCount2 = ttdParser.writeTargetDiseaseNodes(targetDict, targetDiseaseNodeOutFile)
-                        elif ttdFilePath.endswith("Target-KEGGpathway_all.txt"):
-                            print ttdFilePath
-                            KEGGRelnCount = ttdParser.parseTargetKEGG(ttdFilePath, KEGGNodeOutFile, KEGGRelnOutFile)
-                        elif ttdFilePath.endswith("Target-wikipathway_all.txt"):
-                            print ttdFilePath
-                            wikiRelnCount = ttdParser.parseTargetWiki(ttdFilePath, wikiNodeOutFile, wikiRelnOutFile)
-
-                    endTime = time.clock()
-                    duration = endTime - startTime
-                    print ("\n%s total Therapeutic Target Database nodes have been created." %
-                           (locale.format('%d', (nodeCount + nodeCount2), True)))
-                    print ("\n%s total Therapeutic Target Database relationships have been created." %
-                           (locale.format('%d', (KEGGRelnCount + wikiRelnCount), True)))
-                    print "\nIt took %s seconds to create all TTD nodes and relationships\n" % duration
-
-                """ Medical Subject Headings Database (MeSH) """
-                if sourcePath.endswith('MeSH'):
-                    startTime = time.clock()
-                    print "\n\n\n================================ PARSING NLM MEDICAL SUBJECT HEADINGS (MeSH) DATABASE ================================"
-                    print "\nProcessing files in:\n\t%s\n" % sourcePath
-                    finalCount = 0
-                    bigRelnDict = dict()
-                    sortedFiles = sorted(fileList, key=len)
-                    for meshFile in sortedFiles:
-                        meshFilePath = os.path.join(sourcePath, meshFile)
-                        print "%s" % meshFilePath
-                        if not meshFilePath.endswith('mtrees2016.bin'):
-                            treeRelnDict, fileNodeSet = meshParser.meshData(meshFilePath, meshNodeOutFile)
-                            totalMeshNodeSet.update(fileNodeSet)
-                            bigRelnDict.update(treeRelnDict)
-                            finalCount += len(fileNodeSet)
-                            print 'len(fileNodeSet): ', len(fileNodeSet)
-                            print "\t%s nodes have been created from this file\n" % locale.format('%d', len(fileNodeSet), True)
-                        else:
-                            relnCount = meshParser.parseTree(meshFilePath, bigRelnDict, meshRelnOutFile)
-                            print "\t%s relationships have been created from this file\n" % locale.format('%d', relnCount, True)
-
-                    endTime = time.clock()
-                    duration = endTime - startTime
-                    print ("\n%s total NLM MeSH nodes and %s total relationships have been created..." %
-                           (locale.format('%d', finalCount, True), locale.format('%d', relnCount, True)))
-                    print "\nIt took %s seconds to create all NLM MeSH nodes and relationships \n" % duration
+            manifest = buildManifest.BuildManifest(outPath, force)
+            stageMetrics.startRun('ttdMeshParser', outPath)
+            try:
+                parseCache.enable(outPath, manifest)
+                nodeIndex.enable(outPath)
+
+                sourceList = os.listdir(topDir)[::-1]
+
+                for source in sourceList:
+                    if sourceFilter and source not in sourceFilter:
+                        continue
+                    sourcePath = os.path.join(topDir + source)
+                    fileList = os.listdir(sourcePath)
+
+                    """ Therapeutic Target Database """
+                    if sourcePath.endswith('TTD'):
+                        ttdVersion = buildManifest.getParserVersion(__file__, ttdParser.__file__, general.__file__, parseCache.__file__,
+                                                                   nodeIndex.__file__, batchWriter.__file__, inputReader.__file__)
+                        ttdOutPaths = [batchWriter.getOutputPath(outPath + name) for name in TTD_OUTFILES]
+                        if manifest.isCurrent('ttdMeshParser.py:TTD', buildManifest.listInputs(sourcePath), ttdVersion):
+                            print "\nTTD is up to date, skipping"
+                            continue
+                        ttdNodeOutFile, targetDiseaseNodeOutFile, KEGGNodeOutFile, KEGGRelnOutFile, wikiNodeOutFile, wikiRelnOutFile = \
+                            [batchWriter.openOutput(ttdOutPath) for ttdOutPath in ttdOutPaths]
+                        ttdNodeOutFile.write("Source_ID:ID|Name|Source|Function|Diseases|Synonyms:string[]|KEGG_Pathway|Wiki_Pathway|:LABEL\n")
+                        targetDiseaseNodeOutFile.write("Source_ID:ID|Name|Source|Diseases:String[]|:LABEL\n")
+                        KEGGNodeOutFile.write("Source_ID:ID|Name|Source|:LABEL\n")
+                        KEGGRelnOutFile.write(":START_ID|Source|:END_ID|:TYPE\n")
+                        wikiNodeOutFile.write("Source_ID:ID|Name|Source|:LABEL\n")
+                        wikiRelnOutFile.write(":START_ID|Source|:END_ID|:TYPE\n")
+                        print "\n\n\n================================ PARSING THERAPEUTIC TARGET DATABASE (TTD) ==================================="
+                        print "\nProcessing files in:\n\t%s\n" % sourcePath
+                        publisher = nodeIndex.publish('ttdMeshParser.py:TTD')
+                        for ttdFile in fileList:
+                            ttdFilePath = os.path.join(sourcePath, ttdFile)
+                            if inputReader.stripCompression(ttdFilePath).endswith("TTD_download_raw.txt"):
+                                print ttdFilePath
+                                with stageMetrics.stage(ttdFile, [ttdFilePath]) as stage:
+                                    with ttdParser.loadTTDNodes(ttdFilePath) as nodeTable:
+                                        nodeCount = ttdParser.writeTTDNodes(nodeTable, ttdNodeOutFile)
+                                        nodeSet = set(nodeTable.getColumn('TTDID'))
+                                    publisher.update(nodeSet)
+                                    stage.count(rowsOut=nodeCount)
+
+                                tempPath = inputReader.resolveInput(sourcePath + "/target-disease_TTD2016.txt")
+                                print tempPath
+                                with stageMetrics.stage(os.path.basename(tempPath), [tempPath]) as stage:
+                                    with ttdParser.loadTargetDisease(tempPath, nodeSet, ttdFilePath) as targetTable:
+                                        nodeCount2 = ttdParser.writeTargetDiseaseNodes(targetTable, targetDiseaseNodeOutFile)
+                                        publisher.update(targetTable.getColumn('TargetID'))
+                                    stage.count(rowsOut=nodeCount2)
+                            elif inputReader.stripCompression(ttdFilePath).endswith("Target-KEGGpathway_all.txt"):
+                                print ttdFilePath
+                                with stageMetrics.stage(ttdFile, [ttdFilePath]) as stage:
+                                    KEGGRelnCount = ttdParser.parseTargetKEGG(ttdFilePath, KEGGNodeOutFile, KEGGRelnOutFile)
+                                    stage.count(rowsOut=KEGGRelnCount)
+                                with ttdParser.loadPathways(ttdFilePath) as pathwayTable:
+                                    publisher.update(pathwayTable.getColumn('PathwayID'))
+                            elif inputReader.stripCompression(ttdFilePath).endswith("Target-wikipathway_all.txt"):
+                                print ttdFilePath
+                                with stageMetrics.stage(ttdFile, [ttdFilePath]) as stage:
+                                    wikiRelnCount = ttdParser.parseTargetWiki(ttdFilePath, wikiNodeOutFile, wikiRelnOutFile)
+                                    stage.count(rowsOut=wikiRelnCount)
+                                with ttdParser.loadPathways(ttdFilePath) as pathwayTable:
+                                    publisher.update(pathwayTable.getColumn('PathwayID'))
+
+                        print ("\n%s total Therapeutic Target Database nodes have been created." %
+                               (locale.format('%d', (nodeCount + nodeCount2), True)))
+                        print ("\n%s total Therapeutic Target Database relationships have been created." %
+                               (locale.format('%d', (KEGGRelnCount + wikiRelnCount), True)))
+                        for ttdOutFile in [ttdNodeOutFile, targetDiseaseNodeOutFile, KEGGNodeOutFile, KEGGRelnOutFile, wikiNodeOutFile, wikiRelnOutFile]:
+                            ttdOutFile.close()
+                        publisher.close()
+                        manifest.record('ttdMeshParser.py:TTD', buildManifest.listInputs(sourcePath), ttdVersion, ttdOutPaths)
+
+                    """ Medical Subject Headings Database (MeSH) """
+                    if sourcePath.endswith('MeSH'):
+                        meshVersion = buildManifest.getParserVersion(__file__, meshParser.__file__, chunkedIngest.__file__, parseCache.__file__,
+                                                                    nodeIndex.__file__, batchWriter.__file__, inputReader.__file__)
+                        meshOutPaths = [batchWriter.getOutputPath(outPath + name) for name in ['meshNodeOut.csv', 'meshRelnOut.csv']]
+                        if manifest.isCurrent('ttdMeshParser.py:MeSH', buildManifest.listInputs(sourcePath), meshVersion):
+                            print "\nMeSH is up to date, skipping"
+                            continue
+                        meshNodeOutFile, meshRelnOutFile = [batchWriter.openOutput(meshOutPath) for meshOutPath in meshOutPaths]
+                        meshNodeOutFile.write("Source_id:ID|Source|Term|Synonyms:string[]|Semantic_Type:string[]|Mesh_TreeNumber|:LABEL\n")
+                        meshRelnOutFile.write(":START_ID|source|:END_ID|Category|:TYPE\n")
+                        print "\n\n\n================================ PARSING NLM MEDICAL SUBJECT HEADINGS (MeSH) DATABASE ================================"
+                        print "\nProcessing files in:\n\t%s\n" % sourcePath
+                        finalCount = 0
+                        bigRelnDict = dict()
+                        sortedFiles = sorted(fileList, key=lambda meshFile: len(inputReader.stripCompression(meshFile)))
+                        for meshFile in sortedFiles:
+                            meshFilePath = os.path.join(sourcePath, meshFile)
+                            print "%s" % meshFilePath
+                            if not inputReader.stripCompression(meshFilePath).endswith('mtrees2016.bin'):
+                                with stageMetrics.stage(meshFile, [meshFilePath]) as stage:
+                                    treeRelnDict, fileNodeSet = meshParser.meshData(meshFilePath, meshNodeOutFile, workerCount)
+                                    stage.count(rowsOut=len(fileNodeSet))
+                                totalMeshNodeSet.update(fileNodeSet)
+                                bigRelnDict.update(treeRelnDict)
+                                finalCount += len(fileNodeSet)
+                                print "\t%s nodes have been created from this file\n" % locale.format('%d', len(fileNodeSet), True)
+                            else:
+                                with stageMetrics.stage(meshFile, [meshFilePath]) as stage:
+                                    relnCount = meshParser.parseTree(meshFilePath, bigRelnDict, meshRelnOutFile)
+                                    stage.count(rowsOut=relnCount)
+                                print "\t%s relationships have been created from this file\n" % locale.format('%d', relnCount, True)
+
+                        print ("\n%s total NLM MeSH nodes and %s total relationships have been created..." %
+                               (locale.format('%d', finalCount, True), locale.format('%d', relnCount, True)))
+                        meshNodeOutFile.close()
+                        meshRelnOutFile.close()
+                        with nodeIndex.publish('ttdMeshParser.py:MeSH') as publisher:
+                            publisher.update(totalMeshNodeSet)
+                        manifest.record('ttdMeshParser.py:MeSH', buildManifest.listInputs(sourcePath), meshVersion, meshOutPaths)
+            finally:
+                stageMetrics.finishRun()
+                nodeIndex.close()
 
 
 if __name__ == "__main__":
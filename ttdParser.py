@@ -5,6 +5,8 @@ import time
 import getopt
 import locale
 import os
+import inputReader
+import parseCache
 # import general
 from collections import defaultdict
 
@@ -89,6 +91,8 @@ Written by: Brandon Burciaga
 #                (locale.format('%d', (KEGGRelnCount + wikiRelnCount), True)))
 #         print "\nIt took %s seconds to create all TTD nodes and relationships\n" % duration
 
+PATHWAY_FIELDS = ['TTDID', 'PathwayID', 'PathwayName']
+
 
 def parseTTDNodes(ttdFilePath):
     """ Parses TTD_download_raw.txt for node information """
@@ -96,7 +100,7 @@ def parseTTDNodes(ttdFilePath):
     # and creates nodeDict[key][now_existing_key] = set(). Defaultdict(set) nested two levels.
     nodeDict = defaultdict(lambda: defaultdict(set))
     nodeSet = set()
-    with open(ttdFilePath, 'rU') as inFile:
+    with inputReader.openInput(ttdFilePath, 'rU') as inFile:
         for line in inFile:
             columns = line.strip().split('\t')
             if not len(columns) == 3:
@@ -107,6 +111,15 @@ def parseTTDNodes(ttdFilePath):
     return nodeDict, nodeSet
 
 
+def loadTTDNodes(ttdFilePath):
+    """
+    Returns parse cache table of TTD_download_raw.txt nodes parsed by parseTTDNodes(), unless cached.
+    Fields are TTDID then one per attribute, the table can be passed to writeTTDNodes() in place of nodeDict.
+    """
+    return parseCache.getTable(ttdFilePath, 'nodes', parseCache.getCodeVersion(parseTTDNodes),
+                               lambda: parseCache.getKeyedRecords('TTDID', parseTTDNodes(ttdFilePath)[0]))
+
+
 def writeTTDNodes(nodeDict, nodeOutFile):
     """ Iterates nodeDict and writes nodes to outfile """
     for k, v in nodeDict.iteritems():
@@ -125,7 +138,7 @@ def parseTargetDisease(tempPath, nodeSet):
     Adds above to targetDict
     """
     targetDict = defaultdict(lambda: defaultdict(set))
-    with open(tempPath, 'rU') as inFile:
+    with inputReader.openInput(tempPath, 'rU') as inFile:
         for line in inFile:
             columns = line.strip().split("\t")
             if not len(columns) == 5:
@@ -138,6 +151,16 @@ def parseTargetDisease(tempPath, nodeSet):
     return targetDict
 
 
+def loadTargetDisease(tempPath, nodeSet, ttdFilePath):
+    """
+    Returns parse cache table of target-disease_TTD2016.txt targets parsed by parseTargetDisease(), unless cached.
+    Targets are filtered on nodeSet, so the table is rebuilt when ttdFilePath (TTD_download_raw.txt) changes.
+    """
+    return parseCache.getTable(tempPath, 'targets', parseCache.getCodeVersion(parseTargetDisease),
+                               lambda: parseCache.getKeyedRecords('TargetID', parseTargetDisease(tempPath, nodeSet)),
+                               dependPaths=[ttdFilePath])
+
+
 def writeTargetDiseaseNodes(targetDict, targetDiseaseNodeOutFile):
     """ Iterates targetDict and writes more TTD nodes if they have not been created already by parseNodes """
     for k, v in targetDict.iteritems():
@@ -148,15 +171,28 @@ def writeTargetDiseaseNodes(targetDict, targetDiseaseNodeOutFile):
     return len(targetDict)
 
 
-def parseTargetKEGG(ttdFilePath, KEGGNodeOutFile, KEGGRelnOutFile):
-    """ Creates and writes relationships from disease target 'TTDID' to KEGG pathway ID 'hsa' """
-    KEGGCount = 0
-    nodeSet = set()
-    with open(ttdFilePath, 'rU') as inFile:
+def loadPathways(ttdFilePath):
+    """ Returns parse cache table of (TTDID, pathway ID, pathway name) rows parsed by readPathways(), unless cached """
+    return parseCache.getTable(ttdFilePath, 'pathways', parseCache.getCodeVersion(readPathways),
+                               lambda: (PATHWAY_FIELDS, readPathways(ttdFilePath)))
+
+
+def readPathways(ttdFilePath):
+    """ Yields (TTDID, pathway ID, pathway name) columns of Target-KEGGpathway_all.txt or Target-wikipathway_all.txt """
+    with inputReader.openInput(ttdFilePath, 'rU') as inFile:
         for line in inFile:
             columns = line.strip().split("\t")
             if not len(columns) == 3 or columns[0] == "TTDID":
                 continue
+            yield columns
+
+
+def parseTargetKEGG(ttdFilePath, KEGGNodeOutFile, KEGGRelnOutFile):
+    """ Creates and writes relationships from disease target 'TTDID' to KEGG pathway ID 'hsa' """
+    KEGGCount = 0
+    nodeSet = set()
+    with loadPathways(ttdFilePath) as pathwayTable:
+        for columns in pathwayTable.iterRows():
             KEGGNode = "%s|%s|KEGG|Pathway\n" % (columns[1], columns[2])
             nodeSet.add(KEGGNode)
             KEGGReln = "%s|Therapeutic_Target_Database|%s|part_of_pathway\n" % (columns[0], columns[1])
@@ -178,11 +214,8 @@ def parseTargetWiki(ttdFilePath, wikiNodeOutFile, wikiRelnOutFile):
     """
     wikiCount = 0
     nodeSet = set()
-    with open(ttdFilePath, 'rU') as inFile:
-        for line in inFile:
-            columns = line.strip().split('\t')
-            if not len(columns) == 3 or columns[0] == "TTDID":
-                continue
+    with loadPathways(ttdFilePath) as pathwayTable:
+        for columns in pathwayTable.iterRows():
             wikiCount += 2
             wikiNode = "%s|%s|Wiki|Pathway\n" % (columns[1], columns[2])
             nodeSet.add(wikiNode)
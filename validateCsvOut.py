@@ -0,0 +1,340 @@
+#!/usr/bin/python
+
+import os
+import sys
+import array
+import bisect
+import getopt
+import locale
+import itertools
+import multiprocessing
+import inputReader
+
+"""
+##################################################################################################################
+##########################################   Validate csv_out   ################################################
+##################################################################################################################
+
+* Checks the outfiles neo4j-import is given in neo4j.sh before the import is run: node IDs written twice, within
+    one node file or across node files (meshNodeOut.csv IDs and ontology MeSH IDs written without 'MESH:'),
+    and relationship endpoints missing from every node file.
+* Files are told apart by their neo4j-import header: node files have an ':ID' column, relationship files
+    ':START_ID' and ':END_ID' columns. Other files and entries of csv_out (parseCache/, nodeIndex.sqlite,
+    buildManifest.json, runReport.*.json) are ignored. Outfiles written with -z (.csv.gz, .out.gz) are read as well.
+* Each file is scanned by its own worker process. Node IDs are kept as their 64 bit hash() in sorted arrays,
+    8 bytes per ID, and merged into one sorted index. Relationship workers are forked once the index is built,
+    so they share it, and look endpoints up by bisection while streaming their file, remembering recent results.
+* A hash collision can hide a missing node or report a false duplicate, which is vanishingly rare at 64 bits;
+    samples are reported with their original IDs.
+* Prints per file counts with up to SAMPLE_COUNT sample IDs, exits with status 1 when anything was found.
+"""
+
+SAMPLE_COUNT = 5  # sample IDs reported per problem and file
+OUTFILE_SUFFIXES = ('.csv', '.out', '.csv.gz', '.out.gz')
+KEY_TYPECODE = 'l'  # C long, the type of hash()
+LOOKUP_CACHE_SIZE = 1 << 20  # endpoint IDs whose lookup result a relationship worker remembers, per column
+
+# Set right before the relationship pool is forked, read by checkRelationshipFile() in the workers.
+indexState = dict()
+
+
+def howToRun():
+    """
+    Instructs users how to use script.
+    opts/args: -h, help
+    """
+    print "\n\t\t * Run as: python /path/to/this/script.py -p /path/to/top/directory"
+    print "\n\t\t * Validates the outfiles in <top directory>/csv_out/"
+    print "\n\t\t * Optional: -d /path/to/other/outfiles adds another outfile directory (repeatable)"
+    print "\t\t * Optional: -j N scans N files at a time (default: number of CPUs)\n"
+    sys.exit()
+
+
+def listOutfiles(dirList):
+    """ Returns sorted paths of the node and relationship outfile candidates in the directories of dirList """
+    pathList = []
+    for outDir in dirList:
+        for name in sorted(os.listdir(outDir)):
+            path = os.path.join(outDir, name)
+            if name.endswith(OUTFILE_SUFFIXES) and os.path.isfile(path):
+                pathList.append(path)
+    return pathList
+
+
+def parseColumn(column):
+    """ Returns (type, ID group) of a neo4j-import header column: 'GeneID:START_ID' -> ('START_ID', '') """
+    name, separator, columnType = column.rpartition(':')
+    if not separator:
+        return '', ''
+    columnType = columnType.strip()
+    group = ''
+    if columnType.endswith(')') and '(' in columnType:
+        columnType, group = columnType[:-1].split('(', 1)
+    return columnType.upper(), group
+
+
+def getFileLayout(path):
+    """
+    Returns ('nodes', [(ID column, ID group)]) or ('relationships', [(START_ID column, group), (END_ID column, group)])
+    from the header of path, None for files neo4j-import would not take as either.
+    """
+    with inputReader.openInput(path) as inFile:
+        header = inFile.readline().rstrip('\r\n').split('|')
+    columnDict = dict()
+    for index, column in enumerate(header):
+        columnType, group = parseColumn(column)
+        columnDict.setdefault(columnType, (index, group))
+    if 'START_ID' in columnDict and 'END_ID' in columnDict:
+        return 'relationships', [columnDict['START_ID'], columnDict['END_ID']]
+    if 'ID' in columnDict:
+        return 'nodes', [columnDict['ID']]
+    return None
+
+
+def getKey(rawID, group):
+    """ Returns index key of rawID in ID group """
+    if group:
+        return hash(group + '\x00' + rawID)
+    return hash(rawID)
+
+
+def iterIDs(path, column):
+    """ Yields the column value of every row of path after the header, None for rows too short to have one """
+    with inputReader.openInput(path) as inFile:
+        inFile.readline()
+        for line in inFile:
+            fields = line.rstrip('\r\n').split('|', column + 1)
+            if len(fields) > column and fields[column]:
+                yield fields[column]
+            else:
+                yield None
+
+
+def collectSamples(path, column, group, wantedKeys):
+    """ Returns up to SAMPLE_COUNT distinct IDs of path whose key is in wantedKeys """
+    sampleList = []
+    if not wantedKeys:
+        return sampleList
+    for rawID in iterIDs(path, column):
+        if rawID is not None and rawID not in sampleList and getKey(rawID, group) in wantedKeys:
+            sampleList.append(rawID)
+            if len(sampleList) >= SAMPLE_COUNT:
+                break
+    return sampleList
+
+
+def scanNodeFile(fileArgs):
+    """
+    Pool worker: returns dict of row counts, the sorted unique ID keys of a node file as an array,
+    and the number and samples of IDs written more than once within it.
+    """
+    path, column, group = fileArgs
+    keyList = []
+    rowCount = 0
+    malformedCount = 0
+    for rawID in iterIDs(path, column):
+        rowCount += 1
+        if rawID is None:
+            malformedCount += 1
+            continue
+        keyList.append(getKey(rawID, group))
+    keySet = set(keyList)
+    duplicateSamples = []
+    duplicateCount = len(keyList) - len(keySet)
+    if duplicateCount:
+        seenKeys = set()
+        duplicateKeys = set()
+        for key in keyList:
+            if key in seenKeys:
+                duplicateKeys.add(key)
+            else:
+                seenKeys.add(key)
+        duplicateSamples = collectSamples(path, column, group, set(itertools.islice(duplicateKeys, SAMPLE_COUNT)))
+    keyList = None
+    return {'path': path, 'rows': rowCount, 'malformed': malformedCount, 'keys': array.array(KEY_TYPECODE, sorted(keySet)),
+            'duplicates': duplicateCount, 'duplicateSamples': duplicateSamples}
+
+
+def findCrossDuplicates(nodeResults):
+    """
+    Returns the sorted unique keys of every node file as one array, and fills in 'overlaps' of each result:
+    list of (earlier node file, number of shared IDs, keys of up to SAMPLE_COUNT of them).
+    """
+    seenKeys = set()
+    for position, result in enumerate(nodeResults):
+        result['overlaps'] = []
+        sharedKeys = seenKeys.intersection(result['keys'])
+        if sharedKeys:
+            for earlier in nodeResults[:position]:
+                pairKeys = sharedKeys.intersection(earlier['keys'])
+                if pairKeys:
+                    result['overlaps'].append((earlier['path'], len(pairKeys), set(itertools.islice(pairKeys, SAMPLE_COUNT))))
+        seenKeys.update(result['keys'])
+    return array.array(KEY_TYPECODE, sorted(seenKeys))
+
+
+def collectOverlapSamples(sampleArgs):
+    """ Pool worker: returns (path, list of (earlier node file, count, sample IDs)) for the overlaps of a node file """
+    path, column, group, overlaps = sampleArgs
+    return path, [(earlierPath, count, collectSamples(path, column, group, sampleKeys))
+                  for earlierPath, count, sampleKeys in overlaps]
+
+
+def checkRelationshipFile(fileArgs):
+    """
+    Pool worker: streams a relationship file against the node index inherited from the parent,
+    returns dict of row counts and the number and samples of rows whose START_ID or END_ID node is missing.
+    """
+    path, startColumn, startGroup, endColumn, endGroup = fileArgs
+    nodeKeys = indexState['keys']
+    keyCount = len(nodeKeys)
+    lastColumn = max(startColumn, endColumn)
+    rowCount = 0
+    malformedCount = 0
+    danglingCounts = [0, 0]
+    danglingSamples = [[], []]
+    endpoints = ((0, startColumn, startGroup, dict()), (1, endColumn, endGroup, dict()))
+    with inputReader.openInput(path) as inFile:
+        inFile.readline()
+        for line in inFile:
+            rowCount += 1
+            fields = line.rstrip('\r\n').split('|', lastColumn + 1)
+            if len(fields) <= lastColumn:
+                malformedCount += 1
+                continue
+            for side, column, group, foundDict in endpoints:
+                rawID = fields[column]
+                found = foundDict.get(rawID)
+                if found is None:
+                    key = getKey(rawID, group)
+                    position = bisect.bisect_left(nodeKeys, key)
+                    found = position < keyCount and nodeKeys[position] == key
+                    if len(foundDict) >= LOOKUP_CACHE_SIZE:
+                        foundDict.clear()
+                    foundDict[rawID] = found
+                if not found:
+                    danglingCounts[side] += 1
+                    sampleList = danglingSamples[side]
+                    if len(sampleList) < SAMPLE_COUNT and rawID not in sampleList:
+                        sampleList.append(rawID)
+    return {'path': path, 'rows': rowCount, 'malformed': malformedCount,
+            'danglingCounts': danglingCounts, 'danglingSamples': danglingSamples}
+
+
+def runPool(function, argList, workerCount):
+    """ Returns results of function over argList, largest files first, run on up to workerCount processes """
+    argList = sorted(argList, key=lambda args: os.path.getsize(args[0]), reverse=True)
+    if workerCount <= 1 or len(argList) <= 1:
+        return map(function, argList)
+    pool = multiprocessing.Pool(min(workerCount, len(argList)))
+    try:
+        resultList = pool.map(function, argList, chunksize=1)
+    except:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+    return resultList
+
+
+def formatCount(count):
+    """ Returns count with thousands separators """
+    return locale.format("%d", count, grouping=True)
+
+
+def formatSamples(sampleList):
+    """ Returns sample IDs for a report line """
+    if not sampleList:
+        return ''
+    return ' (e.g. %s)' % ', '.join(sampleList)
+
+
+def validate(dirList, workerCount):
+    """ Validates the outfiles of the directories in dirList, prints a report and returns the number of problems """
+    nodeArgs = []
+    relnArgs = []
+    for path in listOutfiles(dirList):
+        layout = getFileLayout(path)
+        if layout is None:
+            print "\tSkipping %s, no :ID or :START_ID/:END_ID columns in its header" % path
+        elif layout[0] == 'nodes':
+            nodeArgs.append((path,) + layout[1][0])
+        else:
+            relnArgs.append((path,) + layout[1][0] + layout[1][1])
+    problemCount = 0
+
+    print "\nScanning %d node files" % len(nodeArgs)
+    nodeResults = runPool(scanNodeFile, nodeArgs, workerCount)
+    nodeResults.sort(key=lambda result: result['path'])
+    indexState['keys'] = findCrossDuplicates(nodeResults)
+    columnDict = dict((args[0], args[1:]) for args in nodeArgs)
+    sampleArgs = [(result['path'],) + columnDict[result['path']] + (result['overlaps'],)
+                  for result in nodeResults if result['overlaps']]
+    overlapDict = dict(runPool(collectOverlapSamples, sampleArgs, workerCount))
+
+    print "\nNode files (%s unique IDs):\n" % formatCount(len(indexState['keys']))
+    for result in nodeResults:
+        print "\t%s: %s rows" % (os.path.basename(result['path']), formatCount(result['rows']))
+        if result['malformed']:
+            problemCount += result['malformed']
+            print "\t\t%s rows without an ID" % formatCount(result['malformed'])
+        if result['duplicates']:
+            problemCount += result['duplicates']
+            print "\t\t%s duplicate IDs within the file%s" % (formatCount(result['duplicates']),
+                                                               formatSamples(result['duplicateSamples']))
+        for earlierPath, count, sampleList in overlapDict.get(result['path'], []):
+            problemCount += count
+            print "\t\t%s IDs also in %s%s" % (formatCount(count), os.path.basename(earlierPath), formatSamples(sampleList))
+
+    print "\nChecking %d relationship files" % len(relnArgs)
+    relnResults = runPool(checkRelationshipFile, relnArgs, workerCount)
+    relnResults.sort(key=lambda result: result['path'])
+    print "\nRelationship files:\n"
+    for result in relnResults:
+        print "\t%s: %s rows" % (os.path.basename(result['path']), formatCount(result['rows']))
+        if result['malformed']:
+            problemCount += result['malformed']
+            print "\t\t%s rows without both endpoints" % formatCount(result['malformed'])
+        for side, endpoint in enumerate([':START_ID', ':END_ID']):
+            if result['danglingCounts'][side]:
+                problemCount += result['danglingCounts'][side]
+                print "\t\t%s rows whose %s node is missing from the node files%s" % (
+                    formatCount(result['danglingCounts'][side]), endpoint, formatSamples(result['danglingSamples'][side]))
+    indexState.clear()
+    return problemCount
+
+
+def main(argv):
+    """ If run as main script, function executes with user input """
+    dirList = []
+    workerCount = multiprocessing.cpu_count()
+    try:
+        opts, args = getopt.getopt(argv, "hp:d:j:", ["help", "dirPath=", "outDir=", "jobs="])
+        if len(argv) == 0:
+            howToRun()
+    except getopt.GetoptError:
+        howToRun()
+    for opt, arg in opts:
+        if opt in ['-h', '--help']:
+            howToRun()
+        elif opt in ("-p", "--dirPath"):
+            dirList.append(os.path.join(arg, "csv_out"))
+        elif opt in ("-d", "--outDir"):
+            dirList.append(arg)
+        elif opt in ("-j", "--jobs"):
+            workerCount = int(arg)
+    if not dirList:
+        howToRun()
+    locale.setlocale(locale.LC_ALL, "")
+    print "\n\n=====================================  VALIDATING outfiles ====================================="
+    print "\nProcessing files in:\n\n%s" % '\n'.join(dirList)
+    problemCount = validate(dirList, workerCount)
+    if problemCount:
+        print "\n%s problems found, see above\n" % formatCount(problemCount)
+        sys.exit(1)
+    print "\nNo duplicate IDs or dangling relationships found\n"
+
+if __name__ == "__main__":
+    main(sys.argv[1:])